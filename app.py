@@ -1,23 +1,37 @@
 import os
+import atexit # Para esperar a que se publique la última versión del índice al terminar
+import logging
+import time # Para medir la duración de las peticiones
 # Configurar la codificación de la consola a UTF-8 al inicio
 os.environ['PYTHONIOENCODING'] = 'utf-8'
 
-from flask import Flask, request, render_template, send_file, jsonify
+from flask import Flask, request, render_template, send_file, jsonify, Response, stream_with_context, g
 # AÑADE ESTA LÍNEA para importar CORS
 from flask_cors import CORS
-from llama_index.core import VectorStoreIndex, Document, Settings
-from llama_index.llms.google_genai.base import GoogleGenAI
-from llama_index.embeddings.google_genai.base import GoogleGenAIEmbedding
-import PyPDF2
 from io import BytesIO
-from reportlab.pdfgen import canvas
-import unicodedata # Para normalizar caracteres Unicode
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase import ttfonts # Para registrar fuentes TrueType
-from reportlab.lib.pagesizes import letter # Para definir el tamaño de página del PDF
-from reportlab.lib.units import inch # Para usar pulgadas como unidad de medida en el PDF
 import re # Para expresiones regulares en la extracción de ID
+import hashlib # Para calcular el hash del contenido de cada documento indexado
+import threading # Para serializar las modificaciones del índice
+import json # Para serializar los eventos SSE del chat en streaming
+import uuid # Para nombres únicos de los archivos subidos en la carpeta temporal
+import tempfile # Para escribir los PDF de exportación en lote fuera de memoria
+import functools # Para el decorador de las rutas de ingesta
+import importlib # Para importar los módulos pesados durante el calentamiento
+from concurrent.futures import ThreadPoolExecutor # Para extraer en paralelo los archivos de un lote
 from dotenv import load_dotenv
+from text_normalization import BoilerplateFilter, NORMALIZATION_VERSION
+from response_cache import ResponseCache
+from ingestion_jobs import IngestionJobManager, QueueFullError
+from patient_registry import PatientRegistry
+from holter_metrics import HolterMetricsStore, parse_holter_metrics, answer_metric_question
+from intents import CHAT_INTENTS
+from engine_snapshot import EngineSnapshotHolder, RETRIEVAL_MODES, clone_index
+from index_versions import IndexVersionPublisher, IndexVersionStore, IndexVersionWatcher
+from warmup import Warmup
+import metrics
+from metrics import stage_timer
+# LlamaIndex, los clientes de Gemini, PyPDF2, ReportLab y los módulos que dependen de ellos
+# (HEAVY_MODULES) se importan donde se usan: el calentamiento los carga en segundo plano.
 
 # Cargar variables de entorno desde el archivo .env
 # Asegúrate de que un archivo '.env' exista en la raíz de tu proyecto con GEMINI_API_KEY.
@@ -28,12 +42,22 @@ app = Flask(__name__)
 # Esto es crucial para que tu frontend React (ejecutándose en localhost) pueda comunicarse con el túnel.
 CORS(app) 
 
+# Nivel de los mensajes de registro: DEBUG (consultas, pacientes y nodos recuperados), INFO, WARNING o ERROR.
+app.config["LOG_LEVEL"] = os.getenv("LOG_LEVEL", "INFO").strip().upper()
+logging.basicConfig(
+    level=app.config["LOG_LEVEL"],
+    format="%(asctime)s %(levelname)s [%(process)d %(threadName)s] %(name)s: %(message)s",
+)
+logger = logging.getLogger(__name__)
+
 # 🔐 IMPORTANTE: Cargar la clave de API de Gemini desde una variable de entorno
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
 if not GEMINI_API_KEY:
-    print("ADVERTENCIA: La clave de API de Gemini no está configurada como variable de entorno.")
-    print("Asegúrate de establecer la variable de entorno 'GEMINI_API_KEY' en un archivo .env o en el entorno del sistema.")
+    logger.warning(
+        "La clave de API de Gemini no está configurada como variable de entorno. "
+        "Asegúrate de establecer la variable de entorno 'GEMINI_API_KEY' en un archivo .env o en el entorno del sistema."
+    )
     # En un entorno de producción, podrías querer lanzar una excepción o salir
     # exit(1)
 
@@ -41,12 +65,82 @@ if not GEMINI_API_KEY:
 UPLOAD_FOLDER = "uploads"
 INDEXED_TEXTS_FOLDER = "indexed_texts"
 FONTS_FOLDER = "fonts" # Carpeta para almacenar archivos de fuentes TTF
+STORAGE_FOLDER = "storage" # Carpeta donde se persisten el índice, el docstore y los vectores
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(INDEXED_TEXTS_FOLDER, exist_ok=True)
 os.makedirs(FONTS_FOLDER, exist_ok=True)
+os.makedirs(STORAGE_FOLDER, exist_ok=True)
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 app.config["INDEXED_TEXTS_FOLDER"] = INDEXED_TEXTS_FOLDER
 app.config["FONTS_FOLDER"] = FONTS_FOLDER
+app.config["STORAGE_FOLDER"] = STORAGE_FOLDER
+# Papel del proceso (ver DESPLIEGUE.md):
+# - "ingestor" (por defecto): procesa las subidas y publica las versiones del índice; también atiende el chat.
+# - "worker": solo atiende consultas; carga en modo lectura la versión publicada y la recarga al cambiar.
+app.config["APP_ROLE"] = os.getenv("APP_ROLE", "ingestor").strip().lower()
+if app.config["APP_ROLE"] not in ("ingestor", "worker"):
+    raise ValueError(f"APP_ROLE no válido: '{app.config['APP_ROLE']}' (usa 'ingestor' o 'worker').")
+IS_WORKER = app.config["APP_ROLE"] == "worker"
+# Versiones publicadas del índice (una carpeta por versión y un puntero CURRENT).
+app.config["INDEX_VERSIONS_FOLDER"] = os.path.join(STORAGE_FOLDER, "index_versions")
+app.config["INDEX_VERSIONS_KEPT"] = int(os.getenv("INDEX_VERSIONS_KEPT", "3"))
+# Cada cuántos segundos comprueba un worker si hay una versión nueva del índice.
+app.config["INDEX_RELOAD_INTERVAL"] = float(os.getenv("INDEX_RELOAD_INTERVAL", "2"))
+# Segundos que espera el ingestor al terminar a que se persista la última versión del índice.
+app.config["INDEX_PUBLISH_SHUTDOWN_TIMEOUT"] = float(os.getenv("INDEX_PUBLISH_SHUTDOWN_TIMEOUT", "60"))
+# Vectores en una matriz de numpy: "float32" o "int8" (4 veces menos memoria, similitud aproximada).
+app.config["VECTOR_QUANTIZATION"] = os.getenv("VECTOR_QUANTIZATION", "float32").strip().lower()
+# Recuperación de nodos para el chat: "hybrid" (vectores + BM25; solo BM25 para búsquedas exactas
+# como 'Sinemet' o 'Lisinopril 20mg'), "vector" (solo similitud de embeddings) o "lexical" (solo BM25).
+app.config["RETRIEVAL_MODE"] = os.getenv("RETRIEVAL_MODE", "hybrid").strip().lower()
+if app.config["RETRIEVAL_MODE"] not in RETRIEVAL_MODES:
+    raise ValueError(f"RETRIEVAL_MODE no válido: '{app.config['RETRIEVAL_MODE']}' (usa {', '.join(RETRIEVAL_MODES)}).")
+# Nodos que se envían a Gemini por consulta y peso de la similitud de vectores en la fusión (0-1).
+app.config["RETRIEVAL_TOP_K"] = int(os.getenv("RETRIEVAL_TOP_K", "2"))
+app.config["HYBRID_ALPHA"] = float(os.getenv("HYBRID_ALPHA", "0.5"))
+# Tokens (aprox.) del prompt de cada consulta a Gemini: sistema, instrucción y contexto recuperado.
+# El contexto se recorta por frases para no superarlo.
+app.config["PROMPT_TOKEN_BUDGET"] = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+# Caché de embeddings por hash de contenido: los fragmentos sin cambios nunca se vuelven a enviar a Gemini.
+app.config["EMBEDDING_CACHE_PATH"] = os.path.join(STORAGE_FOLDER, "embedding_cache.sqlite3")
+# Párrafos repetidos (membretes, avisos legales) aprendidos entre páginas y documentos.
+app.config["BOILERPLATE_MODEL_PATH"] = os.path.join(STORAGE_FOLDER, "boilerplate_model.json")
+# Caché de respuestas del chat (clics repetidos en las burbujas para el mismo paciente).
+app.config["RESPONSE_CACHE_SIZE"] = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+app.config["RESPONSE_CACHE_PATH"] = os.path.join(STORAGE_FOLDER, "response_cache.json")
+# Segundos que se agrupan los cambios de la caché antes de escribirla en disco.
+app.config["RESPONSE_CACHE_FLUSH_DELAY"] = float(os.getenv("RESPONSE_CACHE_FLUSH_DELAY", "5"))
+# Ingesta en segundo plano: hilos que extraen e indexan, y máximo de documentos pendientes en cola.
+app.config["INGEST_WORKERS"] = int(os.getenv("INGEST_WORKERS", "2"))
+app.config["INGEST_MAX_PENDING"] = int(os.getenv("INGEST_MAX_PENDING", "100"))
+# Extracción de PDF en paralelo por páginas (0 = un proceso por núcleo) y caché por hash del archivo.
+app.config["PDF_EXTRACTION_WORKERS"] = int(os.getenv("PDF_EXTRACTION_WORKERS", "0"))
+app.config["PDF_PAGE_TIMEOUT"] = float(os.getenv("PDF_PAGE_TIMEOUT", "30"))
+app.config["EXTRACTION_CACHE_FOLDER"] = os.path.join(STORAGE_FOLDER, "extraction_cache")
+# Fragmentos por llamada de embeddings (Gemini admite hasta 100 por petición batchEmbedContents).
+app.config["EMBED_BATCH_SIZE"] = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+# Límites de las llamadas a Gemini de cada proceso (LLM y embeddings): llamadas simultáneas, tokens de
+# entrada por minuto (0 = sin límite), reintentos de los 429/5xx con espera exponencial (segundos
+# inicial y máxima) y espera máxima por un hueco antes de responder 503.
+app.config["GEMINI_MAX_CONCURRENCY"] = int(os.getenv("GEMINI_MAX_CONCURRENCY", "4"))
+app.config["GEMINI_TOKENS_PER_MINUTE"] = int(os.getenv("GEMINI_TOKENS_PER_MINUTE", "0"))
+app.config["GEMINI_MAX_RETRIES"] = int(os.getenv("GEMINI_MAX_RETRIES", "4"))
+app.config["GEMINI_RETRY_BASE_DELAY"] = float(os.getenv("GEMINI_RETRY_BASE_DELAY", "1"))
+app.config["GEMINI_RETRY_MAX_DELAY"] = float(os.getenv("GEMINI_RETRY_MAX_DELAY", "30"))
+app.config["GEMINI_MAX_WAIT"] = float(os.getenv("GEMINI_MAX_WAIT", "30"))
+# Número máximo de archivos por subida en lote y de extracciones simultáneas dentro del lote.
+app.config["BATCH_MAX_FILES"] = int(os.getenv("BATCH_MAX_FILES", "100"))
+app.config["BATCH_EXTRACTION_THREADS"] = int(os.getenv("BATCH_EXTRACTION_THREADS", "4"))
+# Registro de pacientes (ID -> documentos, nombres y fechas) construido en la ingesta.
+app.config["PATIENT_REGISTRY_PATH"] = os.path.join(STORAGE_FOLDER, "patient_registry.json")
+# Medidas de Holter/ECG por paciente (series columnares) para responder sin pasar por Gemini.
+app.config["HOLTER_METRICS_PATH"] = os.path.join(STORAGE_FOLDER, "holter_metrics.npz")
+# Exportación de varias respuestas en un único PDF: procesos de renderizado (0 = núcleos de CPU) y máximo por lote.
+app.config["PDF_EXPORT_WORKERS"] = int(os.getenv("PDF_EXPORT_WORKERS", "0"))
+app.config["BATCH_EXPORT_MAX_RESPONSES"] = int(os.getenv("BATCH_EXPORT_MAX_RESPONSES", "50"))
+# Calentamiento (módulos pesados, fuente del PDF e índice) en un hilo: Flask responde mientras tanto y
+# /ready indica cuándo termina. Con WARMUP_IN_BACKGROUND=0 se hace al importar app, como antes.
+app.config["WARMUP_IN_BACKGROUND"] = os.getenv("WARMUP_IN_BACKGROUND", "1").strip().lower() not in ("0", "false", "no")
 
 # --- Configuración de fuente Unicode para ReportLab ---
 # Se recomienda usar una fuente TrueType (TTF) con soporte Unicode completo.
@@ -54,65 +148,152 @@ app.config["FONTS_FOLDER"] = FONTS_FOLDER
 FONT_NAME = "DejaVuSans" # Nombre que se usará para la fuente en ReportLab
 FONT_PATH = os.path.join(app.config["FONTS_FOLDER"], f"{FONT_NAME}.ttf")
 
-try:
-    # Registrar la fuente TrueType con ReportLab
-    pdfmetrics.registerFont(ttfonts.TTFont(FONT_NAME, FONT_PATH))
-    # Registrar la familia de fuentes para que ReportLab la reconozca correctamente
-    pdfmetrics.registerFontFamily(FONT_NAME, normal=FONT_NAME)
-    print(f"Fuente '{FONT_NAME}' registrada exitosamente desde '{FONT_PATH}'.")
-except Exception as e:
-    print(f"ERROR: No se pudo registrar la fuente '{FONT_NAME}' desde '{FONT_PATH}'.")
-    print(f"Asegúrate de que el archivo '{FONT_NAME}.ttf' esté en la carpeta '{FONTS_FOLDER}'.")
-    print(f"Detalles del error: {e}")
-    # Si la fuente no se puede registrar, la generación del PDF con caracteres especiales podría fallar.
-
 # Nombre de la fuente final que se usará para dibujar el texto en el PDF
 FINAL_FONT_NAME = FONT_NAME
+# Membrete de los PDF exportados: posiciones y anchos calculados una sola vez (get_pdf_letterhead()).
+_pdf_letterhead = None
+_pdf_letterhead_lock = threading.Lock()
 
-# Variable global para almacenar el motor de consulta de LlamaIndex
-# Se inicializa y reconstruye cuando se procesan documentos.
-global_query_engine = None
+def register_pdf_font():
+    """
+    Registra la fuente TrueType en ReportLab.
+    """
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase import ttfonts # Para registrar fuentes TrueType
+
+    try:
+        # Registrar la fuente TrueType con ReportLab
+        pdfmetrics.registerFont(ttfonts.TTFont(FONT_NAME, FONT_PATH))
+        # Registrar la familia de fuentes para que ReportLab la reconozca correctamente
+        pdfmetrics.registerFontFamily(FONT_NAME, normal=FONT_NAME)
+        logger.info(f"Fuente '{FONT_NAME}' registrada exitosamente desde '{FONT_PATH}'.")
+    except Exception as e:
+        logger.error(
+            f"No se pudo registrar la fuente '{FONT_NAME}' desde '{FONT_PATH}'. "
+            f"Asegúrate de que el archivo '{FONT_NAME}.ttf' esté en la carpeta '{FONTS_FOLDER}'. Detalles del error: {e}"
+        )
+        # Si la fuente no se puede registrar, la generación del PDF con caracteres especiales podría fallar.
+
+def get_pdf_letterhead():
+    """
+    Membrete de los PDF exportados. La primera llamada (normalmente la del calentamiento) registra
+    la fuente y calcula el membrete; las siguientes lo reutilizan.
+    """
+    global _pdf_letterhead
+    with _pdf_letterhead_lock:
+        if _pdf_letterhead is None:
+            from pdf_export import LetterheadTemplate
+            register_pdf_font()
+            _pdf_letterhead = LetterheadTemplate(FINAL_FONT_NAME)
+        return _pdf_letterhead
+
+# Snapshot vigente del índice de LlamaIndex (índice, índice léxico BM25, documentos y partición por paciente).
+# Se publica al arrancar y se sustituye de forma atómica tras cada ingesta o borrado: las consultas
+# del chat usan el snapshot que estaba vigente al empezar y nunca esperan a una reindexación.
+engine_snapshots = EngineSnapshotHolder({
+    "mode": app.config["RETRIEVAL_MODE"],
+    "similarity_top_k": app.config["RETRIEVAL_TOP_K"],
+    "alpha": app.config["HYBRID_ALPHA"],
+})
+# Las modificaciones del índice se serializan para que dos subidas simultáneas no se pisen.
+index_lock = threading.Lock()
+# Versiones del índice en disco: el ingestor las publica y los workers las cargan.
+index_versions = IndexVersionStore(app.config["INDEX_VERSIONS_FOLDER"], app.config["INDEX_VERSIONS_KEPT"])
+# Etapa de normalización entre la extracción del texto y la indexación.
+boilerplate_filter = BoilerplateFilter(app.config["BOILERPLATE_MODEL_PATH"])
+# Respuestas del chat por (mensaje normalizado, paciente, versión del índice).
+# En los workers la caché es solo en memoria: varios procesos no pueden reescribir el mismo archivo.
+response_cache = ResponseCache(
+    app.config["RESPONSE_CACHE_SIZE"],
+    None if IS_WORKER else app.config["RESPONSE_CACHE_PATH"],
+    app.config["RESPONSE_CACHE_FLUSH_DELAY"],
+)
+# Trabajos de ingesta: /procesar responde de inmediato y el documento se procesa en este pool.
+ingestion_jobs = IngestionJobManager(app.config["INGEST_WORKERS"], app.config["INGEST_MAX_PENDING"])
+# Paciente de cada documento ya registrado: al arrancar no se vuelve a buscar el ID en el texto.
+patient_registry = PatientRegistry(app.config["PATIENT_REGISTRY_PATH"])
+# Frecuencia cardiaca, extrasístoles y tensión arterial extraídas en la ingesta.
+holter_store = HolterMetricsStore(app.config["HOLTER_METRICS_PATH"])
+# Caché de embeddings (SQLite) y regulador de todas las llamadas salientes a Gemini del proceso
+# (concurrencia, cuota, reintentos). Dependen de LlamaIndex: los crea configure_llama_settings().
+embedding_cache = None
+gemini_governor = None
+llama_settings_lock = threading.Lock()
+# Pasos del calentamiento; se registran al final del módulo.
+warmup = Warmup()
+
+# Métricas de /metrics que se leen del estado del proceso al exportarlas. Las latencias por etapa y
+# los tokens se registran en cada módulo (metrics.STAGE_SECONDS, metrics.CHAT_TOKENS).
+metrics.REGISTRY.callback(
+    "sinusal_index_documents", "Documentos del snapshot vigente del índice.",
+    lambda: len(engine_snapshots.current().indexed_documents),
+)
+metrics.REGISTRY.callback(
+    "sinusal_index_nodes", "Nodos del snapshot vigente del índice.",
+    lambda: len(engine_snapshots.current().index.index_struct.nodes_dict) if engine_snapshots.current().index is not None else 0,
+)
+metrics.REGISTRY.callback("sinusal_index_version", "Versión del snapshot vigente del índice.", lambda: engine_snapshots.current().version)
+metrics.REGISTRY.callback("sinusal_ingest_queue_depth", "Trabajos de ingesta en cola o en ejecución.", ingestion_jobs.pending_count)
+metrics.REGISTRY.callback("sinusal_gemini_in_flight", "Llamadas a Gemini en curso en el proceso.", lambda: gemini_governor.in_flight if gemini_governor else 0)
+metrics.REGISTRY.callback(
+    "sinusal_cache_lookups_total", "Consultas a las cachés de respuestas y de embeddings por resultado.",
+    lambda: {
+        ("respuestas", "hit"): response_cache.hits, ("respuestas", "miss"): response_cache.misses,
+        ("embeddings", "hit"): embedding_cache.hits if embedding_cache else 0,
+        ("embeddings", "miss"): embedding_cache.misses if embedding_cache else 0,
+    },
+    ["cache", "result"], kind="counter",
+)
+metrics.REGISTRY.callback("sinusal_ready", "1 cuando el calentamiento del proceso ha terminado.", lambda: int(warmup.ready))
+
+# Patrones para buscar la cédula o ID en el texto de un documento. El más específico primero.
+# 1. Cédula: 7-9 dígitos
+PATIENT_ID_TEXT_PATTERNS = [
+    re.compile(r"(?:cédula|cedula|id|identificación|dni|nro expediente|número expediente)[:\s]*([0-9]{7,9})"),
+    re.compile(r"(?:paciente|cédula)\s*([0-9]{7,9})"),
+    re.compile(r"id[:\s]*([a-zA-Z0-9\-\.]+)"), # Patrón más general para IDs alfanuméricos
+]
+# ID de paciente mencionado en un mensaje del chat.
+PATIENT_ID_QUERY_PATTERN = re.compile(r"(?:paciente|cédula|cedula|id)[:\s]*([0-9]{7,9}|[a-zA-Z0-9\-\.]+)", re.IGNORECASE)
+WHITESPACE_PATTERN = re.compile(r"\s+")
 
 def extraer_texto_pdf(ruta):
     """
     Extrae texto de un archivo PDF dado su ruta.
+    Las páginas se extraen en paralelo y se unen con un separador de página; una página que
+    falla no invalida el resto del documento. El resultado se cachea por hash del archivo.
     Maneja posibles errores de lectura.
     """
-    texto = ""
+    from pdf_extraction import extract_pdf_pages
+
     try:
-        with open(ruta, "rb") as f:
-            lector = PyPDF2.PdfReader(f)
-            for pagina in lector.pages:
-                page_text = pagina.extract_text()
-                if page_text:
-                    texto += page_text
+        resultado = extract_pdf_pages(
+            ruta,
+            max_workers=app.config["PDF_EXTRACTION_WORKERS"] or None,
+            page_timeout=app.config["PDF_PAGE_TIMEOUT"],
+            cache_dir=app.config["EXTRACTION_CACHE_FOLDER"],
+        )
     except Exception as e:
-        print(f"Error al extraer texto del PDF {ruta}: {e}")
+        logger.error(f"Error al extraer texto del PDF {ruta}: {e}")
         return ""
-    return texto
+    if resultado.errors:
+        logger.warning(f"{len(resultado.errors)} de {len(resultado.pages)} páginas de {ruta} no se pudieron extraer.")
+    return resultado.text
 
 def extract_patient_id_from_text(text_content):
     """
     Intenta extraer el ID del paciente (ej. cédula) del contenido del texto.
     Se busca específicamente la cédula de 7-9 dígitos y otros patrones.
     """
-    cleaned_text = re.sub(r'\s+', ' ', text_content).lower()
+    cleaned_text = WHITESPACE_PATTERN.sub(' ', text_content).lower()
 
-    # Patrones para buscar la cédula o ID. El más específico primero.
-    # 1. Cédula: 7-9 dígitos
-    patterns = [
-        r"(?:cédula|cedula|id|identificación|dni|nro expediente|número expediente)[:\s]*([0-9]{7,9})",
-        r"(?:paciente|cédula)\s*([0-9]{7,9})",
-        r"id[:\s]*([a-zA-Z0-9\-\.]+)", # Patrón más general para IDs alfanuméricos
-    ]
-
-    for pattern in patterns:
-        match = re.search(pattern, cleaned_text)
+    for pattern in PATIENT_ID_TEXT_PATTERNS:
+        match = pattern.search(cleaned_text)
         if match:
             extracted_id = match.group(1).strip().upper()
-            print(f"DEBUG: extract_patient_id_from_text encontró ID: '{extracted_id}' con patrón: '{pattern}'")
+            logger.debug(f"extract_patient_id_from_text encontró ID: '{extracted_id}' con patrón: '{pattern.pattern}'")
             return extracted_id
-    print("DEBUG: extract_patient_id_from_text no encontró ID numérico o alfanumérico principal en el texto.")
+    logger.debug("extract_patient_id_from_text no encontró ID numérico o alfanumérico principal en el texto.")
     return None
 
 def extract_patient_id_from_filename(filename):
@@ -127,7 +308,7 @@ def extract_patient_id_from_filename(filename):
     match = re.search(r'([0-9]{7,9})', name_without_ext) # Buscar 7-9 dígitos
     if match:
         extracted_id = match.group(1).strip().upper()
-        print(f"DEBUG: extract_patient_id_from_filename encontró ID numérico: '{extracted_id}'")
+        logger.debug(f"extract_patient_id_from_filename encontró ID numérico: '{extracted_id}'")
         return extracted_id
 
     # Fallback al método original si no se encuentra un ID numérico en el nombre
@@ -136,20 +317,76 @@ def extract_patient_id_from_filename(filename):
         potential_id_part = parts[0].split('-')[0]
         if potential_id_part:
             extracted_id = potential_id_part.strip().upper()
-            print(f"DEBUG: extract_patient_id_from_filename (fallback) usó: '{extracted_id}'")
+            logger.debug(f"extract_patient_id_from_filename (fallback) usó: '{extracted_id}'")
             return extracted_id
-    print("DEBUG: extract_patient_id_from_filename no encontró un ID en el nombre.")
+    logger.debug("extract_patient_id_from_filename no encontró un ID en el nombre.")
     return "DESCONOCIDO" # Default if no ID found
 
-def load_all_indexed_documents(indexed_texts_folder):
+def compute_content_hash(text_content):
     """
-    Carga todos los documentos de texto previamente guardados con sus metadatos.
+    Calcula el hash SHA-256 del contenido de un documento.
+    Se usa para detectar si un archivo indexado ha cambiado y evitar reindexarlo.
+    """
+    return hashlib.sha256(text_content.encode("utf-8")).hexdigest()
+
+def indexed_content_hash(content):
     """
-    documents = []
-    print(f"\nCargando documentos de la carpeta de índice: {indexed_texts_folder}")
+    Hash con el que se identifica la versión indexada de un texto.
+    Las versiones de la normalización y del troceo por secciones forman parte del hash: si cambian
+    las reglas, el documento se reindexa.
+    """
+    from clinical_sections import SECTION_PARSER_VERSION
+
+    return f"v{NORMALIZATION_VERSION}.{SECTION_PARSER_VERSION}-{compute_content_hash(content)}"
+
+def resolve_document_patient(filename, content, content_hash):
+    """
+    ID de paciente de un documento. Si el registro de pacientes ya conoce esta versión del
+    documento se usa su ID; si no, se prioriza el ID del texto y después el del nombre de archivo.
+    """
+    entry = patient_registry.get_document(filename)
+    if entry is not None and entry["content_hash"] == content_hash:
+        return entry["patient_id"]
+    extracted_id_from_text = extract_patient_id_from_text(content)
+    return extracted_id_from_text if extracted_id_from_text else extract_patient_id_from_filename(filename)
+
+def build_indexed_document(filename, content, content_hash=None):
+    """
+    Construye el Document de LlamaIndex para un texto indexado.
+    El nombre de archivo se usa como doc_id para poder reemplazar o eliminar sus nodos más tarde.
+    El texto se normaliza (sin membretes ni avisos repetidos, tokens reparados) antes de trocearlo y embeberlo.
+    """
+    from llama_index.core import Document
+
+    content_hash = content_hash or indexed_content_hash(content)
+    patient_id = resolve_document_patient(filename, content, content_hash)
+
+    with stage_timer("normalizacion"):
+        normalized_text = boilerplate_filter.normalize(
+            content, document_id=filename, content_hash=content_hash, patient_id=patient_id
+        )
+    logger.debug(f"Normalización de '{filename}': {len(content)} -> {len(normalized_text)} caracteres.")
+
+    document = Document(
+        text=normalized_text,
+        doc_id=filename,
+        metadata={"filename": filename, "patient_id": patient_id, "content_hash": content_hash},
+    )
+    # El hash solo sirve para la gestión del índice: no debe influir en los embeddings ni en el prompt.
+    document.excluded_embed_metadata_keys = ["content_hash"]
+    document.excluded_llm_metadata_keys = ["content_hash"]
+    return document
+
+def load_indexed_texts(indexed_texts_folder):
+    """
+    Lee todos los textos previamente guardados: nombre de archivo -> contenido.
+    Los documentos se construyen después, solo los que haya que (re)indexar.
+    """
+    texts = {}
+    logger.info(f"Cargando documentos de la carpeta de índice: {indexed_texts_folder}")
     if not os.path.exists(indexed_texts_folder):
-        print(f"ADVERTENCIA: La carpeta '{indexed_texts_folder}' no existe.")
-        return []
+        logger.warning(f"La carpeta '{indexed_texts_folder}' no existe.")
+        return {}
 
     for filename in os.listdir(indexed_texts_folder):
         if filename.endswith(".txt"):
@@ -158,48 +395,492 @@ def load_all_indexed_documents(indexed_texts_folder):
                 with open(filepath, "r", encoding="utf-8") as f:
                     content = f.read()
                     if content:
-                        # Priorizar ID del texto si está presente, sino del nombre de archivo.
-                        extracted_id_from_text = extract_patient_id_from_text(content)
-                        patient_id = extracted_id_from_text if extracted_id_from_text else extract_patient_id_from_filename(filename)
-
-                        doc_to_add = Document(text=content, metadata={"filename": filename, "patient_id": patient_id})
-                        documents.append(doc_to_add)
-                        print(f"  - Documento cargado: '{filename}', ID Paciente FINAL en metadata: '{patient_id}'")
+                        texts[filename] = content
             except Exception as e:
-                print(f"Error al cargar documento indexado {filepath}: {e}")
-    print("-" * 50)
-    return documents
+                logger.error(f"Error al cargar documento indexado {filepath}: {e}")
+    return texts
+
+def sync_document_metadata(texts, content_hashes):
+    """
+    Pone al día el registro de pacientes y el almacén de medidas con la carpeta de textos
+    indexados: analiza los documentos nuevos o modificados y olvida los que ya no están.
+    Los documentos ya analizados con el mismo hash no se vuelven a leer.
+    """
+    registry_changed = False
+    metrics_changed = False
+    for filename, content in texts.items():
+        content_hash = content_hashes[filename]
+        entry = patient_registry.get_document(filename)
+        if entry is None or entry["content_hash"] != content_hash:
+            patient_id = resolve_document_patient(filename, content, content_hash)
+            patient_registry.register_document(filename, patient_id, content_hash, content, save=False)
+            registry_changed = True
+            logger.debug(f"Documento registrado: '{filename}', ID Paciente: '{patient_id}'")
+        if not holter_store.is_current(filename, content_hash):
+            patient_id = patient_registry.get_document(filename)["patient_id"]
+            holter_store.set_document(filename, patient_id, content_hash, parse_holter_metrics(content), save=False)
+            metrics_changed = True
+    for filename in list(patient_registry.documents):
+        if filename not in texts:
+            patient_registry.remove_document(filename, save=False)
+            registry_changed = True
+    for filename in list(holter_store.documents):
+        if filename not in texts:
+            holter_store.remove_document(filename, save=False)
+            metrics_changed = True
+    if registry_changed:
+        patient_registry.save()
+    if metrics_changed:
+        holter_store.save()
+
+def configure_llama_settings():
+    """
+    Configura el LLM y el modelo de embeddings de Gemini en los Settings globales de LlamaIndex.
+    La primera vez crea también la caché de embeddings y el regulador de llamadas a Gemini.
+    """
+    global embedding_cache, gemini_governor
+    from llama_index.core import Settings
+    from llama_index.llms.google_genai.base import GoogleGenAI
+    from llama_index.embeddings.google_genai.base import GoogleGenAIEmbedding
+    from clinical_sections import ClinicalSectionParser
+    from embedding_cache import CachedEmbedding, EmbeddingCacheStore
+    from gemini_client import GeminiGovernor, GovernedLLM, install_llm_latency_handler
+
+    if not GEMINI_API_KEY:
+        raise ValueError("La clave de API de Gemini no está configurada. Por favor, establece la variable de entorno GEMINI_API_KEY.")
+
+    with llama_settings_lock:
+        if embedding_cache is None:
+            embedding_cache = EmbeddingCacheStore(app.config["EMBEDDING_CACHE_PATH"])
+        if gemini_governor is None:
+            gemini_governor = GeminiGovernor(
+                max_concurrency=app.config["GEMINI_MAX_CONCURRENCY"],
+                tokens_per_minute=app.config["GEMINI_TOKENS_PER_MINUTE"],
+                max_retries=app.config["GEMINI_MAX_RETRIES"],
+                base_delay=app.config["GEMINI_RETRY_BASE_DELAY"],
+                max_delay=app.config["GEMINI_RETRY_MAX_DELAY"],
+                max_wait=app.config["GEMINI_MAX_WAIT"],
+            )
+        install_llm_latency_handler()
+
+        # Las llamadas pasan por gemini_governor, que también se encarga de los reintentos.
+        llm = GoogleGenAI(api_key=GEMINI_API_KEY, model="gemini-1.5-flash")
+        Settings.llm = GovernedLLM(llm, gemini_governor)
+        # Nodos por sección del informe (MOTIVO DE CONSULTA, ANTECEDENTES, TRATAMIENTO...).
+        Settings.node_parser = ClinicalSectionParser()
+
+        embed_model = GoogleGenAIEmbedding(
+            api_key=GEMINI_API_KEY,
+            model_name="models/text-embedding-004",
+            embed_batch_size=app.config["EMBED_BATCH_SIZE"],
+            retries=1,
+        )
+        Settings.embed_model = CachedEmbedding(embed_model, embedding_cache, governor=gemini_governor)
+
+def write_index_version(index, version_path):
+    """
+    Escribe el índice, el docstore y los vectores en la carpeta de una versión reservada.
+    """
+    with stage_timer("persistencia"):
+        index.storage_context.persist(persist_dir=version_path)
+
+# Las subidas y eliminaciones persisten el índice en segundo plano (solo la última versión pendiente).
+index_publisher = IndexVersionPublisher(index_versions, write_index_version)
+atexit.register(index_publisher.wait, app.config["INDEX_PUBLISH_SHUTDOWN_TIMEOUT"])
+
+def persist_index(index):
+    """
+    Guarda en disco el índice, el docstore y los vectores en una carpeta de versión nueva, para no
+    tener que embeber de nuevo al reiniciar. La versión no es visible hasta publish_index().
+    Devuelve el nombre de la versión.
+    """
+    # Una versión pendiente del publicador no debe publicarse después de esta.
+    index_publisher.wait()
+    version_name, version_path = index_versions.new_version()
+    try:
+        write_index_version(index, version_path)
+    except Exception:
+        index_versions.discard(version_name)
+        raise
+    return version_name
+
+def schedule_index_persistence(index):
+    """
+    Reserva una versión nueva con el registro de pacientes y las medidas actuales y deja que
+    index_publisher persista el índice y la publique en segundo plano. Se llama con index_lock
+    tomado, después de guardar el registro y las medidas, para que los archivos copiados
+    correspondan al índice. Si el proceso termina antes de publicarla no se pierde nada: los
+    textos indexados ya están en disco y el siguiente arranque los sincroniza con la última versión.
+    """
+    version_name, _ = index_versions.new_version()
+    index_versions.add_file(version_name, patient_registry.path)
+    index_versions.add_file(version_name, holter_store.path)
+    index_publisher.submit(version_name, index)
+
+def new_storage_context():
+    """
+    Almacenamiento de un índice nuevo, con los vectores en NumpyVectorStore.
+    """
+    from llama_index.core import StorageContext
+    from numpy_vector_store import NumpyVectorStore
+
+    return StorageContext.from_defaults(vector_store=NumpyVectorStore(quantization=app.config["VECTOR_QUANTIZATION"]))
+
+def open_storage_context(persist_dir, quantization=None):
+    """
+    Almacenamiento de un índice persistido. La matriz de vectores se abre con mmap salvo que haya
+    que convertirla (índice anterior en formato SimpleVectorStore u otra cuantización).
+    """
+    from llama_index.core import StorageContext
+    from numpy_vector_store import NumpyVectorStore
+
+    return StorageContext.from_defaults(
+        persist_dir=persist_dir, vector_store=NumpyVectorStore.from_persist_dir(persist_dir, quantization)
+    )
+
+def published_index_needs_upgrade():
+    """
+    True si la versión publicada no existe o no está en el formato configurado (vectores de numpy
+    con la cuantización de VECTOR_QUANTIZATION): en ese caso el ingestor la vuelve a persistir.
+    """
+    from numpy_vector_store import NumpyVectorStore
+
+    version_name = index_versions.current_name()
+    if version_name is None:
+        return True
+    return NumpyVectorStore.persisted_quantization(index_versions.path_for(version_name)) != app.config["VECTOR_QUANTIZATION"]
+
+def load_persisted_index():
+    """
+    Carga la versión publicada del índice o, si todavía no hay ninguna, el índice persistido
+    directamente en la carpeta de almacenamiento (formato anterior a las versiones).
+    Devuelve None si no existe o si no se puede leer (en ese caso se reconstruye desde los textos).
+    """
+    from llama_index.core import load_index_from_storage
+
+    version_name = index_versions.current_name()
+    persist_dir = index_versions.path_for(version_name) if version_name else app.config["STORAGE_FOLDER"]
+    if not os.path.exists(os.path.join(persist_dir, "docstore.json")):
+        return None
+    try:
+        return load_index_from_storage(open_storage_context(persist_dir, app.config["VECTOR_QUANTIZATION"]))
+    except Exception as e:
+        logger.warning(f"No se pudo cargar el índice persistido en '{persist_dir}', se reconstruirá: {e}")
+        return None
+
+def publish_index(index, indexed, affected_patient_ids=(), version_name=None):
+    """
+    Publica un snapshot nuevo con el índice ya modificado e invalida las respuestas cacheadas
+    de los pacientes afectados (las claves de la caché también incluyen la versión del índice).
+    Si el índice se ha persistido en version_name, la versión se completa con el registro de
+    pacientes y las medidas y pasa a ser la vigente para los workers.
+    """
+    if version_name is not None:
+        index_versions.add_file(version_name, patient_registry.path)
+        index_versions.add_file(version_name, holter_store.path)
+        index_versions.publish(version_name)
+    snapshot = engine_snapshots.publish(
+        index, indexed, {ref_doc_id: info.metadata.get("patient_id") for ref_doc_id, info in index.ref_doc_info.items()}
+    )
+    for patient_id in affected_patient_ids:
+        response_cache.invalidate_patient(patient_id)
+    return snapshot
 
 def initialize_global_query_engine():
-    global global_query_engine
-    all_documents = load_all_indexed_documents(app.config["INDEXED_TEXTS_FOLDER"])
+    """
+    Carga el índice persistido y lo sincroniza con la carpeta de textos indexados.
+    Solo se embeben los documentos nuevos o modificados; si no hay índice persistido se construye
+    desde los textos (la caché de embeddings evita volver a pagar los fragmentos ya conocidos).
+    Las subidas posteriores publican snapshots nuevos del índice de forma incremental.
+    """
+    from llama_index.core import VectorStoreIndex
 
-    if not all_documents:
-        print("No se encontraron documentos para la indexación inicial. El chatbot no estará disponible hasta que se procese un documento.")
-        global_query_engine = None
+    texts = load_indexed_texts(app.config["INDEXED_TEXTS_FOLDER"])
+    content_hashes = {filename: indexed_content_hash(content) for filename, content in texts.items()}
+    sync_document_metadata(texts, content_hashes)
+
+    if not texts:
+        logger.warning("No se encontraron documentos para la indexación inicial. El chatbot no estará disponible hasta que se procese un documento.")
         return
 
     try:
-        if not GEMINI_API_KEY:
-            raise ValueError("La clave de API de Gemini no está configurada. Por favor, establece la variable de entorno GEMINI_API_KEY.")
+        configure_llama_settings()
+
+        with index_lock:
+            index = load_persisted_index()
+            if index is None:
+                all_documents = [
+                    build_indexed_document(filename, content, content_hashes[filename]) for filename, content in texts.items()
+                ]
+                index = VectorStoreIndex.from_documents(all_documents, storage_context=new_storage_context())
+                indexed = dict(content_hashes)
+                changed = True
+                logger.info(f"Índice construido desde los textos indexados ({len(all_documents)} documentos).")
+            else:
+                indexed = {ref_doc_id: info.metadata.get("content_hash") for ref_doc_id, info in index.ref_doc_info.items()}
+                changed = False
+                for filename, content in texts.items():
+                    if indexed.get(filename) == content_hashes[filename]:
+                        continue
+                    doc = build_indexed_document(filename, content, content_hashes[filename])
+                    if doc.doc_id in indexed:
+                        index.delete_ref_doc(doc.doc_id, delete_from_docstore=True)
+                    index.insert(doc)
+                    indexed[doc.doc_id] = doc.metadata["content_hash"]
+                    changed = True
+                    logger.info(f"Documento nuevo o modificado sincronizado: '{doc.doc_id}'")
+                for ref_doc_id in list(indexed):
+                    if ref_doc_id not in texts:
+                        index.delete_ref_doc(ref_doc_id, delete_from_docstore=True)
+                        del indexed[ref_doc_id]
+                        changed = True
+                        logger.info(f"Documento ya no presente en '{app.config['INDEXED_TEXTS_FOLDER']}' eliminado del índice: '{ref_doc_id}'")
+                logger.info("Índice persistido cargado.")
+
+            # Sin versión publicada o en otro formato (primer arranque, índice anterior) también se persiste.
+            version_name = persist_index(index) if changed or published_index_needs_upgrade() else None
+            snapshot = publish_index(index, indexed, version_name=version_name)
+        logger.info(f"Motor de consulta de LlamaIndex inicializado exitosamente con {len(snapshot.indexed_documents)} documentos.")
+    except Exception as e:
+        # El snapshot vigente (vacío al arrancar) sigue publicado.
+        logger.exception(f"No se pudo inicializar el motor de consulta de LlamaIndex globalmente: {e}")
 
-        llm = GoogleGenAI(api_key=GEMINI_API_KEY, model="gemini-1.5-flash")
-        Settings.llm = llm
+def upsert_indexed_documents(items):
+    """
+    Inserta o reemplaza varios documentos en el índice sin volver a embeber el resto del corpus.
+    items es una lista de pares (nombre de archivo indexado, texto). Los documentos sin cambios
+    (mismo hash) se omiten antes de normalizarlos; los fragmentos de todos los demás se embeben
+    juntos, en lotes grandes.
+    Los cambios se aplican sobre una copia del índice publicado y se publican como un snapshot
+    nuevo al terminar; si algo falla, el chat sigue usando el snapshot anterior. El índice se
+    persiste en segundo plano (schedule_index_persistence).
+    Devuelve un diccionario nombre de archivo -> "sin cambios", "insertado" o "reemplazado".
+    """
+    from llama_index.core import VectorStoreIndex, Settings
+    from llama_index.core.ingestion import run_transformations
+
+    contents = dict(items)
+    content_hashes = {filename: indexed_content_hash(content) for filename, content in items}
+    # Primera comprobación sin bloqueo: los documentos sin cambios no pasan por la normalización.
+    indexed_documents = engine_snapshots.current().indexed_documents
+    documents = [
+        build_indexed_document(filename, content, content_hashes[filename])
+        for filename, content in items
+        if indexed_documents.get(filename) != content_hashes[filename]
+    ]
 
-        embed_model = GoogleGenAIEmbedding(api_key=GEMINI_API_KEY, model_name="models/text-embedding-004")
-        Settings.embed_model = embed_model
+    with index_lock:
+        snapshot = engine_snapshots.current()
+        actions = {}
+        pending_documents = []
+        for filename, content_hash in content_hashes.items():
+            if snapshot.index is not None and snapshot.indexed_documents.get(filename) == content_hash:
+                logger.info(f"Documento '{filename}' sin cambios (hash {content_hash[:12]}), no se reindexa.")
+                actions[filename] = "sin cambios"
+        for document in documents:
+            filename = document.doc_id
+            if filename in actions:
+                continue
+            actions[filename] = "reemplazado" if filename in snapshot.indexed_documents else "insertado"
+            pending_documents.append(document)
+
+        if not pending_documents:
+            return actions
+
+        with stage_timer("indexacion"):
+            if snapshot.index is None:
+                configure_llama_settings()
+                index = VectorStoreIndex.from_documents(pending_documents, storage_context=new_storage_context())
+            else:
+                index = clone_index(snapshot.index)
+                for document in pending_documents:
+                    if document.doc_id in snapshot.indexed_documents:
+                        # Eliminar los nodos antiguos del documento antes de insertar la nueva versión.
+                        index.delete_ref_doc(document.doc_id, delete_from_docstore=True)
+                # Trocear todos los documentos y embeber sus nodos de una vez (en lotes de embed_batch_size).
+                nodes = run_transformations(pending_documents, Settings.transformations)
+                index.insert_nodes(nodes)
+
+        indexed = dict(snapshot.indexed_documents)
+        affected_patient_ids = set()
+        for document in pending_documents:
+            filename = document.doc_id
+            indexed[filename] = document.metadata["content_hash"]
+            affected_patient_ids.add(snapshot.document_patients.get(filename))
+            affected_patient_ids.add(document.metadata["patient_id"])
+            patient_registry.register_document(
+                filename, document.metadata["patient_id"], document.metadata["content_hash"], contents[filename], save=False
+            )
+            holter_store.set_document(
+                filename, document.metadata["patient_id"], document.metadata["content_hash"],
+                parse_holter_metrics(contents[filename]), save=False,
+            )
+            logger.info(f"Documento '{filename}' {actions[filename]} en el índice (ID Paciente: '{document.metadata['patient_id']}').")
+        patient_registry.save()
+        holter_store.save()
+        publish_index(index, indexed, affected_patient_ids - {None})
+        schedule_index_persistence(index)
+        return actions
+
+def upsert_indexed_document(filename, content):
+    """
+    Inserta o reemplaza un único documento en el índice.
+    Devuelve "sin cambios", "insertado" o "reemplazado".
+    """
+    return upsert_indexed_documents([(filename, content)])[filename]
 
-        index = VectorStoreIndex.from_documents(all_documents)
-        global_query_engine = index.as_query_engine()
-        print(f"Motor de consulta de LlamaIndex inicializado/reconstruido exitosamente con {len(all_documents)} documentos.")
-    except Exception as e:
-        print(f"ERROR: No se pudo inicializar el motor de consulta de LlamaIndex globalmente: {e}")
-        import traceback
-        traceback.print_exc()
-        global_query_engine = None
+def remove_indexed_document(filename):
+    """
+    Elimina del índice los nodos de un documento (sobre una copia que se publica al terminar).
+    Devuelve False si el documento no estaba indexado.
+    """
+    with index_lock:
+        snapshot = engine_snapshots.current()
+        if snapshot.index is None or filename not in snapshot.indexed_documents:
+            return False
+
+        index = clone_index(snapshot.index)
+        index.delete_ref_doc(filename, delete_from_docstore=True)
+        indexed = dict(snapshot.indexed_documents)
+        del indexed[filename]
+        patient_id = snapshot.document_patients.get(filename)
+        patient_registry.remove_document(filename)
+        holter_store.remove_document(filename)
+        publish_index(index, indexed, {patient_id} - {None})
+        schedule_index_persistence(index)
+        logger.info(f"Documento '{filename}' eliminado del índice.")
+        return True
+
+def indexed_text_filename_for(filename):
+    """
+    Devuelve el nombre del archivo .txt indexado que corresponde a un archivo subido.
+    """
+    return f"{os.path.splitext(os.path.basename(filename))[0]}.txt"
+
+def load_published_version(version_name):
+    """
+    Worker: carga en modo lectura una versión publicada por el ingestor (índice, registro de
+    pacientes y medidas) y la publica como snapshot. No se embebe nada: los vectores están en disco.
+    Las consultas en curso terminan con el snapshot anterior.
+    """
+    from llama_index.core import load_index_from_storage
+
+    version_path = index_versions.path_for(version_name)
+    # Sin conversión: la matriz de vectores queda en mmap y se comparte entre los workers.
+    index = load_index_from_storage(open_storage_context(version_path))
+    patient_registry.reload(os.path.join(version_path, os.path.basename(patient_registry.path)))
+    holter_store.reload(os.path.join(version_path, os.path.basename(holter_store.path)))
+    indexed = {ref_doc_id: info.metadata.get("content_hash") for ref_doc_id, info in index.ref_doc_info.items()}
+    publish_index(index, indexed)
+    logger.info(f"Versión del índice '{version_name}' cargada.")
+
+# En los workers, vigila el puntero CURRENT y recarga el índice cuando el ingestor publica una versión.
+index_version_watcher = IndexVersionWatcher(index_versions, load_published_version, app.config["INDEX_RELOAD_INTERVAL"])
+
+# Módulos que tardan en importarse (LlamaIndex, clientes de Gemini, PyPDF2, ReportLab) y los del
+# proyecto que dependen de ellos. Se importan en el primer paso del calentamiento.
+HEAVY_MODULES = (
+    "llama_index.core",
+    "llama_index.llms.google_genai.base",
+    "llama_index.embeddings.google_genai.base",
+    "numpy_vector_store",
+    "clinical_sections",
+    "lexical_index",
+    "context_assembly",
+    "chat_prompts",
+    "embedding_cache",
+    "gemini_client",
+    "pdf_extraction",
+    "pdf_export",
+)
+# Segundos que se sugieren al cliente (Retry-After) mientras el proceso se calienta.
+WARMUP_RETRY_AFTER = 5
+
+def import_heavy_modules():
+    for module_name in HEAVY_MODULES:
+        importlib.import_module(module_name)
+
+def load_startup_index():
+    """
+    Último paso del calentamiento. Ingestor: carga y sincroniza el índice. Worker: configura Gemini,
+    carga la versión publicada y arranca la vigilancia de versiones nuevas.
+    """
+    with app.app_context():
+        if IS_WORKER:
+            try:
+                configure_llama_settings()
+            except Exception as e:
+                logger.error(f"No se pudo configurar Gemini en el worker: {e}")
+            if not index_version_watcher.check():
+                logger.warning("Todavía no hay ninguna versión del índice publicada; se cargará en cuanto el ingestor la publique.")
+            index_version_watcher.start()
+        else:
+            initialize_global_query_engine()
+
+warmup.add_step("modulos", import_heavy_modules)
+warmup.add_step("pdf", get_pdf_letterhead)
+warmup.add_step("indice", load_startup_index)
+# Los pools de procesos (forkserver/spawn) vuelven a importar el script principal como __mp_main__;
+# en esos procesos no se calienta nada.
+if __name__ != "__mp_main__":
+    warmup.start(background=app.config["WARMUP_IN_BACKGROUND"])
+
+def ingestion_route(view):
+    """
+    Las rutas que modifican el índice solo se atienden en el proceso de ingesta.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if IS_WORKER:
+            return jsonify({
+                "error": "Este proceso solo atiende consultas (APP_ROLE=worker). Envía los documentos al proceso de ingesta."
+            }), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.before_request
+def start_request_timer():
+    g.request_started_at = time.perf_counter()
+
+@app.after_request
+def observe_request_duration(response):
+    """
+    Duración de cada petición por ruta. En /chat/stream mide hasta el envío de las cabeceras: la
+    generación de la respuesta se mide en las etapas 'recuperacion' y 'llm'.
+    """
+    started_at = g.pop("request_started_at", None)
+    if started_at is not None:
+        endpoint = request.url_rule.rule if request.url_rule is not None else "desconocida"
+        metrics.REQUEST_SECONDS.observe(
+            time.perf_counter() - started_at, endpoint=endpoint, method=request.method, status=response.status_code
+        )
+    return response
 
-with app.app_context():
-    initialize_global_query_engine()
+@app.route("/ready", methods=["GET"])
+def ready():
+    """
+    Disponibilidad del proceso para balanceadores y comprobaciones de salud: 200 cuando ha terminado
+    el calentamiento, 503 (con Retry-After mientras continúa) y el progreso en otro caso.
+    """
+    snapshot = engine_snapshots.current()
+    body = {
+        "listo": warmup.ready,
+        "calentamiento": warmup.to_dict(),
+        "papel": app.config["APP_ROLE"],
+        "version_indice": snapshot.version,
+        "documentos": len(snapshot.indexed_documents),
+    }
+    if warmup.ready:
+        return jsonify(body)
+    headers = {} if warmup.finished else {"Retry-After": str(WARMUP_RETRY_AFTER)}
+    return jsonify(body), 503, headers
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """
+    Métricas del proceso en formato de texto de Prometheus.
+    """
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
 
 @app.route("/", methods=["GET"])
 def index():
@@ -207,8 +888,136 @@ def index():
     # Solo se usa aquí para pruebas locales o si no hay un servidor frontend separado
     return render_template("index.html")
 
+def extract_uploaded_text(ruta_archivo, original_filename):
+    """
+    Extrae el texto de un archivo subido (PDF o texto plano).
+    """
+    with stage_timer("extraccion"):
+        if original_filename.lower().endswith(".pdf"):
+            return extraer_texto_pdf(ruta_archivo)
+        try:
+            with open(ruta_archivo, "r", encoding="utf-8") as f:
+                return f.read()
+        except Exception as e:
+            raise RuntimeError(f"Error al leer el archivo de texto: {e}") from e
+
+def save_indexed_text(indexed_text_filename, texto_extraido):
+    """
+    Guarda el texto extraído en la carpeta de documentos indexados.
+    """
+    indexed_text_filepath = os.path.join(app.config["INDEXED_TEXTS_FOLDER"], indexed_text_filename)
+    try:
+        with open(indexed_text_filepath, "w", encoding="utf-8") as f:
+            f.write(texto_extraido)
+        logger.debug(f"Texto guardado/actualizado en '{indexed_text_filepath}'")
+    except Exception as e:
+        logger.error(f"Error al guardar el texto extraído para indexación: {e}")
+
+def save_upload(archivo):
+    """
+    Guarda un archivo subido en la carpeta temporal y devuelve (ruta, nombre original).
+    """
+    original_filename = os.path.basename(archivo.filename)
+    # Prefijo único para que dos subidas simultáneas del mismo nombre no se pisen en la carpeta temporal.
+    ruta_archivo = os.path.join(app.config["UPLOAD_FOLDER"], f"{uuid.uuid4().hex}_{original_filename}")
+    archivo.save(ruta_archivo)
+    return ruta_archivo, original_filename
+
+def remove_upload(ruta_archivo):
+    try:
+        os.remove(ruta_archivo)
+    except Exception as e:
+        logger.warning(f"Error al eliminar el archivo temporal {ruta_archivo}: {e}")
+
+def process_uploaded_document(job, ruta_archivo, original_filename):
+    """
+    Trabajo de ingesta en segundo plano: extrae el texto del archivo subido, lo guarda en la
+    carpeta de documentos indexados y actualiza el índice. Lanza una excepción si algo falla
+    para que el trabajo quede marcado como error.
+    """
+    try:
+        job.update("extrayendo texto", 10)
+        texto_extraido = extract_uploaded_text(ruta_archivo, original_filename)
+
+        logger.debug(f"Archivo subido: '{original_filename}' (trabajo {job.id}), {len(texto_extraido)} caracteres extraídos.")
+
+        # Guardar el texto extraído en la carpeta de documentos indexados
+        job.update("guardando texto", 40)
+        indexed_text_filename = indexed_text_filename_for(original_filename)
+        save_indexed_text(indexed_text_filename, texto_extraido)
+
+        # Insertar o reemplazar solo los nodos de este documento en el índice vivo
+        job.update("indexando", 60)
+        if not texto_extraido:
+            # Igual que al cargar la carpeta, un texto vacío no se indexa (y retira la versión anterior si la había).
+            remove_indexed_document(indexed_text_filename)
+            raise RuntimeError(f"No se pudo extraer texto de '{original_filename}'.")
+        action = upsert_indexed_document(indexed_text_filename, texto_extraido)
+        # El ID se resuelve una sola vez al construir el documento (texto, o nombre de archivo como respaldo).
+        patient_id = engine_snapshots.current().document_patients.get(indexed_text_filename)
+
+        job.update("completado", 100, f"Documento procesado (Paciente ID: {patient_id}) y asistente actualizado. Ahora puedes analizar.")
+        return {"patient_id": patient_id, "indexed_filename": indexed_text_filename, "accion": action}
+    finally:
+        remove_upload(ruta_archivo)
+
+def process_uploaded_batch(job, uploads):
+    """
+    Trabajo de ingesta de un lote: extrae los archivos en paralelo, guarda sus textos e inserta
+    todos los documentos en el índice de una sola vez (embeddings en lotes grandes y una única
+    persistencia). Devuelve el resultado de cada archivo.
+    """
+    results = {original_filename: {"estado": "pendiente"} for _, original_filename in uploads}
+    try:
+        job.update("extrayendo texto", 10)
+
+        def extract(upload):
+            ruta_archivo, original_filename = upload
+            try:
+                return original_filename, extract_uploaded_text(ruta_archivo, original_filename), None
+            except Exception as e:
+                return original_filename, "", str(e)
+
+        max_threads = max(1, min(app.config["BATCH_EXTRACTION_THREADS"], len(uploads)))
+        with ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="extraccion-lote") as executor:
+            extracted = list(executor.map(extract, uploads))
+
+        job.update("guardando textos", 40)
+        items = []
+        for original_filename, texto_extraido, error in extracted:
+            indexed_text_filename = indexed_text_filename_for(original_filename)
+            if error or not texto_extraido:
+                results[original_filename] = {"estado": "error", "error": error or f"No se pudo extraer texto de '{original_filename}'."}
+                continue
+            save_indexed_text(indexed_text_filename, texto_extraido)
+            items.append((indexed_text_filename, texto_extraido))
+            results[original_filename] = {"estado": "extraido", "indexed_filename": indexed_text_filename}
+
+        job.update("indexando", 60)
+        if items:
+            actions = upsert_indexed_documents(items)
+            document_patients = engine_snapshots.current().document_patients
+            for original_filename, result in results.items():
+                indexed_text_filename = result.get("indexed_filename")
+                if indexed_text_filename in actions:
+                    result["estado"] = "completado"
+                    result["accion"] = actions[indexed_text_filename]
+                    result["patient_id"] = document_patients.get(indexed_text_filename)
+
+        failed = sum(1 for result in results.values() if result["estado"] == "error")
+        job.update("completado", 100, f"Lote procesado: {len(results) - failed} documentos indexados, {failed} con error.")
+        return results
+    finally:
+        for ruta_archivo, _ in uploads:
+            remove_upload(ruta_archivo)
+
 @app.route("/procesar", methods=["POST"])
+@ingestion_route
 def procesar():
+    """
+    Acepta un documento y lo procesa en segundo plano.
+    Responde inmediatamente con 202 y el ID del trabajo; el progreso se consulta en /jobs/<job_id>.
+    """
     if 'documento' not in request.files:
         return "No se ha subido ningún archivo", 400
 
@@ -217,341 +1026,569 @@ def procesar():
     if not archivo.filename:
         return "Nombre de archivo vacío", 400
 
-    ruta_archivo = os.path.join(app.config["UPLOAD_FOLDER"], archivo.filename)
     try:
-        archivo.save(ruta_archivo)
+        ruta_archivo, original_filename = save_upload(archivo)
     except Exception as e:
-        print(f"Error al guardar el archivo subido: {e}")
+        logger.error(f"Error al guardar el archivo subido: {e}")
         return "Error al guardar el archivo", 500
 
-    texto_extraido = ""
-    if archivo.filename.lower().endswith(".pdf"):
-        texto_extraido = extraer_texto_pdf(ruta_archivo)
+    try:
+        job = ingestion_jobs.submit(original_filename, process_uploaded_document, ruta_archivo, original_filename)
+    except QueueFullError as e:
+        remove_upload(ruta_archivo)
+        return jsonify({"response": f"El servidor está ocupado procesando documentos. {e} Inténtalo más tarde."}), 503
+
+    return jsonify({
+        "response": f"Documento '{original_filename}' recibido. Procesando en segundo plano.",
+        "job_id": job.id,
+        "estado": job.status,
+        "status_url": f"/jobs/{job.id}",
+    }), 202
+
+@app.route("/procesar_lote", methods=["POST"])
+@ingestion_route
+def procesar_lote():
+    """
+    Acepta varios documentos (campo 'documentos') y los procesa en segundo plano como un único lote.
+    Responde con 202, el ID del trabajo y la aceptación de cada archivo; el resultado final de
+    cada archivo se consulta en /jobs/<job_id>.
+    """
+    archivos = request.files.getlist("documentos")
+    if not archivos:
+        return jsonify({"response": "No se ha subido ningún archivo."}), 400
+    if len(archivos) > app.config["BATCH_MAX_FILES"]:
+        return jsonify({"response": f"Se admiten como máximo {app.config['BATCH_MAX_FILES']} archivos por lote."}), 400
+
+    uploads = []
+    archivos_resultado = []
+    for archivo in archivos:
+        if not archivo.filename:
+            archivos_resultado.append({"filename": "", "estado": "rechazado", "error": "Nombre de archivo vacío"})
+            continue
+        try:
+            ruta_archivo, original_filename = save_upload(archivo)
+        except Exception as e:
+            logger.error(f"Error al guardar el archivo subido: {e}")
+            archivos_resultado.append({"filename": archivo.filename, "estado": "rechazado", "error": "Error al guardar el archivo"})
+            continue
+        uploads.append((ruta_archivo, original_filename))
+        archivos_resultado.append({"filename": original_filename, "estado": "aceptado"})
+
+    if not uploads:
+        return jsonify({"response": "Ningún archivo del lote es válido.", "archivos": archivos_resultado}), 400
+
+    try:
+        job = ingestion_jobs.submit(f"lote de {len(uploads)} archivos", process_uploaded_batch, uploads)
+    except QueueFullError as e:
+        for ruta_archivo, _ in uploads:
+            remove_upload(ruta_archivo)
+        return jsonify({"response": f"El servidor está ocupado procesando documentos. {e} Inténtalo más tarde."}), 503
+
+    return jsonify({
+        "response": f"Lote de {len(uploads)} documentos recibido. Procesando en segundo plano.",
+        "job_id": job.id,
+        "estado": job.status,
+        "status_url": f"/jobs/{job.id}",
+        "archivos": archivos_resultado,
+    }), 202
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+@ingestion_route
+def estado_trabajo(job_id):
+    """
+    Devuelve el estado, la etapa, el progreso y el error (si lo hubo) de un trabajo de ingesta.
+    """
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        return jsonify({"response": f"No existe el trabajo '{job_id}'."}), 404
+    return jsonify(job.to_dict()), 200
+
+def describe_patient(patient):
+    return {
+        "patient_id": patient["patient_id"],
+        "nombres": patient["names"],
+        "documentos": patient["documents"],
+        "fechas": patient["dates"],
+        "especialidades": patient["specialties"],
+    }
+
+@app.route("/patients", methods=["GET"])
+def listar_pacientes():
+    """
+    Lista los pacientes del registro con sus documentos, nombres y fechas.
+    Con ?q= se busca un paciente por ID o por nombre (sin distinguir tildes ni mayúsculas).
+    """
+    query = request.args.get("q", "").strip()
+    if query:
+        patient = patient_registry.get_patient(query.upper())
+        if patient is None:
+            patient_id = patient_registry.find_patient_by_name(query)
+            patient = patient_registry.get_patient(patient_id) if patient_id else None
+        patients = [patient] if patient else []
     else:
+        patients = patient_registry.list_patients()
+    return jsonify({"pacientes": [describe_patient(patient) for patient in patients]}), 200
+
+@app.route("/patients/<patient_id>", methods=["GET"])
+def detalle_paciente(patient_id):
+    patient = patient_registry.get_patient(patient_id.upper())
+    if patient is None:
+        return jsonify({"response": f"No existe el paciente '{patient_id}'."}), 404
+    return jsonify(describe_patient(patient)), 200
+
+
+@app.route("/documentos/<path:filename>", methods=["DELETE"])
+@ingestion_route
+def eliminar_documento(filename):
+    """
+    Elimina un documento del índice y su texto de la carpeta de documentos indexados.
+    Acepta tanto el nombre original subido (ej. 'informe.pdf') como el del texto indexado ('informe.txt').
+    """
+    indexed_text_filename = indexed_text_filename_for(filename)
+    removed = remove_indexed_document(indexed_text_filename)
+
+    indexed_text_filepath = os.path.join(app.config["INDEXED_TEXTS_FOLDER"], indexed_text_filename)
+    if os.path.exists(indexed_text_filepath):
         try:
-            with open(ruta_archivo, "r", encoding="utf-8") as f:
-                texto_extraido = f.read()
+            os.remove(indexed_text_filepath)
+            removed = True
         except Exception as e:
-            print(f"Error al leer el archivo de texto: {e}")
-            return "Error al leer el archivo de texto", 500
+            logger.error(f"Error al eliminar el texto indexado {indexed_text_filepath}: {e}")
+            return jsonify({"response": f"Error al eliminar el documento '{indexed_text_filename}'."}), 500
 
-    # Priorizar la extracción del ID del texto, sino del nombre de archivo.
-    patient_id = extract_patient_id_from_text(texto_extraido)
-    if not patient_id:
-        patient_id = extract_patient_id_from_filename(archivo.filename) # Fallback al nombre de archivo
+    if not removed:
+        return jsonify({"response": f"El documento '{indexed_text_filename}' no está indexado."}), 404
+    return jsonify({"response": f"Documento '{indexed_text_filename}' eliminado del asistente."}), 200
 
-    print(f"\n--- Depuración de Procesamiento de Documento ---")
-    print(f"Archivo subido: '{archivo.filename}'")
-    print(f"ID Paciente (extraído para metadata): '{patient_id}'") # Imprimir el ID extraído
-    print(f"Texto extraído del archivo (primeros 200 caracteres):")
-    print(texto_extraido[:200])
-    print("-" * 50)
 
-    # Guardar el texto extraído en la carpeta de documentos indexados
-    indexed_text_filename_base = os.path.splitext(archivo.filename)[0]
-    indexed_text_filepath = os.path.join(app.config["INDEXED_TEXTS_FOLDER"], f"{indexed_text_filename_base}.txt")
+def resolve_patient_in_message(user_message, snapshot):
+    """
+    Identifica al paciente de un mensaje del chat: por su ID (cédula) o, si el ID no corresponde
+    a ningún paciente indexado en el snapshot, por un nombre del registro de pacientes ('José Manuel Álvarez').
+    """
+    # Se revisan todas las coincidencias: 'id' también aparece dentro de palabras como 'especialidades'.
+    candidates = [match.group(1).strip().upper() for match in PATIENT_ID_QUERY_PATTERN.finditer(user_message)]
+    for candidate in candidates:
+        if candidate in snapshot.patient_documents:
+            return candidate
+    patient_id = candidates[0] if candidates else None
+    patient_id_by_name = patient_registry.find_patient_by_name(user_message)
+    if patient_id_by_name in snapshot.patient_documents:
+        logger.debug(f"Paciente identificado por nombre en la consulta: '{patient_id_by_name}'")
+        return patient_id_by_name
+    return patient_id
+
+def patient_mentions_in_message(user_message, patient_id):
+    """
+    Fragmentos del mensaje que mencionan el ID del paciente ('paciente 14473217', 'cédula: 14473217').
+    """
+    if not patient_id:
+        return []
+    return [
+        match.group(0) for match in PATIENT_ID_QUERY_PATTERN.finditer(user_message)
+        if match.group(1).strip().upper() == patient_id
+    ]
 
-    try:
-        with open(indexed_text_filepath, "w", encoding="utf-8") as f:
-            f.write(texto_extraido)
-        print(f"Texto guardado/actualizado en '{indexed_text_filepath}'")
-    except Exception as e:
-        print(f"Error al guardar el texto extraído para indexación: {e}")
+def build_chat_request(user_message, snapshot):
+    """
+    Separa un mensaje del chat en consulta de recuperación (lo que se busca en el índice) e
+    instrucción para Gemini, según el paciente y la acción (burbuja/chip) identificados.
+    Las instrucciones generales no forman parte de ninguna de las dos: van en el prompt de sistema.
+    """
+    from chat_prompts import ChatRequest, build_instruction, build_retrieval_query
 
-    # Reconstruir el motor de consulta global con los metadatos actualizados
-    initialize_global_query_engine()
+    patient_id_in_query = resolve_patient_in_message(user_message, snapshot)
 
-    try:
-        os.remove(ruta_archivo)
-    except Exception as e:
-        print(f"Error al eliminar el archivo temporal {ruta_archivo}: {e}")
+    intent = CHAT_INTENTS.classify(user_message)
+    logger.debug(
+        f"Mensaje de usuario recibido: '{user_message}' (paciente: '{patient_id_in_query}', "
+        f"acción: {intent.label if intent is not None else 'respuesta general'})"
+    )
 
-    return f"Documento procesado (Paciente ID: {patient_id}) y asistente actualizado. Ahora puedes analizar.", 200
+    retrieval_query = build_retrieval_query(
+        user_message, patient_mentions_in_message(user_message, patient_id_in_query), intent
+    )
+    logger.debug(f"Consulta de recuperación: '{retrieval_query}'")
+    instruction = build_instruction(user_message, patient_id_in_query, intent)
+    return ChatRequest(user_message, retrieval_query, instruction, patient_id_in_query, intent)
 
+def chat_unavailable_response():
+    """
+    503 del chat sin snapshot disponible: mientras el proceso se calienta, con Retry-After y el
+    progreso del calentamiento; después, porque todavía no hay documentos indexados.
+    """
+    if not warmup.finished:
+        return jsonify({
+            "response": "El asistente se está iniciando. Inténtalo de nuevo en unos segundos.",
+            "calentamiento": warmup.to_dict(),
+        }), 503, {"Retry-After": str(WARMUP_RETRY_AFTER)}
+    if not warmup.ready:
+        return jsonify({
+            "response": "El asistente no se pudo iniciar. Revisa el registro del servidor.",
+            "calentamiento": warmup.to_dict(),
+        }), 503
+    return jsonify({"response": "El chatbot no está disponible. Por favor, procesa un documento primero."}), 503
 
 @app.route("/chat", methods=["POST"])
 def chat():
-    global global_query_engine
-    if global_query_engine is None:
-        return jsonify({"response": "El chatbot no está disponible. Por favor, procesa un documento primero."}), 503
+    # Snapshot fijado para toda la petición: una reindexación en curso no la bloquea ni la altera.
+    snapshot = engine_snapshots.current()
+    if not snapshot.available:
+        return chat_unavailable_response()
 
     user_message = request.json.get("message", "")
     if not user_message:
         return jsonify({"response": "Mensaje vacío."}), 400
 
+    from gemini_client import GeminiUnavailableError
+
     try:
-        patient_id_in_query_match = re.search(r"(?:paciente|cédula|cedula|id)[:\s]*([0-9]{7,9}|[a-zA-Z0-9\-\.]+)", user_message, re.IGNORECASE)
-        patient_id_in_query = patient_id_in_query_match.group(1).strip().upper() if patient_id_in_query_match else None
+        chat_request = build_chat_request(user_message, snapshot)
+        patient_id_in_query = chat_request.patient_id
+
+        local_answer = answer_locally(chat_request.intent, user_message, patient_id_in_query, snapshot)
+        if local_answer is not None:
+            return jsonify({"response": local_answer, "local": True})
+
+        cache_key, cache_patient_id = get_response_cache_key(user_message, patient_id_in_query, snapshot)
+        cached_response = response_cache.get(cache_key)
+        if cached_response is not None:
+            logger.debug("Respuesta servida desde la caché de respuestas.")
+            return jsonify({"response": cached_response["response"], "cached": True})
+
+        # Si la consulta identifica a un paciente indexado, la búsqueda se limita a sus nodos.
+        context_assembler = new_context_assembler(chat_request)
+        query_engine = snapshot.get_query_engine(
+            patient_id_in_query, node_postprocessors=[context_assembler], sections=chat_request.sections
+        )
+        response_obj = query_engine.query(chat_request.query_bundle())
+        texto_respuesta = str(response_obj)
+        token_usage = report_token_usage(chat_request, context_assembler, texto_respuesta)
+        response_cache.put(
+            cache_key,
+            {"response": texto_respuesta, "sources": describe_source_nodes(getattr(response_obj, "source_nodes", None))},
+            cache_patient_id,
+        )
+        log_source_nodes(getattr(response_obj, "source_nodes", None))
+
+        return jsonify({"response": texto_respuesta, "tokens": token_usage})
+    except GeminiUnavailableError as e:
+        logger.warning(f"Consulta del chat rechazada, Gemini no disponible: {e}")
+        return gemini_unavailable_response(e)
+    except Exception as e:
+        logger.exception(f"Error al procesar el mensaje del chat: {e}")
+        return jsonify({"response": f"Error al procesar tu mensaje. Detalles: {e}"}), 500
 
-        print(f"DEBUG: Mensaje de usuario recibido: '{user_message}'")
-        print(f"DEBUG: ID de paciente extraído de la consulta: '{patient_id_in_query}'")
+def gemini_unavailable_response(error):
+    """
+    503 con Retry-After cuando Gemini no está disponible (cuota agotada o límite del proceso).
+    """
+    retry_after = error.retry_after_header()
+    return jsonify({
+        "response": f"El asistente está saturado en este momento. Inténtalo de nuevo en {retry_after} s.",
+        "retry_after": int(retry_after),
+    }), 503, {"Retry-After": retry_after}
 
-        base_prompt = (
-            "Eres un asistente médico virtual. Tu tarea es analizar los documentos proporcionados "
-            "y responder a las preguntas con la mayor precisión posible, extrayendo información relevante. "
-            "Siempre responde en español."
+def new_context_assembler(chat_request):
+    """
+    Etapa de montaje del contexto de una consulta: el contexto recibe lo que queda del
+    presupuesto de tokens de la petición después del prompt de sistema y la instrucción.
+    """
+    from context_assembly import ContextAssembler, MIN_CONTEXT_TOKENS
+
+    budget = max(app.config["PROMPT_TOKEN_BUDGET"] - chat_request.prompt_tokens(), MIN_CONTEXT_TOKENS)
+    return ContextAssembler(token_budget=budget)
+
+def report_token_usage(chat_request, context_assembler, response_text):
+    """
+    Tokens aproximados de entrada (prompt con el contexto montado) y de salida de una consulta.
+    """
+    from context_assembly import estimate_tokens
+
+    report = context_assembler.report
+    usage = {
+        "entrada": chat_request.prompt_tokens() + report.get("tokens_contexto", 0),
+        "salida": estimate_tokens(response_text),
+        "contexto": report.get("tokens_contexto", 0),
+        "contexto_recuperado": report.get("tokens_contexto_recuperado", 0),
+        "frases_duplicadas": report.get("frases_duplicadas", 0),
+        "presupuesto": app.config["PROMPT_TOKEN_BUDGET"],
+    }
+    for kind in ("entrada", "salida", "contexto"):
+        metrics.CHAT_TOKENS.inc(usage[kind], kind=kind)
+    logger.debug(
+        f"Tokens: entrada ~{usage['entrada']} de {usage['presupuesto']} (contexto {usage['contexto']} de "
+        f"{usage['contexto_recuperado']} recuperados, {usage['frases_duplicadas']} frases duplicadas), salida ~{usage['salida']}."
+    )
+    return usage
+
+def answer_locally(intent, user_message, patient_id_in_query, snapshot):
+    """
+    Respuesta de la acción sin recuperación ni Gemini, si tiene manejador local y este puede
+    responder con los metadatos del paciente. Devuelve None para seguir por el RAG.
+    """
+    if intent is None or intent.local_handler is None or patient_id_in_query not in snapshot.patient_documents:
+        return None
+    answer = intent.local_handler(user_message, patient_id_in_query)
+    if answer is not None:
+        logger.debug(f"Acción '{intent.name}' respondida localmente (sin LLM).")
+    return answer
+
+@CHAT_INTENTS.local_handler("medidas")
+def answer_from_metrics(user_message, patient_id):
+    """
+    Medidas y tendencias (frecuencia cardiaca, extrasístoles, tensión arterial) calculadas con
+    las series del paciente.
+    """
+    return answer_metric_question(holter_store.get_series(patient_id), user_message, patient_id)
+
+@CHAT_INTENTS.local_handler("archivos_adjuntos")
+def answer_patient_documents(user_message, patient_id):
+    """
+    Lista de documentos del paciente con sus fechas y motivo de consulta, desde el registro de pacientes.
+    """
+    patient = patient_registry.get_patient(patient_id)
+    if patient is None:
+        return None
+    lines = [f"Documentos disponibles del paciente con ID '{patient_id}':"]
+    for filename in patient["documents"]:
+        entry = patient_registry.get_document(filename)
+        details = []
+        if entry["dates"]:
+            details.append("fechas: " + ", ".join(entry["dates"]))
+        if entry["visit_reason"]:
+            details.append(f"motivo: {entry['visit_reason']}")
+        lines.append(f"- {filename}" + (f" ({'; '.join(details)})" if details else ""))
+    return "\n".join(lines)
+
+@CHAT_INTENTS.local_handler("especialidades")
+def answer_patient_specialties(user_message, patient_id):
+    """
+    Especialidades mencionadas en los documentos del paciente, con el motivo de consulta de cada documento.
+    """
+    patient = patient_registry.get_patient(patient_id)
+    if patient is None or not patient["specialties"]:
+        return None
+    lines = [f"Especialidades que aparecen en los documentos del paciente con ID '{patient_id}':"]
+    for specialty in patient["specialties"]:
+        reasons = []
+        for filename in patient["documents"]:
+            entry = patient_registry.get_document(filename)
+            if specialty in entry["specialties"]:
+                reasons.append(f"{filename}" + (f": {entry['visit_reason']}" if entry["visit_reason"] else ""))
+        lines.append(f"- {specialty} ({'; '.join(reasons)})")
+    return "\n".join(lines)
+
+def get_response_cache_key(user_message, patient_id_in_query, snapshot):
+    """
+    Clave de la caché de respuestas para un mensaje, con la versión del índice del snapshot.
+    Solo se particiona por paciente si el ID corresponde a un paciente indexado (igual que la búsqueda).
+    Devuelve (clave, paciente usado en la clave).
+    """
+    cache_patient_id = patient_id_in_query if patient_id_in_query in snapshot.patient_documents else None
+    cache_key = ResponseCache.make_key(user_message, cache_patient_id, snapshot.get_index_version(cache_patient_id))
+    return cache_key, cache_patient_id
+
+def describe_source_nodes(source_nodes):
+    """
+    Resume los metadatos de los nodos fuente recuperados para enviarlos al cliente.
+    """
+    return [
+        {
+            "filename": node.metadata.get("filename"),
+            "patient_id": node.metadata.get("patient_id"),
+            "section": node.metadata.get("section"),
+            "score": node.score,
+        }
+        for node in source_nodes or []
+    ]
+
+def log_source_nodes(source_nodes):
+    """
+    Registra (en nivel DEBUG) los metadatos de los nodos fuente de una respuesta.
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    for position, node in enumerate(source_nodes or [], start=1):
+        logger.debug(
+            f"Nodo fuente {position}: {node.node_id} (paciente '{node.metadata.get('patient_id', 'N/A')}', "
+            f"archivo '{node.metadata.get('filename', 'N/A')}', sección '{node.metadata.get('section', 'N/A')}', "
+            f"puntuación {node.score})"
         )
 
-        if patient_id_in_query:
-            base_prompt += (
-                f" **ATENCIÓN: CONCÉNTRATE ESTRICTAMENTE en la información del paciente con ID '{patient_id_in_query}'.** "
-                "IGNORA Y OMITE cualquier dato que no esté **DIRECTAMENTE** relacionado con este ID de paciente, incluso si aparece en el contexto. "
-                "Si la información solicitada para este paciente específico NO se encuentra en los documentos, "
-                "responde ÚNICAMENTE: 'Lo siento, no se encontró información relevante para el paciente con ID {patient_id_in_query} en los documentos disponibles.' "
-                "NO inventes información ni te refieras a otros IDs."
-            )
-        else:
-            base_prompt += " Si tu pregunta no especifica un ID de paciente, responde basándote en toda la información disponible. "
-
-        user_message_lower = user_message.lower()
-        final_prompt = ""
-        action_identified = False
-
-        # Lógica para las opciones de burbujas/chips (orden actualizado y 'redactame' eliminado)
-        if "informes completo" in user_message_lower or "informes médicos" in user_message_lower:
-            final_prompt = f"{base_prompt} Proporciona un resumen detallado o los puntos clave de los informes médicos completos disponibles para el paciente con ID '{patient_id_in_query if patient_id_in_query else 'general'}'. {user_message}"
-            print("Acción: Informes completos.")
-            action_identified = True
-        elif "resumen" in user_message_lower:
-            final_prompt = f"{base_prompt} Proporciona un resumen de la historia clínica del paciente con ID '{patient_id_in_query if patient_id_in_query else 'general'}', incluyendo antecedentes familiares y personales, alergias, medicación actual y pasada, y conclusiones de pruebas diagnósticas relevantes. {user_message}"
-            print("Acción: Resumen de historia clínica.")
-            action_identified = True
-        elif "alergias e intolerancias" in user_message_lower:
-            final_prompt = f"{base_prompt} Enumera todas las alergias e intolerancias documentadas para el paciente con ID '{patient_id_in_query if patient_id_in_query else 'general'}'. Si no se encuentran, indica 'No documentado' para ese paciente. {user_message}"
-            print("Acción: Alergias e intolerancias.")
-            action_identified = True
-        elif "medicación" in user_message_lower or "medicacion" in user_message_lower: # Acepta con y sin tilde
-            final_prompt = f"{base_prompt} Detalla la medicación actual y pasada del paciente con ID '{patient_id_in_query if patient_id_in_query else 'general'}', incluyendo la dosis, frecuencia y las causas de suspensión si están disponibles en los documentos. Si no hay medicación documentada para este paciente, indícalo. {user_message}"
-            print("Acción: Medicación.")
-            action_identified = True
-        elif "curvas evolutivas" in user_message_lower:
-            final_prompt = f"{base_prompt} Describe cualquier información sobre curvas evolutivas, tendencias o cambios significativos en mediciones (ej. peso, tensión arterial, glucosa) a lo largo del tiempo, según los documentos disponibles para el paciente con ID '{patient_id_in_query if patient_id_in_query else 'general'}'. Si no hay datos, indícalo. {user_message}"
-            print("Acción: Curvas evolutivas.")
-            action_identified = True
-        elif "pruebas" in user_message_lower:
-            final_prompt = f"{base_prompt} Resume las pruebas diagnósticas realizadas al paciente con ID '{patient_id_in_query if patient_id_in_query else 'general'}', enfocándote específicamente en sus conclusiones y resultados clave. {user_message}"
-            print("Acción: Pruebas diagnósticas.")
-            action_identified = True
-        elif "analíticas" in user_message_lower or "analiticas" in user_message_lower: # Acepta con y sin tilde
-            final_prompt = f"{base_prompt} Proporciona un resumen de los resultados de las analíticas de laboratorio del paciente con ID '{patient_id_in_query if patient_id_in_query else 'general'}', destacando cualquier valor fuera de rango o significativo. {user_message}"
-            print("Acción: Analíticas de laboratorio.")
-            action_identified = True
-        elif "diagnósticos" in user_message_lower or "diagnosticos" in user_message_lower: # Acepta con y sin tilde
-            final_prompt = f"{base_prompt} Lista todos los diagnósticos registrados o mencionados para el paciente con ID '{patient_id_in_query if patient_id_in_query else 'general'}' en los documentos. {user_message}"
-            print("Acción: Diagnósticos.")
-            action_identified = True
-        elif "electros" in user_message_lower or "electrocardiogramas" in user_message_lower:
-            final_prompt = f"{base_prompt} Describe los hallazgos y conclusiones de los electrocardiogramas (ECG) mencionados en los documentos del paciente con ID '{patient_id_in_query if patient_id_in_query else 'general'}'. {user_message}"
-            print("Acción: Electros/ECG.")
-            action_identified = True
-        elif "especialidades" in user_message_lower:
-            final_prompt = f"{base_prompt} Lista todas las especialidades médicas que han tratado al paciente con ID '{patient_id_in_query if patient_id_in_query else 'general'}' o que se mencionan en sus documentos, junto con los motivos de consulta si están disponibles. {user_message}"
-            print("Acción: Especialidades.")
-            action_identified = True
-        elif "imágenes" in user_message_lower or "imagenes" in user_message_lower:
-            final_prompt = f"{base_prompt} Resume los hallazgos principales y las conclusiones de los estudios de imágenes diagnósticas (radiografías, ecografías, resonancias, etc.) mencionados en los documentos del paciente con ID '{patient_id_in_query if patient_id_in_query else 'general'}'. {user_message}"
-            print("Acción: Imágenes diagnósticas.")
-            action_identified = True
-        elif "archivos adj." in user_message_lower or "archivos adjuntos" in user_message_lower:
-            final_prompt = f"{base_prompt} Menciona cualquier información relevante sobre archivos adjuntos o documentos anexos que se describan en los registros del paciente con ID '{patient_id_in_query if patient_id_in_query else 'general'}'. {user_message}"
-            print("Acción: Archivos adjuntos.")
-            action_identified = True
-        elif "formato soap" in user_message_lower: # Mantenemos esta para casos específicos o si no se usa la burbuja
-            final_prompt = (
-                f"{base_prompt} Por favor, genera un informe estructurado en formato SOAP "
-                f"(Subjetivo, Objetivo, Evaluación, Plan) basado en la información para el paciente con ID '{patient_id_in_query if patient_id_in_query else 'general'}'. "
-                f"Pregunta original: {user_message}"
-            )
-            print("Acción: Generando informe estructurado (SOAP).")
-            action_identified = True
-        
-        if not action_identified:
-            final_prompt = f"{base_prompt} Pregunta original: {user_message}"
-            print("Acción: Generando respuesta general.")
-
-        response_obj = global_query_engine.query(final_prompt)
-        texto_respuesta = str(response_obj)
+def format_sse_event(event, data):
+    """
+    Formatea un evento Server-Sent Events con datos JSON.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
-        # --- DIAGNOSTIC: Print retrieved source nodes metadata ---
-        print("\nDEBUG: Metadata de los nodos fuente recuperados por LlamaIndex:")
-        if hasattr(response_obj, 'source_nodes') and response_obj.source_nodes:
-            for i, node in enumerate(response_obj.source_nodes):
-                print(f"  Nodo {i+1}:")
-                print(f"    ID de Documento (LlamaIndex): {node.node_id}")
-                print(f"    ID de Paciente (metadata): {node.metadata.get('patient_id', 'N/A')}")
-                print(f"    Nombre de Archivo (metadata): {node.metadata.get('filename', 'N/A')}")
-                # Imprimir el texto del nodo, solo los primeros 200 caracteres para no saturar la consola
-                print(f"    Texto (primeros 200 chars): {node.text[:200]}...")
-        else:
-            print("  - No se recuperaron nodos fuente o no se pudo acceder a ellos.")
-        print("-" * 50)
-        # --- END DIAGNOSTIC ---
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    """
+    Variante en streaming de /chat: envía la respuesta como Server-Sent Events a medida que
+    Gemini genera los tokens ('token'), y al final los metadatos de los nodos fuente ('sources')
+    y un evento 'done'. Los errores a mitad de respuesta se notifican con un evento 'error'.
+    """
+    snapshot = engine_snapshots.current()
+    if not snapshot.available:
+        return chat_unavailable_response()
+
+    user_message = request.json.get("message", "")
+    if not user_message:
+        return jsonify({"response": "Mensaje vacío."}), 400
+
+    from gemini_client import GeminiUnavailableError
 
-        return jsonify({"response": texto_respuesta})
+    # Antes de abrir el stream los errores se responden igual que en /chat (JSON con su código).
+    try:
+        chat_request = build_chat_request(user_message, snapshot)
+        patient_id_in_query = chat_request.patient_id
+        local_answer = answer_locally(chat_request.intent, user_message, patient_id_in_query, snapshot)
+        cache_key = cache_patient_id = cached_response = None
+        if local_answer is None:
+            cache_key, cache_patient_id = get_response_cache_key(user_message, patient_id_in_query, snapshot)
+            cached_response = response_cache.get(cache_key)
+    except GeminiUnavailableError as e:
+        logger.warning(f"Consulta del chat en streaming rechazada, Gemini no disponible: {e}")
+        return gemini_unavailable_response(e)
     except Exception as e:
-        print(f"ERROR al procesar el mensaje del chat: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error al procesar el mensaje del chat en streaming: {e}")
         return jsonify({"response": f"Error al procesar tu mensaje. Detalles: {e}"}), 500
 
+    def generate():
+        if local_answer is not None:
+            yield format_sse_event("token", {"text": local_answer})
+            yield format_sse_event("sources", {"sources": [], "local": True})
+            yield format_sse_event("done", {})
+            return
+        if cached_response is not None:
+            logger.debug("Respuesta servida desde la caché de respuestas.")
+            yield format_sse_event("token", {"text": cached_response["response"]})
+            yield format_sse_event("sources", {"sources": cached_response["sources"], "cached": True})
+            yield format_sse_event("done", {})
+            return
+        try:
+            # El motor de consulta solo se construye cuando hace falta llamar al LLM.
+            context_assembler = new_context_assembler(chat_request)
+            query_engine = snapshot.get_query_engine(
+                patient_id_in_query, streaming=True, node_postprocessors=[context_assembler], sections=chat_request.sections
+            )
+            streaming_response = query_engine.query(chat_request.query_bundle())
+            tokens = []
+            for token in streaming_response.response_gen:
+                tokens.append(token)
+                yield format_sse_event("token", {"text": token})
+            sources = describe_source_nodes(streaming_response.source_nodes)
+            log_source_nodes(streaming_response.source_nodes)
+            response_cache.put(cache_key, {"response": "".join(tokens), "sources": sources}, cache_patient_id)
+            yield format_sse_event("sources", {"sources": sources})
+            yield format_sse_event("done", {"tokens": report_token_usage(chat_request, context_assembler, "".join(tokens))})
+        except GeminiUnavailableError as e:
+            # Las cabeceras ya se enviaron: el cliente recibe la espera sugerida en el evento.
+            logger.warning(f"Consulta del chat en streaming rechazada, Gemini no disponible: {e}")
+            retry_after = e.retry_after_header()
+            yield format_sse_event("error", {
+                "response": f"El asistente está saturado en este momento. Inténtalo de nuevo en {retry_after} s.",
+                "retry_after": int(retry_after),
+            })
+        except Exception as e:
+            logger.exception(f"Error al procesar el mensaje del chat en streaming: {e}")
+            yield format_sse_event("error", {"response": f"Error al procesar tu mensaje. Detalles: {e}"})
+
+    headers = {
+        "Cache-Control": "no-cache",
+        # Evita que proxies intermedios (nginx, túneles) acumulen la respuesta antes de enviarla.
+        "X-Accel-Buffering": "no",
+    }
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=headers)
+
 @app.route("/export_chat_response_pdf", methods=["POST"])
 def export_chat_response_pdf():
     """
     Genera un PDF con el texto de la última respuesta del chatbot,
     aplicando un formato de "hoja membreteada" y estructurando el contenido
-    si detecta un formato SOAP.
+    si detecta un formato SOAP. El membrete está precalculado (get_pdf_letterhead()).
     """
+    from pdf_export import render_chat_response_pdf
+
     data = request.json
     text_content = data.get("text_content", "")
 
     if not text_content:
         return "No hay contenido para exportar a PDF.", 400
 
-    buffer_pdf = BytesIO()
-    c = canvas.Canvas(buffer_pdf, pagesize=letter)
-    width, height = letter # Obtener dimensiones de la página (letter = 612x792 puntos)
-
-    # --- Configuración de fuentes y márgenes ---
-    MARGIN_LEFT = 72 # 1 pulgada = 72 puntos
-    MARGIN_RIGHT = width - 72
-    MARGIN_TOP = height - 72
-    MARGIN_BOTTOM = 72
-    LINE_HEIGHT = 14
-    NORMAL_FONT_SIZE = 10
-    HEADING_FONT_SIZE = 12
-    SUB_HEADING_FONT_SIZE = 10
-    
-    # --- Datos del Membrete ---
-    DR_NAME = "Dr. Rodolfo Gutiérrez Caro"
-    DR_SPECIALTY = "Especialista en Cardiología"
-    DR_COLEGIADO = "Colegiado 332405519"
-    CLINIC_INFO = "CliniKa AI - Asistente Médico Virtual"
-    CONTACT_INFO = "Contacto: info@clinika-ai.com | Tel: +58 412-1234567" # Ejemplo
-
-    def draw_header_footer(canvas_obj, page_num=1):
-        """Dibuja el encabezado y pie de página."""
-        # Encabezado (Header)
-        canvas_obj.setFont(FINAL_FONT_NAME, HEADING_FONT_SIZE)
-        canvas_obj.drawString(MARGIN_LEFT, height - 40, CLINIC_INFO)
-        # Puedes añadir un logo aquí. Por ejemplo:
-        # canvas_obj.drawImage("path/to/your/logo.png", MARGIN_LEFT, height - 70, width=50, height=50)
-
-        canvas_obj.setFont(FINAL_FONT_NAME, NORMAL_FONT_SIZE)
-        canvas_obj.drawRightString(MARGIN_RIGHT, height - 40, DR_NAME)
-        canvas_obj.drawRightString(MARGIN_RIGHT, height - 55, DR_SPECIALTY)
-        canvas_obj.drawRightString(MARGIN_RIGHT, height - 70, DR_COLEGIADO)
-        
-        # Línea divisoria del encabezado
-        canvas_obj.line(MARGIN_LEFT, height - 80, MARGIN_RIGHT, height - 80)
-
-        # Pie de página (Footer)
-        canvas_obj.setFont(FINAL_FONT_NAME, NORMAL_FONT_SIZE - 2) # Fuente más pequeña para el pie
-        canvas_obj.drawCentredString(width / 2, 40, CONTACT_INFO)
-        canvas_obj.drawCentredString(width / 2, 25, f"Página {page_num}")
-        
-        # Línea divisoria del pie de página
-        canvas_obj.line(MARGIN_LEFT, 50, MARGIN_RIGHT, 50)
-
-    # Iniciar la primera página
-    page_num = 1
-    draw_header_footer(c, page_num)
-    c.setFont(FINAL_FONT_NAME, NORMAL_FONT_SIZE)
-    y_position = MARGIN_TOP - 60 # Posición inicial del texto después del encabezado
-
-    c.drawString(MARGIN_LEFT, y_position, "Informe Generado por Asistente Médico Virtual:")
-    y_position -= LINE_HEIGHT * 2
-
-    # Normalizar el texto de la respuesta (buena práctica Unicode)
-    normalized_text_content = unicodedata.normalize('NFC', text_content)
-    # Codificación/decodificación explícita para asegurar la compatibilidad con ReportLab
-    try:
-        texto_para_pdf = normalized_text_content.encode('utf-8', 'ignore').decode('utf-8')
-    except Exception as e:
-        print(f"Advertencia: Error al codificar/decodificar texto para PDF antes de dibujar: {e}")
-        texto_para_pdf = normalized_text_content
-
-    # --- Detección y Formato de Secciones SOAP ---
-    # Patrones para detectar las secciones (Subjetivo, Objetivo, Evaluación, Plan)
-    # Se usa re.IGNORECASE para que sea insensible a mayúsculas/minúsculas.
-    soap_sections = {
-        "Subjetivo": re.compile(r"^(subjetivo|s)\s*[:\.]?\s*", re.IGNORECASE),
-        "Objetivo": re.compile(r"^(objetivo|o)\s*[:\.]?\s*", re.IGNORECASE),
-        "Evaluación": re.compile(r"^(evaluacion|e)\s*[:\.]?\s*", re.IGNORECASE),
-        "Plan": re.compile(r"^(plan|p)\s*[:\.]?\s*", re.IGNORECASE),
-    }
-    
-    current_section = None
-    processed_lines = []
-    lines = texto_para_pdf.split("\n")
+    with stage_timer("pdf"):
+        pdf_bytes, _ = render_chat_response_pdf(text_content, get_pdf_letterhead())
+    buffer_pdf = BytesIO(pdf_bytes)
 
-    for i, line in enumerate(lines):
-        line = line.strip()
-        if not line: # Saltar líneas vacías
-            continue
+    return send_file(buffer_pdf, as_attachment=True, download_name="informe_medico_ia.pdf", mimetype="application/pdf")
 
-        is_new_section = False
-        for section_name, pattern in soap_sections.items():
-            if pattern.match(line):
-                # Extraer solo el contenido después del título de la sección
-                content_after_title = pattern.sub('', line, 1).strip()
-                processed_lines.append((section_name.upper(), content_after_title)) # Guardar como (HEADING, CONTENT)
-                current_section = section_name.upper()
-                is_new_section = True
-                break
-        
-        if not is_new_section:
-            if current_section: # Si estamos dentro de una sección, añadir la línea al contenido de la sección
-                processed_lines.append(("CONTENT", line))
-            else: # Si no estamos en una sección formal, tratar como texto normal
-                processed_lines.append(("NORMAL", line))
-
-    # --- Dibujar el contenido procesado en el PDF ---
-    for item_type, text_to_draw in processed_lines:
-        # Manejo de salto de página antes de dibujar cada elemento
-        required_height = LINE_HEIGHT
-        if item_type in ["SUBJETIVO", "OBJETIVO", "EVALUACIÓN", "PLAN"]:
-            required_height += (HEADING_FONT_SIZE - NORMAL_FONT_SIZE) + LINE_HEIGHT # Espacio extra para el título
-        
-        if y_position - required_height < MARGIN_BOTTOM:
-            c.showPage()
-            page_num += 1
-            draw_header_footer(c, page_num)
-            c.setFont(FINAL_FONT_NAME, NORMAL_FONT_SIZE)
-            y_position = MARGIN_TOP - 60 # Reiniciar posición después del encabezado
-
-        if item_type in ["SUBJETIVO", "OBJETIVO", "EVALUACIÓN", "PLAN"]:
-            c.setFont(FINAL_FONT_NAME, HEADING_FONT_SIZE) # Fuente más grande para el título
-            c.drawString(MARGIN_LEFT, y_position, item_type + ":")
-            y_position -= LINE_HEIGHT # Espacio para el título
-            c.setFont(FINAL_FONT_NAME, NORMAL_FONT_SIZE) # Volver a la fuente normal para el contenido
-            
-            # Dibujar el contenido de la sección
-            for line_part in c._wrapText(text_to_draw, MARGIN_RIGHT - MARGIN_LEFT, FINAL_FONT_NAME, NORMAL_FONT_SIZE):
-                if y_position < MARGIN_BOTTOM:
-                    c.showPage()
-                    page_num += 1
-                    draw_header_footer(c, page_num)
-                    c.setFont(FINAL_FONT_NAME, NORMAL_FONT_SIZE)
-                    y_position = MARGIN_TOP - 60
-                c.drawString(MARGIN_LEFT + 20, y_position, line_part) # Pequeña sangría para el contenido
-                y_position -= LINE_HEIGHT
-            y_position -= LINE_HEIGHT / 2 # Pequeño espacio extra entre secciones
-        else: # Tipo "CONTENT" o "NORMAL"
-            for line_part in c._wrapText(text_to_draw, MARGIN_RIGHT - MARGIN_LEFT, FINAL_FONT_NAME, NORMAL_FONT_SIZE):
-                if y_position < MARGIN_BOTTOM:
-                    c.showPage()
-                    page_num += 1
-                    draw_header_footer(c, page_num)
-                    c.setFont(FINAL_FONT_NAME, NORMAL_FONT_SIZE)
-                    y_position = MARGIN_TOP - 60
-                c.drawString(MARGIN_LEFT, y_position, line_part)
-                y_position -= LINE_HEIGHT
-            y_position -= LINE_HEIGHT / 2 # Pequeño espacio extra entre párrafos/líneas
-
-    c.save() # Guardar el contenido del PDF
-    buffer_pdf.seek(0) # Mover el puntero al inicio del buffer para la lectura
+def build_export_sections(respuestas, group_by_patient):
+    """
+    Convierte las respuestas del lote en secciones del PDF. Con group_by_patient las respuestas se
+    ordenan por paciente (manteniendo su orden dentro de cada uno) y las que no tienen paciente van al final.
+    """
+    from pdf_export import ExportSection
+
+    sections = []
+    for position, item in enumerate(respuestas, start=1):
+        if isinstance(item, str):
+            item = {"text_content": item}
+        if not isinstance(item, dict):
+            raise ValueError(f"La respuesta {position} debe ser un texto o un objeto con 'text_content'.")
+        text_content = item.get("text_content")
+        if not isinstance(text_content, str) or not text_content.strip():
+            raise ValueError(f"La respuesta {position} no tiene contenido ('text_content').")
+        title = item.get("titulo") or f"Respuesta {position}"
+        patient_id = item.get("patient_id")
+        group = None
+        if group_by_patient and patient_id:
+            patient = patient_registry.get_patient(str(patient_id))
+            group = f"Paciente {patient_id}"
+            if patient and patient["names"]:
+                group = f"{group} - {patient['names'][0]}"
+        sections.append(ExportSection(str(title), text_content, group))
+    if group_by_patient:
+        first_position = {}
+        for position, section in enumerate(sections):
+            first_position.setdefault(section.group, position)
+        sections.sort(key=lambda section: (section.group is None, first_position[section.group]))
+    return sections
+
+@app.route("/export_chat_responses_pdf", methods=["POST"])
+def export_chat_responses_pdf():
+    """
+    Compila varias respuestas del chatbot en un único PDF con membrete, índice y marcadores.
+    Cuerpo JSON: {"respuestas": [{"text_content", "titulo"?, "patient_id"?} | texto], "agrupar_por_paciente": bool}.
+    Las secciones se renderizan en paralelo y el documento se devuelve desde un archivo temporal.
+    """
+    from pdf_export import render_batch_pdf
+
+    data = request.get_json(silent=True) or {}
+    respuestas = data.get("respuestas")
+    if not isinstance(respuestas, list) or not respuestas:
+        return jsonify({"error": "Se requiere una lista 'respuestas' con al menos una respuesta."}), 400
+    if len(respuestas) > app.config["BATCH_EXPORT_MAX_RESPONSES"]:
+        return jsonify({"error": f"Se permiten como máximo {app.config['BATCH_EXPORT_MAX_RESPONSES']} respuestas por exportación."}), 400
+    try:
+        sections = build_export_sections(respuestas, bool(data.get("agrupar_por_paciente")))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    return send_file(buffer_pdf, as_attachment=True, download_name="informe_medico_ia.pdf", mimetype="application/pdf")
+    output = tempfile.TemporaryFile()
+    try:
+        with stage_timer("pdf"):
+            total_pages = render_batch_pdf(
+                sections, get_pdf_letterhead(), FONT_PATH, output,
+                max_workers=app.config["PDF_EXPORT_WORKERS"] or None,
+            )
+    except Exception as e:
+        output.close()
+        logger.exception(f"Error al exportar el lote de {len(sections)} respuestas a PDF: {e}")
+        return jsonify({"error": f"No se pudo generar el PDF: {e}"}), 500
+    output.seek(0)
+    logger.info(f"PDF de {len(sections)} respuestas generado ({total_pages} páginas).")
+    return send_file(output, as_attachment=True, download_name="informes_medicos_ia.pdf", mimetype="application/pdf")
 
 # Este bloque se elimina o comenta para despliegue en plataformas como PythonAnywhere
 # if __name__ == "__main__":
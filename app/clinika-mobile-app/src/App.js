@@ -93,6 +93,19 @@ const App = () => {
         }
     };
 
+    // Poll an ingestion job until it finishes (completado / error)
+    const waitForJob = async (statusUrl) => {
+        while (true) {
+            const response = await fetch(`${API_BASE_URL}${statusUrl}`);
+            const job = await response.json();
+            if (!response.ok || job.estado === 'completado' || job.estado === 'error') {
+                return job;
+            }
+            setStatusMessage(`Procesando documento... (${job.etapa}, ${job.progreso}%)`);
+            await new Promise((resolve) => setTimeout(resolve, 1000));
+        }
+    };
+
     // Handler for file input change (when a file is selected)
     const handleFileChange = async (event) => {
         const file = event.target.files[0];
@@ -114,9 +127,16 @@ const App = () => {
             });
 
             if (response.ok) {
-                const message = await response.text();
-                setStatusMessage(`Documento procesado: ${message}`);
-                addChatMessage(`Documento "${file.name}" procesado exitosamente. Ahora puedes preguntar sobre él.`, 'ai');
+                // El servidor procesa el documento en segundo plano: consultar el trabajo hasta que termine
+                const job = await response.json();
+                const finishedJob = await waitForJob(job.status_url);
+                if (finishedJob.estado === 'completado') {
+                    setStatusMessage(`Documento procesado: ${finishedJob.mensaje}`);
+                    addChatMessage(`Documento "${file.name}" procesado exitosamente. Ahora puedes preguntar sobre él.`, 'ai');
+                } else {
+                    setStatusMessage(`Error al procesar: ${finishedJob.error}`);
+                    addChatMessage(`Error al procesar documento "${file.name}": ${finishedJob.error}`, 'ai');
+                }
             } else {
                 const errorText = await response.text();
                 setStatusMessage(`Error al procesar: ${errorText}`);
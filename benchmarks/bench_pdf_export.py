@@ -0,0 +1,122 @@
+"""
+Benchmark de la exportación a PDF de respuestas del chat (1, 10 y 100 páginas).
+
+Uso (desde la raíz del proyecto):
+    python benchmarks/bench_pdf_export.py [--repeticiones 5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reportlab.pdfbase import pdfmetrics, ttfonts
+from PyPDF2 import PdfReader
+from io import BytesIO
+
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfgen import canvas
+
+import pdf_export
+from pdf_export import LetterheadTemplate, parse_soap_sections, render_chat_response_pdf
+
+FONT_NAME = "DejaVuSans"
+FONT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fonts", f"{FONT_NAME}.ttf")
+
+PARAGRAPH = (
+    "Paciente de 76 años con dislipemia, HTA y DM-II. Holter de 72 h con ritmo sinusal, frecuencia cardiaca "
+    "entre 50 y 130 lpm (promedio 80 lpm), extrasístoles supraventriculares aisladas de baja densidad "
+    "(105 / 72h) y rachas cortas de taquicardia paroxística supraventricular; la más larga de 5,6 s."
+)
+
+def build_response(target_pages):
+    """
+    Respuesta en formato SOAP con aproximadamente target_pages páginas (unos 9 párrafos por página).
+    """
+    sections = []
+    paragraphs_per_section = max(1, target_pages * 9 // 4)
+    for title in ("Subjetivo", "Objetivo", "Evaluación", "Plan"):
+        sections.append(f"{title}: {PARAGRAPH}")
+        sections.extend(PARAGRAPH for _ in range(paragraphs_per_section - 1))
+    return "\n".join(sections)
+
+def render_reference_pdf(text_content, font_name):
+    """
+    Referencia con el esquema anterior: membrete redibujado en cada página, ancho de cada línea
+    medido con stringWidth (simpleSplit) y un drawString por línea.
+    """
+    e = pdf_export
+    buffer_pdf = BytesIO()
+    c = canvas.Canvas(buffer_pdf, pagesize=letter)
+
+    def draw_header_footer(page_num):
+        c.setFont(font_name, e.HEADING_FONT_SIZE)
+        c.drawString(e.MARGIN_LEFT, e.PAGE_HEIGHT - 40, e.CLINIC_INFO)
+        c.setFont(font_name, e.NORMAL_FONT_SIZE)
+        c.drawRightString(e.MARGIN_RIGHT, e.PAGE_HEIGHT - 40, e.DR_NAME)
+        c.drawRightString(e.MARGIN_RIGHT, e.PAGE_HEIGHT - 55, e.DR_SPECIALTY)
+        c.drawRightString(e.MARGIN_RIGHT, e.PAGE_HEIGHT - 70, e.DR_COLEGIADO)
+        c.line(e.MARGIN_LEFT, e.PAGE_HEIGHT - 80, e.MARGIN_RIGHT, e.PAGE_HEIGHT - 80)
+        c.setFont(font_name, e.NORMAL_FONT_SIZE - 2)
+        c.drawCentredString(e.PAGE_WIDTH / 2, 40, e.CONTACT_INFO)
+        c.drawCentredString(e.PAGE_WIDTH / 2, 25, f"Página {page_num}")
+        c.line(e.MARGIN_LEFT, 50, e.MARGIN_RIGHT, 50)
+        c.setFont(font_name, e.NORMAL_FONT_SIZE)
+
+    page_num = 1
+    draw_header_footer(page_num)
+    y = e.BODY_TOP
+    c.drawString(e.MARGIN_LEFT, y, e.REPORT_TITLE)
+    y -= e.LINE_HEIGHT * 2
+    for item_type, text_to_draw in parse_soap_sections(text_content):
+        if item_type in e.SOAP_HEADINGS:
+            c.setFont(font_name, e.HEADING_FONT_SIZE)
+            c.drawString(e.MARGIN_LEFT, y, item_type + ":")
+            y -= e.LINE_HEIGHT
+            c.setFont(font_name, e.NORMAL_FONT_SIZE)
+        for line_part in simpleSplit(text_to_draw, font_name, e.NORMAL_FONT_SIZE, e.MARGIN_RIGHT - e.MARGIN_LEFT):
+            if y < e.MARGIN_BOTTOM:
+                c.showPage()
+                page_num += 1
+                draw_header_footer(page_num)
+                y = e.BODY_TOP
+            c.drawString(e.MARGIN_LEFT, y, line_part)
+            y -= e.LINE_HEIGHT
+        y -= e.LINE_HEIGHT / 2
+    c.save()
+    return buffer_pdf.getvalue()
+
+def median_seconds(fn, repetitions):
+    timings = []
+    for _ in range(repetitions):
+        started_at = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started_at)
+    return statistics.median(timings), result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args()
+
+    pdfmetrics.registerFont(ttfonts.TTFont(FONT_NAME, FONT_PATH))
+    letterhead = LetterheadTemplate(FONT_NAME)
+    render_chat_response_pdf(build_response(1), letterhead) # Calentamiento (carga de la fuente, caché de anchos)
+
+    print(f"{'páginas':>8} {'mediana ms':>11} {'ms/página':>10} {'páginas/s':>10} {'KB':>6} {'referencia ms':>14} {'KB ref.':>8}")
+    for target_pages in (1, 10, 100):
+        text = build_response(target_pages)
+        seconds, (pdf_bytes, pages) = median_seconds(lambda: render_chat_response_pdf(text, letterhead), args.repeticiones)
+        assert len(PdfReader(BytesIO(pdf_bytes)).pages) == pages
+        reference_seconds, reference_bytes = median_seconds(lambda: render_reference_pdf(text, FONT_NAME), args.repeticiones)
+        median_ms = seconds * 1000
+        print(
+            f"{pages:>8} {median_ms:>11.1f} {median_ms / pages:>10.2f} {pages / seconds:>10.0f} {len(pdf_bytes) / 1024:>6.0f} "
+            f"{reference_seconds * 1000:>14.1f} {len(reference_bytes) / 1024:>8.0f}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Benchmark del servicio completo con Gemini simulado (benchmarks/fake_gemini.py) y un corpus
+sintético (benchmarks/synthetic_corpus.py), con 10, 1.000 y 10.000 documentos:
+
+- ingesta: documentos por segundo indexados con upsert_indexed_documents en lotes (como /procesar_lote);
+- arranque: segundos hasta que app responde (importación) y hasta que termina el calentamiento
+  con el índice ya persistido (reinicio del servicio, /ready);
+- /chat: latencia p50 y p99 de consultas distintas (sin caché de respuestas);
+- /export_chat_response_pdf: PDF por segundo.
+
+Cada tamaño se ejecuta en una carpeta temporal y en procesos nuevos (app indexa al importarse),
+así que los resultados no dependen de storage/ ni de indexed_texts/ del proyecto.
+
+Uso (desde la raíz del proyecto):
+    python benchmarks/bench_service.py [--documentos 10 1000 10000] [--consultas 200]
+        [--latencia-llm 0] [--latencia-token 0] [--latencia-embeddings 0]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+PROJECT_FOLDER = os.path.dirname(BENCHMARKS_FOLDER)
+sys.path.insert(0, PROJECT_FOLDER)
+sys.path.insert(0, BENCHMARKS_FOLDER)
+
+from synthetic_corpus import generate_corpus, write_corpus
+
+CHAT_MESSAGES = [
+    "Medicación. paciente {patient}",
+    "Alergias e intolerancias. paciente {patient}",
+    "Diagnósticos. paciente {patient}",
+    "Pruebas diagnósticas. paciente {patient}",
+    "¿Qué frecuencia cardiaca tenía el paciente {patient} en el examen físico?",
+    "Bisoprolol paciente {patient}",
+]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def run_phase(phase, workdir, args, extra=()):
+    """
+    Ejecuta una fase en un proceso nuevo dentro de workdir y devuelve su resultado (JSON en la última línea).
+    """
+    env = dict(os.environ, GEMINI_API_KEY="benchmark", LOG_LEVEL="WARNING", RESPONSE_CACHE_SIZE="0")
+    command = [
+        sys.executable, os.path.abspath(__file__), "--fase", phase, "--carpeta", workdir,
+        "--latencia-llm", str(args.latencia_llm), "--latencia-token", str(args.latencia_token),
+        "--latencia-embeddings", str(args.latencia_embeddings), *extra,
+    ]
+    completed = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"La fase '{phase}' falló:\n{completed.stderr[-4000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def import_app(args):
+    """
+    Importa app con Gemini simulado y espera al calentamiento. Devuelve (módulo, segundos hasta
+    que la importación termina, segundos hasta que el proceso está listo). fake_gemini ya ha importado
+    LlamaIndex, así que la importación no incluye ese tiempo.
+    """
+    import fake_gemini
+    fake_gemini.install(args.latencia_llm, args.latencia_token, args.latencia_embeddings)
+    started_at = time.perf_counter()
+    import app
+    imported_seconds = time.perf_counter() - started_at
+    app.warmup.wait()
+    if not app.warmup.ready:
+        raise RuntimeError(f"El calentamiento falló: {app.warmup.error}")
+    return app, imported_seconds, time.perf_counter() - started_at
+
+def ingest_phase(args):
+    """
+    Indexa el corpus de corpus/ en lotes sobre un servicio vacío, como /procesar_lote.
+    """
+    app, _, _ = import_app(args)
+    corpus_folder = os.path.join(args.carpeta, "corpus")
+    filenames = sorted(os.listdir(corpus_folder))
+    started_at = time.perf_counter()
+    for start in range(0, len(filenames), args.lote):
+        batch = []
+        for filename in filenames[start:start + args.lote]:
+            with open(os.path.join(corpus_folder, filename), "r", encoding="utf-8") as f:
+                text = f.read()
+            app.save_indexed_text(filename, text)
+            batch.append((filename, text))
+        app.upsert_indexed_documents(batch)
+    seconds = time.perf_counter() - started_at
+    snapshot = app.engine_snapshots.current()
+    return {
+        "ingesta_s": seconds,
+        "documentos_s": len(filenames) / seconds,
+        "nodos": len(snapshot.index.index_struct.nodes_dict),
+    }
+
+def serve_phase(args):
+    """
+    Reinicio con el índice persistido, consultas al chat y exportaciones a PDF.
+    """
+    app, import_seconds, startup_seconds = import_app(args)
+    client = app.app.test_client()
+    patients = sorted(app.engine_snapshots.current().patient_documents)
+
+    latencies = []
+    responses = []
+    for position in range(args.consultas):
+        patient = patients[(position * 7) % len(patients)]
+        message = CHAT_MESSAGES[position % len(CHAT_MESSAGES)].format(patient=patient)
+        # Texto único por consulta: ni la caché de respuestas ni la de embeddings de consultas la sirven.
+        message = f"{message} ({position})"
+        started_at = time.perf_counter()
+        response = client.post("/chat", json={"message": message})
+        latencies.append(time.perf_counter() - started_at)
+        if response.status_code != 200:
+            raise RuntimeError(f"/chat respondió {response.status_code}: {response.get_data(as_text=True)[:500]}")
+        responses.append(response.get_json()["response"])
+
+    started_at = time.perf_counter()
+    for position in range(args.exportaciones):
+        text = "\n".join(responses[(position + offset) % len(responses)] for offset in range(10))
+        response = client.post("/export_chat_response_pdf", json={"text_content": text})
+        if response.status_code != 200:
+            raise RuntimeError(f"/export_chat_response_pdf respondió {response.status_code}")
+    export_seconds = time.perf_counter() - started_at
+    return {
+        "importacion_s": import_seconds,
+        "arranque_s": startup_seconds,
+        "chat_p50_ms": percentile(latencies, 0.5) * 1000,
+        "chat_p99_ms": percentile(latencies, 0.99) * 1000,
+        "pdf_s": args.exportaciones / export_seconds,
+    }
+
+def prepare_workdir(documents, seed):
+    """
+    Carpeta temporal con el corpus sintético y las fuentes del proyecto (app las busca en ./fonts).
+    """
+    workdir = tempfile.mkdtemp(prefix=f"bench_servicio_{documents}_")
+    os.symlink(os.path.join(PROJECT_FOLDER, "fonts"), os.path.join(workdir, "fonts"))
+    write_corpus(os.path.join(workdir, "corpus"), generate_corpus(documents, seed))
+    return workdir
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documentos", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--consultas", type=int, default=200)
+    parser.add_argument("--exportaciones", type=int, default=50)
+    parser.add_argument("--lote", type=int, default=100, help="Documentos por lote de ingesta.")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--latencia-llm", type=float, default=0.0, help="Segundos hasta el primer token.")
+    parser.add_argument("--latencia-token", type=float, default=0.0, help="Segundos entre tokens.")
+    parser.add_argument("--latencia-embeddings", type=float, default=0.0, help="Segundos por llamada de embeddings.")
+    # Uso interno: fase ejecutada en un proceso nuevo.
+    parser.add_argument("--fase", choices=["ingesta", "servicio"], help=argparse.SUPPRESS)
+    parser.add_argument("--carpeta", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.fase:
+        result = ingest_phase(args) if args.fase == "ingesta" else serve_phase(args)
+        print(json.dumps(result))
+        return
+
+    print(
+        f"{'documentos':>10} {'nodos':>7} {'ingesta s':>10} {'docs/s':>8} {'import s':>9} {'arranque s':>11} "
+        f"{'chat p50 ms':>12} {'chat p99 ms':>12} {'PDF/s':>7}"
+    )
+    for documents in args.documentos:
+        workdir = prepare_workdir(documents, args.semilla)
+        extra = ["--lote", str(args.lote), "--consultas", str(args.consultas), "--exportaciones", str(args.exportaciones)]
+        ingest = run_phase("ingesta", workdir, args, extra)
+        serve = run_phase("servicio", workdir, args, extra)
+        print(
+            f"{documents:>10} {ingest['nodos']:>7} {ingest['ingesta_s']:>10.1f} {ingest['documentos_s']:>8.1f} "
+            f"{serve['importacion_s']:>9.2f} {serve['arranque_s']:>11.2f} {serve['chat_p50_ms']:>12.1f} {serve['chat_p99_ms']:>12.1f} {serve['pdf_s']:>7.1f}"
+        )
+        print(f"{'':>10} carpeta: {workdir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark de la búsqueda por similitud: SimpleVectorStore frente a NumpyVectorStore (float32 e int8),
+sin filtro y filtrando por paciente, con 1.000, 5.000 y 20.000 fragmentos de 768 dimensiones.
+
+Uso (desde la raíz del proyecto):
+    python benchmarks/bench_vector_store.py [--repeticiones 20] [--pacientes 200]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from llama_index.core.schema import NodeRelationship, RelatedNodeInfo, TextNode
+from llama_index.core.vector_stores import ExactMatchFilter, MetadataFilters
+from llama_index.core.vector_stores.simple import SimpleVectorStore
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from numpy_vector_store import NumpyVectorStore
+
+DIMENSION = 768 # text-embedding-004
+TOP_K = 2 # similarity_top_k por defecto de as_query_engine()
+
+def build_nodes(count, patients, rng):
+    nodes = []
+    for position in range(count):
+        filename = f"informe_{position // 10}.txt"
+        node = TextNode(
+            id_=f"nodo-{position}",
+            text="",
+            embedding=rng.standard_normal(DIMENSION).astype(np.float32).tolist(),
+            metadata={"patient_id": str(10000000 + position % patients), "filename": filename},
+        )
+        node.relationships[NodeRelationship.SOURCE] = RelatedNodeInfo(node_id=filename)
+        nodes.append(node)
+    return nodes
+
+def median_ms(fn, repetitions):
+    timings = []
+    for _ in range(repetitions):
+        started_at = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started_at)
+    return statistics.median(timings) * 1000, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--pacientes", type=int, default=200)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    print(f"{'nodos':>6} {'almacén':>8} {'sin filtro ms':>14} {'paciente ms':>12} {'recall@k':>9} {'MB en disco':>12} {'carga ms':>9}")
+    for count in (1000, 5000, 20000):
+        nodes = build_nodes(count, args.pacientes, rng)
+        queries = [
+            VectorStoreQuery(query_embedding=rng.standard_normal(DIMENSION).tolist(), similarity_top_k=TOP_K),
+            VectorStoreQuery(
+                query_embedding=rng.standard_normal(DIMENSION).tolist(),
+                similarity_top_k=TOP_K,
+                filters=MetadataFilters(filters=[ExactMatchFilter(key="patient_id", value="10000007")]),
+            ),
+        ]
+        simple = SimpleVectorStore()
+        simple.add(nodes)
+        expected = [simple.query(query).ids for query in queries]
+        stores = [("simple", simple)]
+        for quantization in ("float32", "int8"):
+            store = NumpyVectorStore(quantization=quantization)
+            store.add(nodes)
+            stores.append((quantization, store))
+
+        for name, store in stores:
+            with tempfile.TemporaryDirectory() as persist_dir:
+                store.persist(os.path.join(persist_dir, "default__vector_store.json"))
+                disk_mb = sum(os.path.getsize(os.path.join(persist_dir, f)) for f in os.listdir(persist_dir)) / 2**20
+                # Una sola carga: la del JSON de SimpleVectorStore tarda minutos con 20.000 nodos.
+                if isinstance(store, NumpyVectorStore):
+                    load_ms, _ = median_ms(lambda: NumpyVectorStore.from_persist_dir(persist_dir), 1)
+                else:
+                    load_ms, _ = median_ms(lambda: SimpleVectorStore.from_persist_dir(persist_dir), 1)
+            timings = []
+            recall = []
+            for query, expected_ids in zip(queries, expected):
+                elapsed_ms, result = median_ms(lambda: store.query(query), args.repeticiones)
+                timings.append(elapsed_ms)
+                recall.append(len(set(result.ids) & set(expected_ids)) / len(expected_ids))
+            print(
+                f"{count:>6} {name:>8} {timings[0]:>14.2f} {timings[1]:>12.2f} {statistics.mean(recall):>9.2f} "
+                f"{disk_mb:>12.1f} {load_ms:>9.1f}"
+            )
+
+if __name__ == "__main__":
+    main()
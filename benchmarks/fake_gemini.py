@@ -0,0 +1,123 @@
+"""
+Sustitutos locales y deterministas de GoogleGenAI y GoogleGenAIEmbedding para los benchmarks.
+
+No llaman a ninguna API: cada llamada espera la latencia configurada y devuelve siempre el mismo
+resultado para la misma entrada (vectores derivados del hash del texto, respuesta derivada del prompt).
+install() debe llamarse antes de importar app, que construye los modelos al arrancar.
+"""
+import hashlib
+import time
+from typing import Any
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.llms import CompletionResponse, CustomLLM, LLMMetadata
+from llama_index.core.llms.callbacks import llm_completion_callback
+
+EMBED_DIMENSION = 768 # text-embedding-004
+RESPONSE_WORDS = (
+    "El paciente presenta ritmo sinusal con frecuencia cardiaca media de 78 lpm, sin pausas significativas. "
+    "Se recomienda control en tres meses con los resultados de las pruebas complementarias."
+).split()
+
+
+def _seed(text):
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+
+
+class FakeGeminiLLM(CustomLLM):
+    """
+    LLM de chat con la latencia de Gemini simulada: latency segundos hasta el primer token y
+    token_latency entre tokens. La respuesta tiene entre 20 y 40 palabras, elegidas según el prompt.
+    """
+
+    model: str = Field(default="fake-gemini")
+    latency: float = Field(default=0.0, description="Segundos hasta el primer token.")
+    token_latency: float = Field(default=0.0, description="Segundos entre tokens en streaming.")
+
+    @classmethod
+    def class_name(cls):
+        return "FakeGeminiLLM"
+
+    @property
+    def metadata(self):
+        return LLMMetadata(context_window=1_000_000, num_output=8192, is_chat_model=True, model_name=self.model)
+
+    def _response_words(self, prompt):
+        seed = _seed(prompt)
+        count = 20 + seed % 21
+        return [RESPONSE_WORDS[(seed + position) % len(RESPONSE_WORDS)] for position in range(count)]
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        words = self._response_words(prompt)
+        time.sleep(self.latency + self.token_latency * len(words))
+        return CompletionResponse(text=" ".join(words))
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        words = self._response_words(prompt)
+
+        def gen():
+            time.sleep(self.latency)
+            text = ""
+            for position, word in enumerate(words):
+                if position:
+                    time.sleep(self.token_latency)
+                delta = word if not text else f" {word}"
+                text += delta
+                yield CompletionResponse(text=text, delta=delta)
+
+        return gen()
+
+
+class FakeGeminiEmbedding(BaseEmbedding):
+    """
+    Modelo de embeddings con vectores unitarios pseudoaleatorios derivados del hash del texto.
+    latency se espera una vez por llamada (un lote de embed_batch_size textos es una llamada).
+    """
+
+    latency: float = Field(default=0.0, description="Segundos por llamada a la API.")
+    dimension: int = Field(default=EMBED_DIMENSION)
+
+    @classmethod
+    def class_name(cls):
+        return "FakeGeminiEmbedding"
+
+    def _vector(self, text):
+        vector = np.random.default_rng(_seed(text)).standard_normal(self.dimension).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def _get_query_embedding(self, query):
+        time.sleep(self.latency)
+        return self._vector(query)
+
+    async def _aget_query_embedding(self, query):
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text):
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts):
+        time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+
+def install(llm_latency=0.0, token_latency=0.0, embed_latency=0.0):
+    """
+    Sustituye las clases de Gemini en los módulos de los que las importa app.
+    """
+    import llama_index.embeddings.google_genai.base as embeddings_module
+    import llama_index.llms.google_genai.base as llm_module
+
+    def fake_llm(model=None, **kwargs):
+        return FakeGeminiLLM(model=model or "fake-gemini", latency=llm_latency, token_latency=token_latency)
+
+    def fake_embedding(model_name=None, embed_batch_size=100, **kwargs):
+        return FakeGeminiEmbedding(
+            model_name=model_name or "fake-embedding", embed_batch_size=embed_batch_size, latency=embed_latency
+        )
+
+    llm_module.GoogleGenAI = fake_llm
+    embeddings_module.GoogleGenAIEmbedding = fake_embedding
@@ -0,0 +1,158 @@
+"""
+Generador de un corpus clínico sintético para los benchmarks, modelado sobre los textos de
+indexed_texts/: consultas cortas, informes con pruebas pendientes e informes de Holter extraídos
+de PDF (membrete y aviso legal repetidos en cada página, tabla de mediciones horarias).
+
+Uso (desde la raíz del proyecto):
+    python benchmarks/synthetic_corpus.py carpeta_destino --documentos 1000 [--semilla 1]
+"""
+import argparse
+import os
+import random
+
+FIRST_NAMES = ["Dionne", "José Manuel", "María", "Carmen", "Antonio", "Lucía", "Francisco", "Elena", "Javier", "Rosa", "Pablo", "Ana"]
+LAST_NAMES = ["Maldonado", "Álvarez", "Quiñones", "García", "Fernández", "López", "Martínez", "Suárez", "Menéndez", "Rodríguez", "Iglesias"]
+MONTHS = ["Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio", "Julio", "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"]
+REASONS = [
+    "Control cardiológico de rutina.", "Palpitaciones de dos semanas de evolución.", "Dolor torácico atípico.",
+    "Descartar patología potencialmente cardioembólica.", "Fatiga física y taquicardias.", "Síncope de perfil vasovagal.",
+]
+HISTORY = [
+    "Dislipemia", "HTA", "DM-II", "Enf. Parkinson", "Microangiopatía", "Hipotiroidismo", "EPOC leve", "Fibrilación auricular paroxística",
+]
+MEDICATIONS = [
+    "Adiro 100 mg", "Metformina 850 mg 1-0-1", "Omeprazol 20 mg", "Lisinopril 20mg 1-0-0", "Sinemet 25/250",
+    "Bisoprolol 2,5 mg", "Atorvastatina 40 mg", "Apixabán 5 mg cada 12 horas", "Levotiroxina 50 mcg",
+]
+ALLERGIES = ["Sin alertas conocidas.", "Penicilina.", "Alergia a AINEs.", "Intolerancia a la lactosa."]
+DIAGNOSES = [
+    "Palpitaciones de origen no determinado, probablemente benignas.", "Extrasístoles supraventriculares aisladas de baja densidad.",
+    "Ventrículo izquierdo de tamaño y función preservada.", "Esclerosis mitral y aórtica sin disfunción valvular.",
+    "Taquicardia paroxística supraventricular.", "Riesgo cardiovascular bajo.",
+]
+LETTERHEAD = (
+    "Dr. Mateos      INSTITUTO NEUROLÓGICO     www.doctormateos.com     Dr. Rodolfo Gutiérrez Caro   "
+    "Especialista en Cardiología   Colegiado 332405519"
+)
+LEGAL_NOTICE = (
+    "De conformidad con lo establecido en la normativa vigente en Protección de Datos de Carácter Personal, le "
+    "informamos que sus datos serán incorporados al sistema de tratamiento titularidad de CONSULTA DR. VALENTÍN "
+    "MATEOS MARCOS con la finalidad de poder atender los compromisos derivados de la relación que mantenemos con "
+    "usted. Podrá ejercer los derechos de acceso, rectificación, limitación de tratamiento, supresión, portabilidad "
+    "y oposición dirigiendo su petición a la dirección postal arriba indicada."
+)
+
+
+class SyntheticPatient:
+    def __init__(self, rng, position):
+        self.patient_id = str(20000000 + position * 7919 % 70000000)
+        self.name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {rng.choice(LAST_NAMES)}"
+        self.age = rng.randint(25, 90)
+        self.history = rng.sample(HISTORY, rng.randint(1, 4))
+        self.medications = rng.sample(MEDICATIONS, rng.randint(1, 5))
+        self.allergy = rng.choice(ALLERGIES)
+
+
+def _date(rng):
+    return f"{rng.randint(1, 28):02d} de {rng.choice(MONTHS)} de {rng.randint(2022, 2025)}"
+
+def consultation_report(rng, patient):
+    """
+    Consulta breve con los apartados en mayúsculas iniciales (como Dionne_14473217.txt).
+    """
+    heart_rate = rng.randint(55, 110)
+    return (
+        f"Paciente: {patient.name}  \nCédula: {patient.patient_id}  \n \nFecha: {_date(rng)}  \n"
+        f"Motivo de Consulta: {rng.choice(REASONS)}  \n"
+        f"Anamnesis: Paciente de {patient.age} años. Antecedentes: {', '.join(patient.history)}. "
+        f"Refiere episodios ocasionales de palpitaciones, no asociados a dolor torácico ni disnea.  \n"
+        f"Alergias: {patient.allergy}  \n"
+        f"Medicación actual: {'; '.join(patient.medications)}.  \n"
+        f"Examen Físico: Tensión Arterial: {rng.randint(105, 160)}/{rng.randint(60, 95)} mmHg. "
+        f"Frecuencia Cardíaca: {heart_rate} lpm. Auscultación cardíaca: ruidos rítmicos, sin soplos.  \n"
+        f"Electrocardiograma (ECG): Ritmo sinusal a {heart_rate} lpm, PR normal, QRS estrecho.  \n"
+        f"Impresión Diagnóstica: {rng.choice(DIAGNOSES)}  \n"
+        "Plan: \n1.  Monitoreo ambulatorio de presión arterial (MAPA) 24 horas.  \n2.  Ecodoppler cardíaco.  \n"
+        f"3.  Control en {rng.randint(1, 12)} meses con resultados.  \n"
+    )
+
+def pending_tests_report(rng, patient):
+    """
+    Informe con pruebas complementarias pendientes y conclusión (como Paciente_14473217.txt).
+    """
+    return (
+        f"Paciente: {patient.name}  \nCédula: {patient.patient_id}  \n \nFecha: {_date(rng)} \n"
+        f"Informe Médico: {rng.choice(REASONS)}  \n \n"
+        f"Anamnesis: Paciente de {patient.age} años que acude refiriendo fatiga desde hace "
+        f"{rng.randint(1, 8)} semanas, con episodios intermitentes de taquicardia en reposo.  \n"
+        f"Examen Físico: Tensión Arterial: {rng.randint(105, 160)}/{rng.randint(60, 95)} mmHg. "
+        f"Frecuencia Cardíaca: {rng.randint(60, 120)} lpm en reposo.  \n"
+        "Pruebas Complementarias Pendientes:  \n1.  Electrocardiograma (ECG) de 12 derivaciones.  \n"
+        "2.  Analítica de sangre completa (hemograma, función tiroidea, electrolitos, glucosa).  \n"
+        "3.  Holter de 24 horas para monitoreo de arritmias.  \n"
+        f"Conclusión  y Recomendaciones: {rng.choice(DIAGNOSES)} Se recomienda evitar estimulantes hasta obtener resultados.\n"
+    )
+
+def holter_report(rng, patient, pages=4):
+    """
+    Informe de Holter extraído de PDF: membrete y aviso legal en cada página, apartados en
+    mayúsculas y mediciones de frecuencia cardiaca por día (como el informe de Holter de indexed_texts/).
+    """
+    date = f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(2022, 2025)}"
+    parts = [
+        f"  {LETTERHEAD}       INFORME CLÍNICO   {patient.name.upper()} ID paciente {patient.patient_id} ({patient.age}  años)    "
+        f"MOTIVO DE CONSULTA {rng.choice(REASONS)}  ANTECEDENTES Alergias {patient.allergy} "
+        f"Antecedentes personales • FRCV: {', '.join(patient.history)}  "
+        f"Medicación previa {' '.join('•' + medication for medication in patient.medications)}  \n{LEGAL_NOTICE}",
+    ]
+    for page in range(2, pages + 1):
+        day_mean = rng.randint(60, 95)
+        parts.append(
+            f"{LETTERHEAD}   Página {page}/{pages} Holter ECG {date}\n"
+            f"IIIII{rng.randint(10, 23)}:{rng.randint(0, 59):02d} FC maxima(25 mm/s) FC: {day_mean + rng.randint(30, 60)}\n"
+            f"IIIII{rng.randint(10, 23)}:{rng.randint(0, 59):02d} FC Promedio(25 mm/s) FC: {day_mean}\n"
+            f"IIIII{rng.randint(0, 6)}:{rng.randint(0, 59):02d} FC Mínima(25 mm/s) FC: {day_mean - rng.randint(15, 30)}\n"
+            f"{LEGAL_NOTICE}"
+        )
+    parts.append(
+        f"{LETTERHEAD}   Holter ECG {date} (72 h) Ritmo sinusal con frecuencia cardiaca entre {rng.randint(45, 60)} y "
+        f"{rng.randint(110, 140)} lpm. Extrasístoles supraventriculares aisladas de baja densidad ({rng.randint(10, 900)} / 72h). "
+        f"DIAGNÓSTICO PRINCIPAL - {rng.choice(DIAGNOSES)}  - {rng.choice(DIAGNOSES)} "
+        "TRATAMIENTO RECOMENDACIONES Puede hacer vida normal por parte de cardiología."
+    )
+    return "\n".join(parts)
+
+REPORT_BUILDERS = (consultation_report, pending_tests_report, holter_report)
+
+def generate_corpus(documents, seed=1, reports_per_patient=3):
+    """
+    Lista de (nombre de archivo, texto) con `documents` informes de unos documents / reports_per_patient
+    pacientes. El mismo seed produce siempre el mismo corpus.
+    """
+    rng = random.Random(seed)
+    patients = [SyntheticPatient(rng, position) for position in range(max(1, documents // reports_per_patient))]
+    corpus = []
+    for position in range(documents):
+        patient = patients[position % len(patients)]
+        builder = REPORT_BUILDERS[position % len(REPORT_BUILDERS)]
+        corpus.append((f"sintetico_{position:05d}_{patient.patient_id}.txt", builder(rng, patient)))
+    return corpus
+
+def write_corpus(folder, corpus):
+    os.makedirs(folder, exist_ok=True)
+    for filename, text in corpus:
+        with open(os.path.join(folder, filename), "w", encoding="utf-8") as f:
+            f.write(text)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("carpeta")
+    parser.add_argument("--documentos", type=int, default=100)
+    parser.add_argument("--semilla", type=int, default=1)
+    args = parser.parse_args()
+    corpus = generate_corpus(args.documentos, args.semilla)
+    write_corpus(args.carpeta, corpus)
+    print(f"{len(corpus)} informes escritos en '{args.carpeta}' ({sum(len(text) for _, text in corpus) / 1024:.0f} KB).")
+
+if __name__ == "__main__":
+    main()
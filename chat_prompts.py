@@ -0,0 +1,116 @@
+import re
+
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from llama_index.core.prompts import ChatPromptTemplate
+from llama_index.core.schema import QueryBundle
+
+from context_assembly import estimate_tokens
+from intents import GENERAL_TEMPLATE
+
+# Instrucción de sistema: es la misma en todas las consultas, así que se envía a Gemini como
+# system_instruction (un prefijo estable) y no se repite en la pregunta ni se embebe.
+SYSTEM_PROMPT = (
+    "Eres un asistente médico virtual. Tu tarea es analizar los documentos proporcionados "
+    "y responder a las preguntas con la mayor precisión posible, extrayendo información relevante. "
+    "Siempre responde en español. No inventes información que no esté en los documentos."
+)
+PATIENT_FOCUS_INSTRUCTION = (
+    "**ATENCIÓN: CONCÉNTRATE ESTRICTAMENTE en la información del paciente con ID '{patient}'.** "
+    "IGNORA Y OMITE cualquier dato que no esté **DIRECTAMENTE** relacionado con este ID de paciente, incluso si aparece en el contexto. "
+    "Si la información solicitada para este paciente específico NO se encuentra en los documentos, "
+    "responde ÚNICAMENTE: 'Lo siento, no se encontró información relevante para el paciente con ID {patient} en los documentos disponibles.' "
+    "NO te refieras a otros IDs."
+)
+NO_PATIENT_INSTRUCTION = "Si la pregunta no especifica un ID de paciente, responde basándote en toda la información disponible."
+
+# Plantillas del sintetizador de respuestas (modo compact de LlamaIndex), construidas una sola vez.
+CHAT_QA_TEMPLATE = ChatPromptTemplate([
+    ChatMessage(role=MessageRole.SYSTEM, content=SYSTEM_PROMPT),
+    ChatMessage(
+        role=MessageRole.USER,
+        content=(
+            "Información de los documentos:\n"
+            "---------------------\n"
+            "{context_str}\n"
+            "---------------------\n"
+            "Con esta información y no con conocimientos previos, responde a la solicitud.\n"
+            "{query_str}"
+        ),
+    ),
+])
+CHAT_REFINE_TEMPLATE = ChatPromptTemplate([
+    ChatMessage(role=MessageRole.SYSTEM, content=SYSTEM_PROMPT),
+    ChatMessage(
+        role=MessageRole.USER,
+        content=(
+            "Solicitud: {query_str}\n"
+            "Respuesta provisional: {existing_answer}\n"
+            "Más información de los documentos:\n"
+            "------------\n"
+            "{context_msg}\n"
+            "------------\n"
+            "Mejora la respuesta provisional con esta información solo si aporta algo; si no, repítela tal cual."
+        ),
+    ),
+])
+
+# Parte fija de CHAT_QA_TEMPLATE (sistema y texto de la plantilla, sin el contexto ni la solicitud).
+QA_TEMPLATE_TOKENS = sum(estimate_tokens(message.content) for message in CHAT_QA_TEMPLATE.message_templates)
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+class ChatRequest:
+    """
+    Consulta del chat separada en sus partes:
+
+    - retrieval_query: lo que se busca en el índice (la pregunta del usuario sin la referencia al
+      paciente, que se aplica como filtro, más el tema de la acción). Es lo único que se embebe.
+    - instruction: la solicitud para Gemini (foco en el paciente, plantilla de la acción y pregunta);
+      va en el mensaje del usuario, después del contexto recuperado.
+    - patient_id e intent (None para una pregunta general).
+    - sections: secciones de los informes en las que busca la acción (None: en todo el documento).
+    """
+
+    def __init__(self, user_message, retrieval_query, instruction, patient_id=None, intent=None):
+        self.user_message = user_message
+        self.retrieval_query = retrieval_query
+        self.instruction = instruction
+        self.patient_id = patient_id
+        self.intent = intent
+        self.sections = intent.sections if intent is not None else None
+
+    def query_bundle(self):
+        """
+        QueryBundle para el motor de consulta: el sintetizador recibe la instrucción y el retriever
+        embebe (y busca con BM25) solo la consulta de recuperación.
+        """
+        return QueryBundle(query_str=self.instruction, custom_embedding_strs=[self.retrieval_query])
+
+    def prompt_tokens(self):
+        """
+        Tokens aproximados del prompt sin el contexto: sistema, plantilla e instrucción.
+        """
+        return QA_TEMPLATE_TOKENS + estimate_tokens(self.instruction)
+
+
+def build_retrieval_query(user_message, patient_mentions=(), intent=None):
+    """
+    Texto de búsqueda de una consulta: el mensaje sin las menciones del paciente (la búsqueda ya se
+    limita a sus nodos) y, para una acción, su tema ('Resumen de historia clínica').
+    """
+    query = user_message
+    for mention in patient_mentions:
+        query = query.replace(mention, " ")
+    query = WHITESPACE_PATTERN.sub(" ", query).strip()
+    if intent is not None:
+        query = f"{intent.topic} {query}".strip()
+    return query or user_message
+
+def build_instruction(user_message, patient_id=None, intent=None):
+    """
+    Solicitud para Gemini: foco en el paciente (o en todo el corpus) y plantilla de la acción.
+    """
+    focus = PATIENT_FOCUS_INSTRUCTION.format(patient=patient_id) if patient_id else NO_PATIENT_INSTRUCTION
+    if intent is not None:
+        return intent.build_prompt(focus, patient_id, user_message)
+    return GENERAL_TEMPLATE.format(base=focus, message=user_message)
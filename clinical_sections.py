@@ -0,0 +1,150 @@
+import re
+from typing import Any, List, Sequence
+
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.node_parser import NodeParser, SentenceSplitter
+from llama_index.core.node_parser.node_utils import build_nodes_from_splits
+from llama_index.core.schema import BaseNode, MetadataMode
+
+# Se incrementa al cambiar los encabezados o el troceo, para que los documentos se vuelvan a indexar.
+SECTION_PARSER_VERSION = 1
+# Sección del texto anterior al primer encabezado (datos del paciente, fecha, membrete).
+HEADER_SECTION = "encabezado"
+# Sección -> encabezados que la abren, sin tildes ni mayúsculas (se reconocen con o sin ellas).
+# Los subapartados ('Medicación previa' dentro de ANTECEDENTES) abren su propia sección.
+SECTION_HEADINGS = {
+    "motivo_consulta": ["motivo de consulta", "informe medico"],
+    "antecedentes": [
+        "antecedentes", "antecedentes familiares", "antecedentes personales", "anamnesis",
+        "historia actual", "enfermedad actual",
+    ],
+    "alergias": ["alergias", "alergias e intolerancias"],
+    "medicacion": ["medicacion", "medicacion previa", "medicacion actual", "tratamiento actual", "tratamiento habitual"],
+    "exploracion": ["exploracion fisica", "examen fisico"],
+    "electrocardiograma": ["electrocardiograma", "electrocardiograma (ecg)", "ecg"],
+    "pruebas": [
+        "pruebas complementarias", "resumen pruebas complementarias", "pruebas complementarias pendientes",
+        "ecocardiografia transtoracica", "ecocardiograma", "pruebas de imagen",
+    ],
+    "analiticas": ["analitica", "analiticas", "analitica de sangre", "laboratorio"],
+    "diagnostico": [
+        "diagnostico", "diagnosticos", "diagnostico principal", "diagnosticos secundarios",
+        "impresion diagnostica", "juicio clinico", "conclusion", "conclusiones", "conclusion y recomendaciones",
+    ],
+    "tratamiento": ["tratamiento", "plan", "plan de tratamiento", "recomendaciones"],
+}
+
+ACCENTED_VOWELS = {"a": "aá", "e": "eé", "i": "ií", "o": "oó", "u": "uúü", "n": "nñ"}
+# Encabezados que también son palabras corrientes: solo cuentan en mayúsculas o seguidos de dos
+# puntos ('Plan:', 'TRATAMIENTO'), no al empezar una frase ('Tratamiento con...', 'ECG 27/05/2025').
+COLON_OR_UPPERCASE_HEADINGS = {
+    "ecg", "plan", "tratamiento", "diagnostico", "conclusion", "recomendaciones", "medicacion",
+    "analitica", "laboratorio", "ecocardiograma", "electrocardiograma",
+}
+COLON_HEADINGS = {"ecg"}
+# A un encabezado le siguen dos puntos, una viñeta, un guion o una mayúscula.
+HEADING_START = r"(?:^|(?<=\s))"
+HEADING_END = r"(?=\s*:|\s*•|\s+-\s|\s+[A-ZÁÉÍÓÚÑ0-9])"
+# Un encabezado que no está en mayúsculas tiene que empezar el texto o una línea, o ir tras dos
+# espacios, un punto u otro encabezado en mayúsculas ('ANTECEDENTES Alergias'). En mayúsculas basta
+# un espacio: la extracción del PDF junta las líneas ('...bradiarritmias DIAGNÓSTICO PRINCIPAL - ...').
+STRONG_START_PATTERN = re.compile(r"(?:\n|\s\s|[.:;]\s|[A-ZÁÉÍÓÚÑ]\s)$")
+# Un elemento de una lista numerada ('1.  Electrocardiograma de 12 derivaciones') no es un
+# encabezado; una cifra al final de una frase ('Paciente 55555555.') no es una lista.
+NUMBERED_ITEM_PATTERN = re.compile(r"(?:^|\s)\d{1,2}[.)][ \t]{1,2}$")
+
+
+def _heading_pattern(heading):
+    """
+    Patrón de un encabezado que admite tildes, mayúsculas y espacios repetidos ('Conclusión  y Recomendaciones').
+    """
+    parts = []
+    for char in heading:
+        if char == " ":
+            parts.append(r"\s+")
+        elif char in ACCENTED_VOWELS:
+            parts.append(f"[{ACCENTED_VOWELS[char]}]")
+        else:
+            parts.append(re.escape(char))
+    return "".join(parts)
+
+_HEADING_SECTIONS = {heading: section for section, headings in SECTION_HEADINGS.items() for heading in headings}
+# Los encabezados más largos primero: 'Medicación previa' antes que 'Medicación'.
+HEADING_PATTERN = re.compile(
+    HEADING_START
+    + "((?i:" + "|".join(_heading_pattern(heading) for heading in sorted(_HEADING_SECTIONS, key=len, reverse=True)) + "))"
+    + HEADING_END
+)
+COLON_AFTER_PATTERN = re.compile(r"\s*:")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def _fold_heading(text):
+    text = WHITESPACE_PATTERN.sub(" ", text.lower())
+    return text.translate(str.maketrans("áéíóúüñ", "aeiouun"))
+
+def split_sections(text):
+    """
+    Divide el texto de un informe por sus encabezados.
+    Devuelve una lista de (sección, texto) en orden; cada texto empieza por su encabezado.
+    Solo cuentan los encabezados que empiezan por mayúscula ('Tratamiento:', 'TRATAMIENTO'), no la
+    palabra dentro de una frase ('inicia tratamiento con...'). Un encabezado sin texto propio
+    ('ANTECEDENTES' seguido de 'Alergias ...') se une a la sección siguiente.
+    """
+    sections = []
+    start = 0
+    body_start = 0
+    section = HEADER_SECTION
+    for match in HEADING_PATTERN.finditer(text):
+        heading = match.group(1)
+        if not heading[0].isupper():
+            continue
+        folded_heading = _fold_heading(heading)
+        uppercase = heading.isupper()
+        has_colon = COLON_AFTER_PATTERN.match(text, match.end()) is not None
+        if folded_heading in COLON_HEADINGS and not has_colon:
+            continue
+        if folded_heading in COLON_OR_UPPERCASE_HEADINGS and not (has_colon or uppercase):
+            continue
+        if not uppercase and match.start() > 0 and not STRONG_START_PATTERN.search(text, 0, match.start()):
+            continue
+        if NUMBERED_ITEM_PATTERN.search(text, max(match.start() - 6, 0), match.start()):
+            continue
+        if text[body_start:match.start()].strip():
+            sections.append((section, text[start:match.start()].strip()))
+            start = match.start()
+        body_start = match.end()
+        section = _HEADING_SECTIONS[folded_heading]
+    if text[start:].strip():
+        sections.append((section, text[start:].strip()))
+    return sections
+
+
+class ClinicalSectionParser(NodeParser):
+    """
+    Troceador de informes clínicos: corta primero por los encabezados ('MOTIVO DE CONSULTA',
+    'ANTECEDENTES', 'EXPLORACIÓN FÍSICA', 'DIAGNÓSTICO PRINCIPAL', 'TRATAMIENTO'...) y solo divide
+    con SentenceSplitter las secciones que no caben en un nodo. Cada nodo lleva su sección en
+    el metadato 'section', para que las acciones del chat busquen solo en las secciones que les
+    corresponden.
+    """
+
+    chunk_size: int = Field(default=1024, description="Tokens máximos por nodo.")
+    chunk_overlap: int = Field(default=50, description="Solapamiento entre los nodos de una misma sección.")
+
+    @classmethod
+    def class_name(cls):
+        return "ClinicalSectionParser"
+
+    def _parse_nodes(self, nodes: Sequence[BaseNode], show_progress: bool = False, **kwargs: Any) -> List[BaseNode]:
+        splitter = SentenceSplitter(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
+        all_nodes = []
+        for node in nodes:
+            metadata_str = node.get_metadata_str(MetadataMode.EMBED)
+            for section, section_text in split_sections(node.get_content(metadata_mode=MetadataMode.NONE)):
+                splits = splitter.split_text_metadata_aware(section_text, metadata_str=f"{metadata_str}\nsection: {section}")
+                section_nodes = build_nodes_from_splits(splits, node, id_func=self.id_func)
+                for section_node in section_nodes:
+                    section_node.metadata["section"] = section
+                all_nodes.extend(section_nodes)
+        return all_nodes
@@ -0,0 +1,164 @@
+from typing import List, Optional
+
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+
+from lexical_index import tokenize
+from metrics import stage_timer
+from text_normalization import segment_fingerprint, split_segments
+
+# Gemini no publica su tokenizador: se estima un token cada 4 caracteres (texto en español).
+CHARS_PER_TOKEN = 4
+# Dos frases son casi iguales si comparten esta proporción de términos (Jaccard).
+DUPLICATE_SIMILARITY = 0.8
+# Contexto mínimo aunque el prompt ocupe casi todo el presupuesto de la petición.
+MIN_CONTEXT_TOKENS = 200
+# Por debajo de estos términos solo se eliminan las frases idénticas ('Normal.', 'Sin cambios.').
+MIN_TERMS_FOR_SIMILARITY = 4
+
+
+def estimate_tokens(text):
+    """
+    Tokens aproximados de un texto para Gemini.
+    """
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class _Sentence:
+    def __init__(self, node_rank, block, position, text):
+        self.node_rank = node_rank
+        self.block = block
+        self.position = position
+        self.text = text
+        self.terms = frozenset(tokenize(text))
+        # Cifras, dosis y fechas: dos frases con valores distintos nunca son duplicadas.
+        self.values = frozenset(term for term in self.terms if any(char.isdigit() for char in term))
+        self.fingerprint = segment_fingerprint(text)
+        self.relevance = 0
+        self.tokens = estimate_tokens(text) + 1
+
+
+class ContextAssembler(BaseNodePostprocessor):
+    """
+    Etapa de montaje del contexto entre la recuperación y Gemini:
+
+    1. Divide cada nodo recuperado en frases (mismos bloques y frases que la normalización).
+    2. Elimina las frases repetidas o casi iguales (Jaccard de términos >= DUPLICATE_SIMILARITY y
+       las mismas cifras), entre nodos y dentro de un mismo nodo. Las lecturas horarias de un Holter
+       ('media 61 lpm', 'media 62 lpm') no son duplicadas.
+    3. Si el contexto supera token_budget, conserva las frases con más términos de la consulta de
+       recuperación (a igualdad, las de los nodos mejor puntuados y las primeras) hasta llenarlo.
+    4. Vuelve a montar cada nodo con sus frases en el orden original; los nodos sin frases se descartan.
+
+    Cada motor de consulta usa su propia instancia, así que report describe la última consulta.
+    """
+
+    token_budget: int = Field(default=2000, description="Tokens máximos del contexto enviado a Gemini.")
+    duplicate_similarity: float = Field(default=DUPLICATE_SIMILARITY)
+    _report: dict = PrivateAttr(default_factory=dict)
+
+    @classmethod
+    def class_name(cls):
+        return "ContextAssembler"
+
+    @property
+    def report(self):
+        return dict(self._report)
+
+    def _postprocess_nodes(self, nodes: List[NodeWithScore], query_bundle: Optional[QueryBundle] = None) -> List[NodeWithScore]:
+        with stage_timer("montaje_contexto"):
+            return self._assemble_context(nodes, query_bundle)
+
+    def _assemble_context(self, nodes, query_bundle):
+        query_terms = set(tokenize(" ".join(query_bundle.embedding_strs))) if query_bundle is not None else set()
+        sentences = []
+        # Los metadatos que ve el LLM (archivo, paciente) también ocupan contexto.
+        node_overheads = [estimate_tokens(n.node.get_metadata_str(MetadataMode.LLM)) + 2 for n in nodes]
+        overhead_tokens = sum(node_overheads)
+        for node_rank, node_with_score in enumerate(nodes):
+            node = node_with_score.node
+            for block_number, segments in enumerate(split_segments(node.get_content())):
+                for segment in segments:
+                    sentences.append(_Sentence(node_rank, block_number, len(sentences), segment))
+        tokens_before = overhead_tokens + sum(sentence.tokens for sentence in sentences)
+
+        unique = self._remove_duplicates(sentences)
+        for sentence in unique:
+            sentence.relevance = len(sentence.terms & query_terms)
+        kept = unique
+        available = self.token_budget - overhead_tokens
+        if overhead_tokens + sum(sentence.tokens for sentence in unique) > self.token_budget:
+            kept = []
+            used = 0
+            for sentence in sorted(unique, key=lambda s: (-s.relevance, s.node_rank, s.position)):
+                if used + sentence.tokens > available:
+                    continue
+                kept.append(sentence)
+                used += sentence.tokens
+            if not kept and unique:
+                # Ni la frase más relevante cabe entera: se recorta.
+                best = min(unique, key=lambda s: (-s.relevance, s.node_rank, s.position))
+                best.text = best.text[: max(available, 1) * CHARS_PER_TOKEN]
+                best.tokens = estimate_tokens(best.text)
+                kept = [best]
+
+        assembled = self._assemble(nodes, kept)
+        sent_node_ranks = {sentence.node_rank for sentence in kept}
+        self._report = {
+            "nodos_recuperados": len(nodes),
+            "nodos_enviados": len(assembled),
+            "frases_recuperadas": len(sentences),
+            "frases_duplicadas": len(sentences) - len(unique),
+            "frases_enviadas": len(kept),
+            "tokens_contexto_recuperado": tokens_before,
+            "tokens_contexto": sum(node_overheads[rank] for rank in sent_node_ranks) + sum(sentence.tokens for sentence in kept),
+            "presupuesto_contexto": self.token_budget,
+        }
+        return assembled
+
+    def _remove_duplicates(self, sentences):
+        """
+        Frases sin las repetidas: se conserva la primera aparición (la del nodo mejor puntuado).
+        """
+        unique = []
+        fingerprints = set()
+        # Cifras de la frase -> términos de las frases conservadas con esas mismas cifras.
+        term_sets = {}
+        for sentence in sentences:
+            if sentence.fingerprint in fingerprints:
+                continue
+            similar = term_sets.get(sentence.values, [])
+            if len(sentence.terms) >= MIN_TERMS_FOR_SIMILARITY and any(
+                len(sentence.terms & terms) >= self.duplicate_similarity * len(sentence.terms | terms) for terms in similar
+            ):
+                continue
+            fingerprints.add(sentence.fingerprint)
+            if len(sentence.terms) >= MIN_TERMS_FOR_SIMILARITY:
+                term_sets.setdefault(sentence.values, []).append(sentence.terms)
+            unique.append(sentence)
+        return unique
+
+    @staticmethod
+    def _assemble(nodes, kept):
+        """
+        Copias de los nodos con solo sus frases conservadas (los nodos del docstore no se modifican).
+        """
+        kept_by_node = {}
+        for sentence in sorted(kept, key=lambda s: s.position):
+            kept_by_node.setdefault(sentence.node_rank, []).append(sentence)
+        assembled = []
+        for node_rank, node_sentences in sorted(kept_by_node.items()):
+            node_with_score = nodes[node_rank]
+            lines = []
+            block = None
+            for sentence in node_sentences:
+                if sentence.block == block:
+                    lines[-1] += " " + sentence.text
+                else:
+                    lines.append(sentence.text)
+                    block = sentence.block
+            node = node_with_score.node.model_copy()
+            node.set_content("\n".join(lines))
+            assembled.append(NodeWithScore(node=node, score=node_with_score.score))
+        return assembled
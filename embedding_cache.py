@@ -0,0 +1,152 @@
+import hashlib # Para derivar la clave de caché a partir del contenido del fragmento
+import os
+import sqlite3 # Almacén persistente y sin dependencias externas para la caché
+import threading
+from array import array # Para serializar los vectores como float32 compactos
+from typing import Any
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from pydantic import PrivateAttr
+
+from context_assembly import estimate_tokens
+from metrics import stage_timer
+
+
+class EmbeddingCacheStore:
+    """
+    Caché persistente de embeddings en SQLite, indexada por el hash del contenido.
+    Un fragmento que ya se embebió una vez no vuelve a enviarse a la API.
+    """
+
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        # Vectores encontrados y no encontrados en la caché desde el arranque (métricas).
+        self.hits = 0
+        self.misses = 0
+        # Flask atiende peticiones en varios hilos: la conexión se comparte protegida por el lock.
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model_name, kind, text):
+        """
+        Clave de caché: modelo + tipo (texto o consulta) + hash SHA-256 del contenido.
+        """
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{model_name}:{kind}:{digest}"
+
+    def get_many(self, keys):
+        """
+        Devuelve un diccionario clave -> vector con las claves presentes en la caché.
+        """
+        found = {}
+        if not keys:
+            return found
+        with self._lock:
+            # SQLite limita el número de parámetros por consulta: se consulta en bloques.
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+        return found
+
+    def put_many(self, items):
+        """
+        Guarda pares (clave, vector) en la caché.
+        """
+        if not items:
+            return
+        rows = [(key, array("f", vector).tobytes()) for key, vector in items]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Envoltorio de un modelo de embeddings que consulta la caché antes de llamar a la API.
+    Solo los fragmentos que no están en la caché se envían al modelo subyacente, en lotes.
+    Con governor (gemini_client.GeminiGovernor) cada lote es una llamada regulada, y los lotes
+    idénticos pedidos a la vez por varios hilos se embeben una sola vez.
+    """
+
+    _inner: BaseEmbedding = PrivateAttr()
+    _store: EmbeddingCacheStore = PrivateAttr()
+    _governor: Any = PrivateAttr(default=None)
+
+    def __init__(self, inner_model, store, governor=None, **kwargs):
+        super().__init__(
+            model_name=inner_model.model_name,
+            embed_batch_size=inner_model.embed_batch_size,
+            **kwargs,
+        )
+        self._inner = inner_model
+        self._store = store
+        self._governor = governor
+
+    @classmethod
+    def class_name(cls):
+        return "CachedEmbedding"
+
+    def _cached_embeddings(self, kind, texts, compute_fn):
+        keys = [EmbeddingCacheStore.make_key(self.model_name, kind, text) for text in texts]
+        cached = self._store.get_many(keys)
+
+        missing_texts = []
+        missing_keys = []
+        seen = set()
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in seen:
+                seen.add(key)
+                missing_keys.append(key)
+                missing_texts.append(text)
+
+        for start in range(0, len(missing_texts), self.embed_batch_size):
+            batch_keys = missing_keys[start:start + self.embed_batch_size]
+            batch_texts = missing_texts[start:start + self.embed_batch_size]
+            with stage_timer("embeddings"):
+                new_vectors = self._compute(compute_fn, batch_keys, batch_texts)
+            new_items = list(zip(batch_keys, new_vectors))
+            self._store.put_many(new_items)
+            cached.update(new_items)
+
+        return [cached[key] for key in keys]
+
+    def _compute(self, compute_fn, keys, texts):
+        if self._governor is None:
+            return compute_fn(texts)
+        key = keys[0] if len(keys) == 1 else hashlib.sha256("\n".join(keys).encode("utf-8")).hexdigest()
+        return self._governor.call(
+            "embeddings", lambda: compute_fn(texts), tokens=sum(estimate_tokens(text) for text in texts), key=key
+        )
+
+    def _get_query_embedding(self, query):
+        return self._cached_embeddings(
+            "query", [query], lambda texts: [self._inner.get_query_embedding(texts[0])]
+        )[0]
+
+    async def _aget_query_embedding(self, query):
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text):
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts):
+        return self._cached_embeddings(
+            "text", texts, lambda missing: self._inner.get_text_embedding_batch(missing)
+        )
@@ -0,0 +1,169 @@
+import hashlib
+import logging
+import threading
+
+# LlamaIndex y los módulos que dependen de él se importan al usarlos: app crea el EngineSnapshotHolder
+# al importarse y el índice se carga después, durante el calentamiento.
+
+logger = logging.getLogger(__name__)
+
+# Modos de recuperación de HybridRetriever (retrieval_options["mode"]).
+RETRIEVAL_MODES = ("hybrid", "vector", "lexical")
+
+
+def documents_version(indexed_documents, filenames):
+    """
+    Versión de un conjunto de documentos indexados: hash de sus nombres y hashes de contenido.
+    Es estable entre reinicios y cambia en cuanto se inserta, reemplaza o elimina uno de ellos.
+    """
+    entries = "\n".join(f"{filename}:{indexed_documents.get(filename)}" for filename in sorted(filenames))
+    return hashlib.sha256(entries.encode("utf-8")).hexdigest()[:16]
+
+def _copy_collections(data):
+    """
+    Copia los diccionarios de colección de un SimpleKVStore compartiendo sus valores, salvo las
+    entradas de ref_doc_info (node_ids y metadata se modifican en el sitio).
+    """
+    copied = {}
+    for collection, entries in data.items():
+        if collection.endswith("/ref_doc_info"):
+            copied[collection] = {
+                key: {**value, "node_ids": list(value.get("node_ids", [])), "metadata": dict(value.get("metadata") or {})}
+                for key, value in entries.items()
+            }
+        else:
+            copied[collection] = dict(entries)
+    return copied
+
+def clone_index(index):
+    """
+    Copia de trabajo de un índice en memoria para modificarla sin afectar a las consultas en curso.
+
+    La copia es superficial (copia en escritura): los nodos del docstore y las estructuras del
+    index store se comparten con el original, porque LlamaIndex los sustituye al modificarlos en
+    lugar de editarlos en el sitio; solo se copian los diccionarios de cada colección y las
+    entradas de ref_doc_info, cuyas listas node_ids sí se modifican en el sitio al insertar o
+    eliminar nodos. Así una subida copia referencias, no el texto ni los metadatos de cada nodo. Los vectores
+    tampoco se copian: NumpyVectorStore comparte sus arrays (nunca los modifica en el sitio) y de
+    SimpleVectorStore solo se copian los diccionarios, porque los embeddings solo se añaden o eliminan.
+    """
+    from llama_index.core import StorageContext, load_index_from_storage
+    from llama_index.core.storage.docstore import SimpleDocumentStore
+    from llama_index.core.storage.index_store import SimpleIndexStore
+    from llama_index.core.vector_stores.simple import SimpleVectorStore, SimpleVectorStoreData
+
+    storage_context = index.storage_context
+    vector_store = storage_context.vector_store
+    if isinstance(vector_store, SimpleVectorStore):
+        vector_data = vector_store.data
+        vector_store = SimpleVectorStore(
+            data=SimpleVectorStoreData(
+                embedding_dict=dict(vector_data.embedding_dict),
+                text_id_to_ref_doc_id=dict(vector_data.text_id_to_ref_doc_id),
+                metadata_dict=dict(vector_data.metadata_dict or {}),
+            )
+        )
+    else:
+        vector_store = vector_store.clone()
+    cloned_context = StorageContext.from_defaults(
+        docstore=SimpleDocumentStore.from_dict(_copy_collections(storage_context.docstore.to_dict())),
+        index_store=SimpleIndexStore.from_dict(_copy_collections(storage_context.index_store.to_dict())),
+        vector_store=vector_store,
+    )
+    return load_index_from_storage(cloned_context, index_id=index.index_id)
+
+
+class EngineSnapshot:
+    """
+    Estado del índice publicado para las consultas: índice, índice léxico (BM25), documentos,
+    partición por paciente y versiones. No se modifica una vez publicado; cada petición del chat
+    toma el snapshot vigente al empezar y lo usa hasta terminar, aunque entretanto se publique otro.
+    """
+
+    def __init__(self, version, index=None, indexed_documents=None, document_patients=None,
+                 previous_lexical_index=None, retrieval_options=None):
+        self.version = version
+        self.index = index
+        # Opciones de HybridRetriever (mode, similarity_top_k, alpha).
+        self.retrieval_options = dict(retrieval_options or {})
+        # Nombre de archivo indexado -> hash del contenido, y -> ID de paciente.
+        self.indexed_documents = dict(indexed_documents or {})
+        self.document_patients = dict(document_patients or {})
+        patient_documents = {}
+        for filename, patient_id in self.document_patients.items():
+            patient_documents.setdefault(patient_id, set()).add(filename)
+        self.patient_documents = {patient_id: frozenset(filenames) for patient_id, filenames in patient_documents.items()}
+        # Versión del índice por paciente (y global, para consultas sin paciente).
+        self.patient_index_versions = {
+            patient_id: documents_version(self.indexed_documents, filenames)
+            for patient_id, filenames in self.patient_documents.items()
+        }
+        self.global_index_version = documents_version(self.indexed_documents, self.indexed_documents)
+        # Índice léxico de los nodos: solo se tokenizan los que no estaban en el snapshot anterior.
+        self.lexical_index = None
+        if index is not None and self.retrieval_options.get("mode") != "vector":
+            from lexical_index import LexicalIndex
+            self.lexical_index = LexicalIndex.from_index(index, previous_lexical_index)
+
+    @property
+    def available(self):
+        # Sin documentos el chatbot no está disponible, igual que al arrancar con la carpeta vacía.
+        return self.index is not None and bool(self.indexed_documents)
+
+    def get_index_version(self, patient_id):
+        """
+        Versión del índice que afecta a una consulta: la del paciente o, sin paciente, la global.
+        """
+        if patient_id:
+            return self.patient_index_versions.get(patient_id, "")
+        return self.global_index_version
+
+    def get_query_engine(self, patient_id, streaming=False, node_postprocessors=None, sections=None):
+        """
+        Motor de consulta con recuperación híbrida (vectores y BM25) que solo recupera nodos del
+        paciente indicado. Si el ID no corresponde a ningún paciente indexado se busca en todo el índice.
+        Se consulta con ChatRequest.query_bundle(): la búsqueda usa la consulta de recuperación y
+        Gemini recibe el prompt de sistema y la instrucción. Con streaming=True el motor devuelve la
+        respuesta token a token. node_postprocessors se aplican a los nodos recuperados (ContextAssembler).
+        Con sections solo se buscan nodos de esas secciones de los informes (si no hay ninguno, en todos).
+        """
+        if not self.available:
+            return None
+        from llama_index.core.query_engine import RetrieverQueryEngine
+        from chat_prompts import CHAT_QA_TEMPLATE, CHAT_REFINE_TEMPLATE
+        from lexical_index import HybridRetriever
+
+        if patient_id not in self.patient_documents:
+            patient_id = None
+        retriever = HybridRetriever(self.index, self.lexical_index, patient_id, sections, **self.retrieval_options)
+        return RetrieverQueryEngine.from_args(
+            retriever, streaming=streaming, node_postprocessors=node_postprocessors,
+            text_qa_template=CHAT_QA_TEMPLATE, refine_template=CHAT_REFINE_TEMPLATE,
+        )
+
+
+class EngineSnapshotHolder:
+    """
+    Referencia al snapshot vigente. Las lecturas no toman ningún bloqueo (leer el atributo es
+    atómico); publicar un snapshot nuevo lo sustituye de una vez con un número de versión mayor.
+    Las reconstrucciones trabajan sobre una copia (clone_index) y solo publican si terminan bien:
+    si fallan, las consultas siguen usando el snapshot anterior.
+    """
+
+    def __init__(self, retrieval_options=None):
+        self._lock = threading.Lock()
+        self._retrieval_options = dict(retrieval_options or {})
+        self._current = EngineSnapshot(0, retrieval_options=self._retrieval_options)
+
+    def current(self):
+        return self._current
+
+    def publish(self, index, indexed_documents, document_patients):
+        with self._lock:
+            snapshot = EngineSnapshot(
+                self._current.version + 1, index, indexed_documents, document_patients,
+                self._current.lexical_index, self._retrieval_options,
+            )
+            self._current = snapshot
+        logger.info(f"Snapshot del índice v{snapshot.version} publicado ({len(snapshot.indexed_documents)} documentos).")
+        return snapshot
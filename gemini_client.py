@@ -0,0 +1,441 @@
+import asyncio
+import hashlib
+import logging
+import math
+import random
+import re
+import threading
+import time
+from typing import Any, Sequence
+
+from llama_index.core.base.llms.types import ChatMessage
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.instrumentation import get_dispatcher
+from llama_index.core.instrumentation.event_handlers import BaseEventHandler
+from llama_index.core.llms import LLM
+
+import metrics
+from context_assembly import estimate_tokens
+from metrics import STAGE_SECONDS, stage_timer
+
+logger = logging.getLogger(__name__)
+
+# Códigos HTTP que indican un fallo transitorio de Gemini: cuota agotada (429) y errores del servidor.
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# Estados de google.genai y textos de error equivalentes cuando la excepción no trae el código.
+RETRYABLE_ERROR_PATTERN = re.compile(r"\b(?:429|500|502|503|504)\b|RESOURCE_EXHAUSTED|UNAVAILABLE|DEADLINE_EXCEEDED")
+# Espera sugerida por la API en la respuesta de un 429 (RetryInfo): "'retryDelay': '17s'".
+RETRY_DELAY_PATTERN = re.compile(r"retryDelay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s")
+
+GEMINI_CALLS = metrics.REGISTRY.counter(
+    "sinusal_gemini_calls_total",
+    "Llamadas a Gemini por tipo (llm, embeddings) y resultado (ok, reintento, error, agotada, rechazada, compartida).",
+    ["kind", "result"],
+)
+
+
+class GeminiUnavailableError(Exception):
+    """
+    Gemini no puede atender la llamada ahora: la cuota sigue agotada (o el servicio caído) después de
+    los reintentos, o la espera en el limitador supera el máximo. retry_after: segundos sugeridos
+    antes de volver a intentarlo.
+    """
+
+    def __init__(self, message, retry_after=1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    def retry_after_header(self):
+        """
+        Valor de la cabecera Retry-After (segundos enteros, al menos 1).
+        """
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+def is_retryable_error(error):
+    """
+    Indica si un error de Gemini es transitorio (429, 5xx, conexión o tiempo de espera agotado).
+    """
+    if isinstance(error, GeminiUnavailableError):
+        return False
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    for attribute in ("code", "status_code"):
+        code = getattr(error, attribute, None)
+        if isinstance(code, int):
+            return code in RETRYABLE_STATUS_CODES
+    response = getattr(error, "response", None)
+    status_code = getattr(response, "status_code", None)
+    if isinstance(status_code, int):
+        return status_code in RETRYABLE_STATUS_CODES
+    return bool(RETRYABLE_ERROR_PATTERN.search(str(error)))
+
+def suggested_retry_delay(error):
+    """
+    Segundos de espera que indica la propia API en el error (RetryInfo de un 429), o None.
+    """
+    match = RETRY_DELAY_PATTERN.search(str(error))
+    return float(match.group(1)) if match else None
+
+
+class TokenBucket:
+    """
+    Limitador de tokens por minuto: se rellena de forma continua hasta tokens_per_minute.
+    Con tokens_per_minute <= 0 no limita.
+    """
+
+    def __init__(self, tokens_per_minute):
+        self.capacity = float(tokens_per_minute)
+        self.rate = self.capacity / 60.0
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens, max_wait):
+        """
+        Descuenta tokens, esperando a que se repongan si hace falta. Si la espera necesaria supera
+        max_wait segundos no descuenta nada y devuelve esa espera; si no, devuelve 0.
+        """
+        if self.capacity <= 0 or tokens <= 0:
+            return 0.0
+        # Una llamada mayor que la capacidad nunca cabría: consume el cubo entero.
+        tokens = min(tokens, self.capacity)
+        deadline = time.monotonic() + max_wait
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return 0.0
+                wait = (tokens - self._tokens) / self.rate
+            if now + wait > deadline:
+                return wait
+            time.sleep(wait)
+
+    def available(self):
+        with self._lock:
+            elapsed = time.monotonic() - self._updated_at
+            return min(self.capacity, self._tokens + elapsed * self.rate)
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Agrupa llamadas idénticas simultáneas: la primera con una clave ejecuta la función y las que
+    llegan mientras tanto esperan y reciben su resultado. Si la primera falla, cada una de las que
+    esperan recibe su propia GeminiUnavailableError encadenada al error original (una misma
+    instancia de excepción lanzada en varios hilos mezclaría sus trazas).
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """
+        Devuelve (resultado, compartido). compartido es True si el resultado viene de otra llamada.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise GeminiUnavailableError(
+                    f"Falló la llamada a Gemini compartida con otra petición: {flight.error}",
+                    retry_after=getattr(flight.error, "retry_after", 1.0),
+                ) from flight.error
+            return flight.result, True
+        try:
+            flight.result = fn()
+            return flight.result, False
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._flights)
+
+
+class GeminiGovernor:
+    """
+    Regula las llamadas salientes a Gemini de un proceso (LLM y embeddings):
+
+    - como mucho max_concurrency llamadas a la vez;
+    - tokens_per_minute de entrada como máximo (tokens aproximados, 0 = sin límite); se descuentan
+      una vez por llamada lógica, los reintentos no vuelven a consumir tokens;
+    - los 429 y 5xx se reintentan hasta max_retries veces con espera exponencial y jitter
+      (o la espera que indique la API), y después se lanza GeminiUnavailableError;
+    - las llamadas idénticas simultáneas (misma clave) comparten una sola llamada a la API.
+
+    Si una llamada tendría que esperar más de max_wait segundos por un hueco o por tokens se
+    rechaza con GeminiUnavailableError en lugar de acumular peticiones bloqueadas.
+    """
+
+    def __init__(self, max_concurrency=4, tokens_per_minute=0, max_retries=4, base_delay=1.0, max_delay=30.0, max_wait=30.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max(0, max_retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._bucket = TokenBucket(tokens_per_minute)
+        self._single_flight = SingleFlight()
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def backoff_delay(self, attempt, error=None):
+        """
+        Espera antes del reintento attempt (0, 1, ...): la que sugiere la API o una exponencial con
+        jitter completo, para que los procesos que chocan con la cuota no reintenten a la vez.
+        """
+        suggested = suggested_retry_delay(error) if error is not None else None
+        if suggested is not None:
+            return min(self.max_delay, suggested) * random.uniform(1.0, 1.2)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _acquire(self, kind, tokens):
+        """
+        Reserva tokens del cubo y un hueco de concurrencia. Los reintentos pasan tokens=0: la
+        llamada lógica ya se cobró en el primer intento.
+        """
+        with stage_timer("espera_gemini"):
+            wait = self._bucket.acquire(tokens, self.max_wait)
+            if wait:
+                GEMINI_CALLS.inc(kind=kind, result="rechazada")
+                raise GeminiUnavailableError(
+                    f"Límite de tokens por minuto de Gemini alcanzado ({tokens} tokens pendientes).", retry_after=wait
+                )
+            if not self._slots.acquire(timeout=self.max_wait):
+                GEMINI_CALLS.inc(kind=kind, result="rechazada")
+                raise GeminiUnavailableError(
+                    f"Hay {self.max_concurrency} llamadas a Gemini en curso; no hubo hueco en {self.max_wait:g} s.",
+                    retry_after=self.base_delay,
+                )
+        with self._in_flight_lock:
+            self._in_flight += 1
+
+    def _release(self):
+        with self._in_flight_lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def _retry_or_raise(self, kind, error, attempt):
+        """
+        Tras un fallo: espera y vuelve si hay que reintentar; si no, relanza el error (los no
+        transitorios tal cual, los transitorios agotados como GeminiUnavailableError).
+        """
+        if not is_retryable_error(error):
+            GEMINI_CALLS.inc(kind=kind, result="error")
+            raise error
+        delay = self.backoff_delay(attempt, error)
+        if attempt >= self.max_retries:
+            GEMINI_CALLS.inc(kind=kind, result="agotada")
+            raise GeminiUnavailableError(
+                f"Gemini no está disponible tras {attempt + 1} intentos: {error}", retry_after=delay
+            ) from error
+        GEMINI_CALLS.inc(kind=kind, result="reintento")
+        logger.warning(f"Error transitorio de Gemini ({kind}), reintento {attempt + 1} de {self.max_retries} en {delay:.1f} s: {error}")
+        time.sleep(delay)
+
+    def _call_with_retries(self, kind, fn, tokens):
+        attempt = 0
+        while True:
+            self._acquire(kind, tokens if attempt == 0 else 0)
+            try:
+                result = fn()
+            except Exception as error:
+                self._release()
+                self._retry_or_raise(kind, error, attempt)
+                attempt += 1
+                continue
+            self._release()
+            GEMINI_CALLS.inc(kind=kind, result="ok")
+            return result
+
+    def call(self, kind, fn, tokens=0, key=None):
+        """
+        Ejecuta fn() (una llamada a Gemini de tipo kind) dentro de los límites. Con key, las llamadas
+        simultáneas con la misma clave comparten el resultado de una sola.
+        """
+        if key is None:
+            return self._call_with_retries(kind, fn, tokens)
+        result, shared = self._single_flight.do((kind, key), lambda: self._call_with_retries(kind, fn, tokens))
+        if shared:
+            GEMINI_CALLS.inc(kind=kind, result="compartida")
+        return result
+
+    def stream(self, kind, open_fn, tokens=0):
+        """
+        Generador para una llamada en streaming: reserva un hueco hasta el último fragmento y
+        reintenta solo si el error llega antes del primero (después ya se ha enviado texto al cliente).
+        """
+        attempt = 0
+        while True:
+            self._acquire(kind, tokens if attempt == 0 else 0)
+            try:
+                iterator = iter(open_fn())
+                first = next(iterator)
+            except StopIteration:
+                self._release()
+                GEMINI_CALLS.inc(kind=kind, result="ok")
+                return
+            except Exception as error:
+                self._release()
+                self._retry_or_raise(kind, error, attempt)
+                attempt += 1
+                continue
+            break
+        try:
+            yield first
+            yield from iterator
+            GEMINI_CALLS.inc(kind=kind, result="ok")
+        except Exception:
+            GEMINI_CALLS.inc(kind=kind, result="error")
+            raise
+        finally:
+            self._release()
+
+    def status(self):
+        return {
+            "en_curso": self.in_flight,
+            "max_concurrencia": self.max_concurrency,
+            "agrupadas": len(self._single_flight),
+            "tokens_disponibles": round(self._bucket.available()) if self._bucket.capacity > 0 else None,
+        }
+
+
+def _messages_tokens(messages):
+    return sum(estimate_tokens(message.content or "") for message in messages)
+
+def _request_key(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(repr(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def _messages_key(messages, kwargs):
+    return _request_key([(str(message.role), message.content) for message in messages], sorted(kwargs.items(), key=str))
+
+
+class GovernedLLM(LLM):
+    """
+    Envoltorio del LLM de Gemini que pasa cada llamada por un GeminiGovernor. Las llamadas sin
+    streaming con los mismos mensajes se agrupan; las de streaming no (cada cliente recibe sus tokens).
+    Los eventos de instrumentación (etapa 'llm') los emite el LLM envuelto.
+    """
+
+    _inner: LLM = PrivateAttr()
+    _governor: GeminiGovernor = PrivateAttr()
+
+    def __init__(self, inner_llm, governor, **kwargs):
+        super().__init__(callback_manager=inner_llm.callback_manager, **kwargs)
+        self._inner = inner_llm
+        self._governor = governor
+
+    @classmethod
+    def class_name(cls):
+        return "GovernedLLM"
+
+    @property
+    def metadata(self):
+        return self._inner.metadata
+
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any):
+        return self._governor.call(
+            "llm", lambda: self._inner.chat(messages, **kwargs), _messages_tokens(messages), _messages_key(messages, kwargs)
+        )
+
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        return self._governor.call(
+            "llm", lambda: self._inner.complete(prompt, formatted=formatted, **kwargs),
+            estimate_tokens(prompt), _request_key(prompt, formatted, sorted(kwargs.items(), key=str)),
+        )
+
+    def stream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any):
+        return self._governor.stream("llm", lambda: self._inner.stream_chat(messages, **kwargs), _messages_tokens(messages))
+
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        return self._governor.stream(
+            "llm", lambda: self._inner.stream_complete(prompt, formatted=formatted, **kwargs), estimate_tokens(prompt)
+        )
+
+    # El servicio es síncrono: las variantes asíncronas ejecutan la síncrona en un hilo.
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any):
+        return await asyncio.to_thread(self.chat, messages, **kwargs)
+
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        return await asyncio.to_thread(self.complete, prompt, formatted, **kwargs)
+
+    async def astream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any):
+        async def gen():
+            for response in self.stream_chat(messages, **kwargs):
+                yield response
+        return gen()
+
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        async def gen():
+            for response in self.stream_complete(prompt, formatted, **kwargs):
+                yield response
+        return gen()
+
+
+class LLMLatencyHandler(BaseEventHandler):
+    """
+    Mide la etapa 'llm' con los eventos de instrumentación de LlamaIndex: del evento de inicio de una
+    llamada al LLM (chat o completion) al de fin, que en streaming llega con el último token.
+    """
+
+    _started: dict = PrivateAttr(default_factory=dict)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    @classmethod
+    def class_name(cls):
+        return "LLMLatencyHandler"
+
+    def handle(self, event, **kwargs):
+        name = event.class_name()
+        # Sin span activo, las llamadas de un mismo hilo no se solapan.
+        key = event.span_id or threading.get_ident()
+        if name in ("LLMChatStartEvent", "LLMCompletionStartEvent"):
+            with self._lock:
+                self._started[key] = time.perf_counter()
+        elif name in ("LLMChatEndEvent", "LLMCompletionEndEvent"):
+            with self._lock:
+                started_at = self._started.pop(key, None)
+            if started_at is not None:
+                STAGE_SECONDS.observe(time.perf_counter() - started_at, stage="llm")
+
+
+_llm_handler_installed = False
+_llm_handler_lock = threading.Lock()
+
+def install_llm_latency_handler():
+    """
+    Registra LLMLatencyHandler en el dispatcher raíz de LlamaIndex (una sola vez por proceso).
+    """
+    global _llm_handler_installed
+    with _llm_handler_lock:
+        if not _llm_handler_installed:
+            get_dispatcher().add_event_handler(LLMLatencyHandler())
+            _llm_handler_installed = True
@@ -0,0 +1,30 @@
+# Configuración de gunicorn para el modo multiproceso (ver DESPLIEGUE.md). Solo Linux y macOS:
+# en Windows la aplicación se ejecuta en un único proceso (python app.py o los .bat).
+#
+#   APP_ROLE=ingestor gunicorn -c gunicorn.conf.py app:app   -> un único proceso que procesa las subidas
+#   APP_ROLE=worker   gunicorn -c gunicorn.conf.py app:app   -> varios procesos que atienden el chat
+import multiprocessing
+import os
+
+role = os.getenv("APP_ROLE", "worker").strip().lower()
+# app.py lee el papel del entorno al importarse en cada proceso.
+os.environ["APP_ROLE"] = role
+
+if role == "ingestor":
+    # La ingesta tiene un único dueño: un solo proceso escribe el índice y publica sus versiones.
+    bind = os.getenv("INGESTOR_BIND", "127.0.0.1:5001")
+    workers = 1
+else:
+    bind = os.getenv("WORKER_BIND", "0.0.0.0:5000")
+    workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+
+# Hilos por proceso: las consultas pasan casi todo el tiempo esperando a Gemini.
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+# Las respuestas de Gemini y los lotes de PDF pueden tardar.
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "180"))
+# Cada proceso importa la aplicación después del fork: así cada worker arranca su propio hilo
+# de vigilancia del índice y sus propios pools (los hilos no sobreviven a un fork).
+preload_app = False
+# Mismo nivel de registro que la aplicación (LOG_LEVEL).
+loglevel = os.getenv("LOG_LEVEL", "info").strip().lower()
@@ -0,0 +1,406 @@
+import logging
+import os
+import re
+import threading
+import unicodedata
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# --- Extracción de medidas de los informes Holter/ECG en la ingesta ---
+
+# Cabeceras de los resúmenes del Holter: el resumen de toda la grabación y el de cada día.
+SUMMARY_HEADER_PATTERN = re.compile(
+    r"(?P<day>\d+)\. Day \((?P<date>\d{2}/\d{2}/\d{4})\)Resumen"
+    r"|Resumen\s+multid[ií]aDuraci[oó]n total: (?P<start>\d{2}/\d{2}/\d{4})"
+)
+SUMMARY_END = "Ventricular events"
+# En el texto extraído los valores van pegados a la hora o a la fecha del evento:
+# 'FCmáximo12616:35' = 126 lpm a las 16:35; 'FCmáximo130may. 29' = 130 lpm el 29 de mayo.
+HR_VALUE = r"(\d{2,5})(?::(\d{2}))?"
+SUMMARY_PATTERNS = {
+    "hr_max": re.compile(rf"FCm[aá]ximo{HR_VALUE}"),
+    "hr_mean": re.compile(rf"medio{HR_VALUE}"),
+    "hr_min": re.compile(rf"al menos{HR_VALUE}"),
+}
+COUNT_PATTERNS = {
+    "beats": re.compile(r"QRSconjunto(\d+)"),
+    "psvt": re.compile(r"PSVT(\d+)longest"),
+    "sve": re.compile(r"ESV(\d+)m[aá]x/h"),
+    "qrs_fail": re.compile(r"Fallo QRS(\d+)longest"),
+    "tachy": re.compile(r"Tachycard\.(\d+)"),
+}
+DURATION_PATTERNS = {
+    "psvt_longest_s": re.compile(r"PSVT\d+longest(\d+(?:[.,]\d+)?) s"),
+}
+BLOOD_PRESSURE_PATTERN = re.compile(r"(?:Tensi[oó]n|Presi[oó]n) arterial:?\s*(\d{2,3})\s*/\s*(\d{2,3})\s*mm\s*Hg", re.IGNORECASE)
+ECG_RATE_PATTERN = re.compile(r"\bECG:\s*[^.]{0,60}?\ba\s+(\d{2,3})\s*lpm", re.IGNORECASE)
+HOLTER_DATE_PATTERN = re.compile(r"Holter ECG (\d{2}/\d{2}/\d{4})")
+DATE_PATTERN = re.compile(r"(?<!\d)(\d{2})/(\d{2})/(\d{4})(?!\d)")
+MIN_HEART_RATE = 20
+MAX_HEART_RATE = 300
+
+# Tipos de registro (columna 'kind').
+KIND_RECORDING = 0 # Resumen de toda la grabación Holter
+KIND_DAY = 1 # Resumen de un día de la grabación
+KIND_CONSULTATION = 2 # Medidas de la consulta (tensión arterial, ECG de reposo)
+
+METRIC_COLUMNS = ("hr_max", "hr_mean", "hr_min", "beats", "psvt", "psvt_longest_s", "sve", "qrs_fail", "tachy", "bp_sys", "bp_dia", "ecg_hr")
+
+
+def _parse_date(text):
+    day, month, year = text.split("/")
+    try:
+        return np.datetime64(f"{year}-{month}-{day}", "D")
+    except ValueError:
+        return None
+
+def _split_rate_and_time(digits, minutes):
+    """
+    Separa la frecuencia cardiaca de la hora pegada detrás: '12616' + ':35' -> 126 (16:35),
+    '675' + ':22' -> 67 (5:22). Sin hora, todos los dígitos son la frecuencia.
+    """
+    if minutes is None:
+        value = int(digits)
+        return value if MIN_HEART_RATE <= value <= MAX_HEART_RATE else None
+    for rate_length in (2, 3):
+        rate, hour = digits[:rate_length], digits[rate_length:]
+        if 1 <= len(hour) <= 2 and int(hour) < 24 and MIN_HEART_RATE <= int(rate) <= MAX_HEART_RATE:
+            return int(rate)
+    return None
+
+def _report_date(text):
+    """
+    Fecha de la consulta: la del Holter si la hay; si no, la primera fecha que no sea la de nacimiento.
+    """
+    match = HOLTER_DATE_PATTERN.search(text)
+    if match:
+        return _parse_date(match.group(1))
+    for match in DATE_PATTERN.finditer(text):
+        if "nacimiento" not in text[max(0, match.start() - 25):match.start()].lower():
+            return _parse_date(match.group(0))
+    return None
+
+def parse_holter_metrics(text):
+    """
+    Extrae las medidas de un informe: resúmenes del Holter (grabación completa y por día) y
+    medidas de la consulta. Devuelve una lista de registros {'date', 'kind', columna: valor}.
+    Los resúmenes repetidos en varias páginas se cuentan una sola vez.
+    """
+    records = []
+    seen = set()
+    headers = list(SUMMARY_HEADER_PATTERN.finditer(text))
+    for position, header in enumerate(headers):
+        block_end = headers[position + 1].start() if position + 1 < len(headers) else len(text)
+        end_marker = text.find(SUMMARY_END, header.end(), block_end)
+        block = text[header.end():end_marker if end_marker != -1 else block_end]
+        if header.group("date"):
+            kind, date = KIND_DAY, _parse_date(header.group("date"))
+        else:
+            kind, date = KIND_RECORDING, _parse_date(header.group("start"))
+
+        record = {"date": date, "kind": kind}
+        for column, pattern in SUMMARY_PATTERNS.items():
+            match = pattern.search(block)
+            if match:
+                record[column] = _split_rate_and_time(match.group(1), match.group(2))
+        for column, pattern in COUNT_PATTERNS.items():
+            match = pattern.search(block)
+            if match:
+                record[column] = int(match.group(1))
+        for column, pattern in DURATION_PATTERNS.items():
+            match = pattern.search(block)
+            if match:
+                record[column] = float(match.group(1).replace(",", "."))
+        if len(record) <= 2 or (kind, date) in seen:
+            continue
+        seen.add((kind, date))
+        records.append(record)
+
+    consultation = {"date": _report_date(text), "kind": KIND_CONSULTATION}
+    match = BLOOD_PRESSURE_PATTERN.search(text)
+    if match:
+        consultation["bp_sys"], consultation["bp_dia"] = int(match.group(1)), int(match.group(2))
+    match = ECG_RATE_PATTERN.search(text)
+    if match:
+        consultation["ecg_hr"] = int(match.group(1))
+    if len(consultation) > 2:
+        records.append(consultation)
+    return records
+
+
+class HolterMetricsStore:
+    """
+    Serie temporal de medidas por paciente en formato columnar (un array de numpy por columna),
+    persistida en un único .npz. Las preguntas de tendencias y medidas se responden con
+    operaciones vectorizadas sobre estas columnas, sin recuperar fragmentos ni llamar a Gemini.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.RLock()
+        # paciente -> {"date": datetime64[D], "kind": int8, "document": str, columna de medida: float64 (NaN = sin dato)}
+        self._patients = {}
+        # documento -> (paciente, hash del contenido), para no volver a analizar documentos sin cambios.
+        self.documents = {}
+        if path and os.path.exists(path):
+            try:
+                self._load()
+            except Exception as e:
+                logger.warning(f"No se pudo cargar el almacén de medidas '{path}': {e}")
+                self._patients, self.documents = {}, {}
+
+    def reload(self, path=None):
+        """
+        Vuelve a leer el almacén desde disco (por defecto desde su propia ruta). Lo usan los
+        procesos de solo lectura cuando otro proceso publica una versión nueva del índice.
+        """
+        patients, documents = _read_store(path or self.path)
+        with self._lock:
+            self._patients, self.documents = patients, documents
+
+    def is_current(self, filename, content_hash):
+        with self._lock:
+            entry = self.documents.get(filename)
+            return entry is not None and entry[1] == content_hash
+
+    def set_document(self, filename, patient_id, content_hash, records, save=True):
+        """
+        Sustituye las medidas de un documento (las de su versión anterior se descartan).
+        """
+        with self._lock:
+            self._drop_document(filename)
+            self.documents[filename] = (patient_id, content_hash)
+            if records:
+                new_columns = {
+                    "date": np.array(
+                        [np.datetime64("NaT") if record["date"] is None else record["date"] for record in records],
+                        dtype="datetime64[D]",
+                    ),
+                    "kind": np.array([record["kind"] for record in records], dtype=np.int8),
+                    "document": np.array([filename] * len(records)),
+                }
+                for column in METRIC_COLUMNS:
+                    new_columns[column] = np.array(
+                        [np.nan if record.get(column) is None else record[column] for record in records], dtype=np.float64
+                    )
+                current = self._patients.get(patient_id)
+                if current is None:
+                    self._patients[patient_id] = new_columns
+                else:
+                    self._patients[patient_id] = {
+                        column: np.concatenate([current[column], new_columns[column]]) for column in new_columns
+                    }
+            if save:
+                self.save()
+
+    def remove_document(self, filename, save=True):
+        with self._lock:
+            if filename not in self.documents:
+                return False
+            self._drop_document(filename)
+            del self.documents[filename]
+            if save:
+                self.save()
+            return True
+
+    def get_series(self, patient_id):
+        """
+        Columnas del paciente ordenadas por fecha (copias), o None si no tiene medidas.
+        """
+        with self._lock:
+            columns = self._patients.get(patient_id)
+            if columns is None:
+                return None
+            order = np.argsort(columns["date"], kind="stable")
+            return {column: values[order] for column, values in columns.items()}
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            arrays = {
+                "__documents": np.array(list(self.documents), dtype=str),
+                "__document_patients": np.array([entry[0] for entry in self.documents.values()], dtype=str),
+                "__document_hashes": np.array([entry[1] for entry in self.documents.values()], dtype=str),
+            }
+            patient_ids = list(self._patients)
+            arrays["__patients"] = np.array(patient_ids, dtype=str)
+            for position, patient_id in enumerate(patient_ids):
+                for column, values in self._patients[patient_id].items():
+                    arrays[f"{position}/{column}"] = values
+            try:
+                tmp_path = f"{self.path}.tmp.npz"
+                np.savez(tmp_path, **arrays)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                logger.warning(f"No se pudo guardar el almacén de medidas '{self.path}': {e}")
+
+    def _load(self):
+        self._patients, self.documents = _read_store(self.path)
+
+    def _drop_document(self, filename):
+        entry = self.documents.get(filename)
+        if entry is None:
+            return
+        columns = self._patients.get(entry[0])
+        if columns is None:
+            return
+        keep = columns["document"] != filename
+        if keep.all():
+            return
+        if not keep.any():
+            del self._patients[entry[0]]
+        else:
+            self._patients[entry[0]] = {column: values[keep] for column, values in columns.items()}
+
+
+def _read_store(path):
+    """
+    Lee un .npz guardado por HolterMetricsStore.save(). Devuelve (columnas por paciente, documentos).
+    """
+    patients = {}
+    with np.load(path, allow_pickle=False) as data:
+        documents = {
+            str(filename): (str(patient_id), str(content_hash))
+            for filename, patient_id, content_hash in zip(
+                data["__documents"], data["__document_patients"], data["__document_hashes"]
+            )
+        }
+        for position, patient_id in enumerate(data["__patients"]):
+            prefix = f"{position}/"
+            patients[str(patient_id)] = {
+                key[len(prefix):]: data[key] for key in data.files if key.startswith(prefix)
+            }
+    return patients, documents
+
+
+# --- Respuestas locales a preguntas de medidas y tendencias ---
+
+def _fold(text):
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+# Grupos de medidas que se pueden pedir en el mensaje (texto sin tildes).
+METRIC_TOPICS = {
+    "heart_rate": ("frecuencia cardiaca", "frecuencia", "fc ", "pulso", "lpm"),
+    "ectopics": ("extrasistole", "esv", "psvt", "taquicardia", "arritmia"),
+    "blood_pressure": ("tension", "presion arterial"),
+}
+# Preguntas que se responden localmente: las que nombran una medida concreta de las series. Las
+# generales ('¿hay pausas en el holter?', 'evolución tras la cirugía', curvas de peso o glucosa)
+# siguen por el RAG.
+LOCAL_QUESTION_KEYWORDS = ("frecuencia cardiaca", "extrasistole", "psvt", "tension arterial", "presion arterial")
+# Las preguntas de evolución solo se responden localmente si hay una serie (al menos dos medidas).
+TREND_KEYWORDS = ("evolucion", "tendencia")
+TREND_STABLE_BPM_PER_DAY = 1.0
+
+def is_metric_question(user_message):
+    folded = _fold(user_message)
+    return any(keyword in folded for keyword in LOCAL_QUESTION_KEYWORDS)
+
+def _format_number(value, unit=""):
+    if np.isnan(value):
+        return "sin dato"
+    text = f"{value:.0f}" if float(value).is_integer() else f"{value:.1f}"
+    return f"{text} {unit}".strip()
+
+def _format_date(date):
+    if np.isnat(date):
+        return "fecha desconocida"
+    year, month, day = str(date).split("-")
+    return f"{day}/{month}/{year}"
+
+def _summary_line(label, row, topics):
+    parts = []
+    if "heart_rate" in topics:
+        parts.append(
+            f"FC máxima {_format_number(row['hr_max'], 'lpm')}, media {_format_number(row['hr_mean'], 'lpm')}, "
+            f"mínima {_format_number(row['hr_min'], 'lpm')}"
+        )
+    if "ectopics" in topics:
+        ectopics = f"PSVT {_format_number(row['psvt'])}"
+        if not np.isnan(row["psvt_longest_s"]):
+            ectopics += f" (la más larga {_format_number(row['psvt_longest_s'], 's')})"
+        ectopics += f"; extrasístoles supraventriculares {_format_number(row['sve'])}"
+        if not np.isnan(row["tachy"]):
+            ectopics += f"; episodios de taquicardia {_format_number(row['tachy'])}"
+        parts.append(ectopics)
+    return f"- {label}: " + "; ".join(parts) + "." if parts else None
+
+def answer_metric_question(series, user_message, patient_id):
+    """
+    Responde con las medidas del paciente (series de get_series) si el mensaje pregunta por
+    medidas o tendencias y hay datos para ello. Devuelve None para dejar la pregunta al RAG.
+    """
+    if series is None or not is_metric_question(user_message):
+        return None
+    folded = _fold(user_message) + " "
+    topics = {topic for topic, keywords in METRIC_TOPICS.items() if any(keyword in folded for keyword in keywords)}
+    if not topics:
+        return None
+
+    kind = series["kind"]
+    recordings = np.flatnonzero(kind == KIND_RECORDING)
+    days = np.flatnonzero(kind == KIND_DAY)
+    consultations = np.flatnonzero(kind == KIND_CONSULTATION)
+    if any(keyword in folded for keyword in TREND_KEYWORDS):
+        measured_consultations = np.count_nonzero(~np.isnan(series["bp_sys"][consultations]))
+        if days.size < 2 and measured_consultations < 2:
+            return None
+    lines = []
+
+    if topics & {"heart_rate", "ectopics"}:
+        for position in recordings:
+            row = {column: series[column][position] for column in METRIC_COLUMNS}
+            line = _summary_line(f"Holter del {_format_date(series['date'][position])} (grabación completa)", row, topics)
+            if line:
+                lines.append(line)
+        for position in days:
+            row = {column: series[column][position] for column in METRIC_COLUMNS}
+            line = _summary_line(f"Día {_format_date(series['date'][position])}", row, topics)
+            if line:
+                lines.append(line)
+
+        if "heart_rate" in topics and days.size >= 2:
+            day_dates = series["date"][days]
+            mean_rates = series["hr_mean"][days]
+            valid = ~np.isnan(mean_rates) & ~np.isnat(day_dates)
+            if valid.sum() >= 2:
+                elapsed_days = (day_dates[valid] - day_dates[valid][0]).astype(np.float64)
+                slope = np.polyfit(elapsed_days, mean_rates[valid], 1)[0]
+                if abs(slope) < TREND_STABLE_BPM_PER_DAY:
+                    trend = "estable"
+                else:
+                    trend = "ascendente" if slope > 0 else "descendente"
+                sequence = " → ".join(_format_number(value) for value in mean_rates[valid])
+                lines.append(
+                    f"- Evolución de la FC media diaria: {sequence} lpm (tendencia {trend}, {slope:+.1f} lpm/día; "
+                    f"máxima absoluta {_format_number(np.nanmax(series['hr_max'][days]), 'lpm')}, "
+                    f"mínima absoluta {_format_number(np.nanmin(series['hr_min'][days]), 'lpm')})."
+                )
+
+        ecg_rates = series["ecg_hr"][consultations]
+        for position in consultations[~np.isnan(ecg_rates)]:
+            if "heart_rate" in topics:
+                lines.append(f"- ECG de reposo ({_format_date(series['date'][position])}): {_format_number(series['ecg_hr'][position], 'lpm')}.")
+
+    if "blood_pressure" in topics:
+        systolic = series["bp_sys"][consultations]
+        measured = consultations[~np.isnan(systolic)]
+        for position in measured:
+            lines.append(
+                f"- Tensión arterial ({_format_date(series['date'][position])}): "
+                f"{_format_number(series['bp_sys'][position])}/{_format_number(series['bp_dia'][position])} mm Hg."
+            )
+        if measured.size >= 2:
+            lines.append(
+                f"- Tensión arterial media: {_format_number(np.mean(series['bp_sys'][measured]))}/"
+                f"{_format_number(np.mean(series['bp_dia'][measured]))} mm Hg en {measured.size} consultas."
+            )
+
+    if not lines:
+        return None
+    header = f"Medidas registradas en los informes del paciente con ID '{patient_id}' (calculadas a partir de los documentos indexados):"
+    return "\n".join([header] + lines)
@@ -0,0 +1,195 @@
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+CURRENT_POINTER = "CURRENT"
+
+
+class IndexVersionStore:
+    """
+    Versiones publicadas del índice en disco, para repartir las consultas entre varios procesos.
+
+    Cada publicación es una carpeta nueva e inmutable (root/<versión>/) con el índice persistido y
+    una copia del registro de pacientes y del almacén de medidas. El archivo CURRENT contiene el
+    nombre de la versión vigente y se sustituye de forma atómica (os.replace) cuando la carpeta ya
+    está completa: un proceso que lea CURRENT nunca ve una versión a medio escribir. Se conservan
+    las últimas `keep` versiones para que un proceso que esté cargando la anterior no se quede sin ella.
+    """
+
+    def __init__(self, root, keep=3):
+        self.root = root
+        self.keep = max(2, keep)
+        os.makedirs(root, exist_ok=True)
+
+    def current_name(self):
+        """
+        Nombre de la versión vigente, o None si todavía no se ha publicado ninguna.
+        """
+        try:
+            with open(os.path.join(self.root, CURRENT_POINTER), "r", encoding="utf-8") as f:
+                name = f.read().strip()
+        except FileNotFoundError:
+            return None
+        return name if name and os.path.isdir(self.path_for(name)) else None
+
+    def path_for(self, name):
+        return os.path.join(self.root, name)
+
+    def new_version(self):
+        """
+        Reserva una carpeta para una versión nueva. Los nombres se ordenan cronológicamente.
+        Devuelve (nombre, ruta).
+        """
+        now = time.time_ns()
+        name = f"v{time.strftime('%Y%m%d-%H%M%S', time.localtime(now // 10**9))}.{now % 10**9:09d}-{uuid.uuid4().hex[:6]}"
+        path = self.path_for(name)
+        os.makedirs(path)
+        return name, path
+
+    def add_file(self, name, source_path):
+        """
+        Copia en la versión un archivo que la acompaña (registro de pacientes, medidas...).
+        """
+        if source_path and os.path.exists(source_path):
+            shutil.copy2(source_path, os.path.join(self.path_for(name), os.path.basename(source_path)))
+
+    def publish(self, name):
+        """
+        Marca la versión como vigente y elimina las más antiguas.
+        """
+        tmp_path = os.path.join(self.root, f"{CURRENT_POINTER}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(name)
+        os.replace(tmp_path, os.path.join(self.root, CURRENT_POINTER))
+        self._prune(name)
+
+    def discard(self, name):
+        """
+        Elimina una versión que no llegó a publicarse (ej. falló la persistencia).
+        """
+        self._remove(name)
+
+    def _prune(self, current):
+        # Las versiones que no se pudieron eliminar en una publicación anterior se reintentan aquí.
+        versions = sorted(entry for entry in os.listdir(self.root) if entry.startswith("v") and os.path.isdir(self.path_for(entry)))
+        for name in versions[:-self.keep]:
+            if name != current:
+                self._remove(name)
+
+    def _remove(self, name):
+        """
+        Elimina la carpeta de una versión. Si no se puede (en Windows no se borra un archivo que otro
+        proceso tiene abierto o en mmap), se registra y se reintenta en la siguiente publicación.
+        """
+        try:
+            shutil.rmtree(self.path_for(name))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"No se pudo eliminar la versión del índice '{name}'; se reintentará en la siguiente publicación: {e}")
+
+
+class IndexVersionPublisher:
+    """
+    Hilo que persiste y publica las versiones del índice en segundo plano, para que una subida no
+    espere a escribir el corpus entero en disco.
+
+    submit(nombre, carga) recibe una versión ya reservada (new_version) con los archivos que la
+    acompañan ya copiados; el hilo llama a write(carga, ruta) y después la publica. Si llegan varias
+    versiones mientras se escribe otra, solo se escribe la última: las intermedias se descartan sin
+    publicarse, porque la última ya contiene todos sus cambios.
+    """
+
+    def __init__(self, store, write):
+        self.store = store
+        self.write = write
+        self._pending = None
+        self._busy = False
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def submit(self, name, payload):
+        with self._condition:
+            replaced = self._pending
+            self._pending = (name, payload)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="publicador-indice", daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+        if replaced is not None:
+            self.store.discard(replaced[0])
+
+    def wait(self, timeout=None):
+        """
+        Espera a que se publique la última versión pedida. Devuelve False si vence el timeout.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._pending is None and not self._busy, timeout)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending is not None)
+                name, payload = self._pending
+                self._pending = None
+                self._busy = True
+            try:
+                self.write(payload, self.store.path_for(name))
+                self.store.publish(name)
+            except Exception as e:
+                # La siguiente modificación vuelve a persistir el índice completo; al reiniciar, los
+                # textos indexados se sincronizan con la última versión publicada.
+                logger.error(f"No se pudo persistir la versión del índice '{name}': {e}")
+                self.store.discard(name)
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+
+
+class IndexVersionWatcher:
+    """
+    Hilo que vigila el archivo CURRENT y llama a on_change(nombre) cuando se publica una versión nueva.
+    Lo usan los procesos de solo lectura (APP_ROLE=worker) para recargar el índice sin reiniciar.
+    """
+
+    def __init__(self, store, on_change, interval=2.0):
+        self.store = store
+        self.on_change = on_change
+        self.interval = interval
+        self.loaded_name = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def check(self):
+        """
+        Carga la versión vigente si es distinta de la última cargada. Devuelve True si ha cargado una.
+        """
+        name = self.store.current_name()
+        if name is None or name == self.loaded_name:
+            return False
+        try:
+            self.on_change(name)
+        except Exception as e:
+            # Se reintenta en la siguiente comprobación; mientras tanto se sigue usando la versión anterior.
+            logger.error(f"No se pudo cargar la versión del índice '{name}': {e}")
+            return False
+        self.loaded_name = name
+        return True
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="vigilante-indice", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
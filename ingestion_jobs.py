@@ -0,0 +1,122 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Estados de un trabajo de ingesta
+JOB_QUEUED = "en_cola"
+JOB_RUNNING = "procesando"
+JOB_DONE = "completado"
+JOB_FAILED = "error"
+
+
+class QueueFullError(Exception):
+    """
+    La cola de ingesta ha alcanzado su límite y no admite más trabajos por ahora.
+    """
+
+
+class IngestionJob:
+    """
+    Estado de un trabajo de ingesta (extracción + indexación) que se ejecuta en segundo plano.
+    """
+
+    def __init__(self, filename):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.status = JOB_QUEUED
+        self.stage = "en cola"
+        self.progress = 0
+        self.message = ""
+        self.error = None
+        self.result = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self._lock = threading.Lock()
+
+    def update(self, stage, progress=None, message=None):
+        """
+        Registra el avance del trabajo (etapa y porcentaje aproximado).
+        """
+        with self._lock:
+            self.stage = stage
+            if progress is not None:
+                self.progress = progress
+            if message is not None:
+                self.message = message
+            self.updated_at = time.time()
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "filename": self.filename,
+                "estado": self.status,
+                "etapa": self.stage,
+                "progreso": self.progress,
+                "mensaje": self.message,
+                "error": self.error,
+                "resultado": self.result,
+                "creado": self.created_at,
+                "actualizado": self.updated_at,
+            }
+
+
+class IngestionJobManager:
+    """
+    Ejecuta los trabajos de ingesta en un pool acotado de hilos y guarda su estado para consultarlo.
+    Los trabajos terminados se conservan hasta max_finished_jobs; los más antiguos se olvidan.
+    """
+
+    def __init__(self, max_workers=2, max_pending=100, max_finished_jobs=500):
+        self.max_pending = max_pending
+        self.max_finished_jobs = max_finished_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingesta")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, filename, fn, *args, **kwargs):
+        """
+        Encola fn(job, *args, **kwargs). El valor devuelto por fn se guarda como resultado del trabajo.
+        Lanza QueueFullError si ya hay max_pending trabajos sin terminar.
+        """
+        job = IngestionJob(filename)
+        with self._lock:
+            if self.pending_count() >= self.max_pending:
+                raise QueueFullError(f"Hay {self.max_pending} documentos pendientes de procesar.")
+            self._jobs[job.id] = job
+            self._forget_old_jobs()
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def pending_count(self):
+        """
+        Número de trabajos en cola o en ejecución.
+        """
+        return sum(1 for job in list(self._jobs.values()) if job.status in (JOB_QUEUED, JOB_RUNNING))
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = JOB_RUNNING
+        job.update("iniciando", 0)
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = JOB_DONE
+            job.update("completado", 100)
+        except Exception as e:
+            logger.exception(f"Error en el trabajo de ingesta {job.id} ('{job.filename}'): {e}")
+            job.error = str(e)
+            job.status = JOB_FAILED
+            job.update("error")
+
+    def _forget_old_jobs(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in (JOB_DONE, JOB_FAILED)]
+        for job_id in finished[: max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job_id]
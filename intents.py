@@ -0,0 +1,158 @@
+import re
+
+from patient_registry import fold_text
+
+
+class Intent:
+    """
+    Acción del chat (burbuja/chip) identificada por palabras clave.
+
+    - keywords: textos que activan la acción; se comparan sin tildes ni mayúsculas con un único
+      patrón precompilado.
+    - template: instrucción para el LLM, con los campos {base} (foco en el paciente o en todo el
+      corpus), {patient} y {message}. Las instrucciones generales van en el prompt de sistema.
+    - topic: tema que se añade a la búsqueda en el índice (por defecto, la etiqueta).
+    - sections: secciones de los informes (ver clinical_sections.SECTION_HEADINGS) en las que se
+      busca; None para buscar en todo el documento.
+    - local_handler: función opcional (mensaje, ID de paciente) -> respuesta o None que responde
+      sin pasar por el RAG; si devuelve None la pregunta sigue su curso normal.
+    """
+
+    def __init__(self, name, label, keywords, template, topic=None, sections=None):
+        self.name = name
+        self.label = label
+        self.topic = topic if topic is not None else label.rstrip(".")
+        self.sections = tuple(sections) if sections else None
+        self.keywords = tuple(keywords)
+        self.template = template
+        self.pattern = re.compile("|".join(re.escape(fold_text(keyword)) for keyword in self.keywords))
+        self.local_handler = None
+
+    def matches(self, folded_message):
+        return self.pattern.search(folded_message) is not None
+
+    def build_prompt(self, base_prompt, patient_id, user_message):
+        return self.template.format(base=base_prompt, patient=patient_id if patient_id else "general", message=user_message)
+
+
+class IntentRegistry:
+    """
+    Tabla de acciones del chat. El orden de registro es la prioridad: gana la primera que coincide.
+    """
+
+    def __init__(self, intents):
+        self._intents = list(intents)
+        self._by_name = {intent.name: intent for intent in self._intents}
+
+    def classify(self, user_message):
+        """
+        Devuelve la acción que corresponde al mensaje, o None para una pregunta general.
+        """
+        folded_message = fold_text(user_message)
+        for intent in self._intents:
+            if intent.matches(folded_message):
+                return intent
+        return None
+
+    def get(self, name):
+        return self._by_name[name]
+
+    def local_handler(self, *names):
+        """
+        Decorador que registra una función como respuesta local de una o varias acciones.
+        """
+        def register(handler):
+            for name in names:
+                self._by_name[name].local_handler = handler
+            return handler
+        return register
+
+    def __iter__(self):
+        return iter(self._intents)
+
+
+GENERAL_TEMPLATE = "{base} Pregunta original: {message}"
+
+# Acciones de las burbujas/chips, en orden de prioridad.
+CHAT_INTENTS = IntentRegistry([
+    Intent(
+        "informes_completos", "Informes completos.",
+        ["informes completo", "informes médicos"],
+        "{base} Proporciona un resumen detallado o los puntos clave de los informes médicos completos disponibles para el paciente con ID '{patient}'. {message}",
+    ),
+    Intent(
+        "resumen", "Resumen de historia clínica.",
+        ["resumen"],
+        "{base} Proporciona un resumen de la historia clínica del paciente con ID '{patient}', incluyendo antecedentes familiares y personales, alergias, medicación actual y pasada, y conclusiones de pruebas diagnósticas relevantes. {message}",
+    ),
+    Intent(
+        "alergias", "Alergias e intolerancias.",
+        ["alergias e intolerancias"],
+        "{base} Enumera todas las alergias e intolerancias documentadas para el paciente con ID '{patient}'. Si no se encuentran, indica 'No documentado' para ese paciente. {message}",
+        sections=["alergias", "antecedentes"],
+    ),
+    Intent(
+        "medicacion", "Medicación.",
+        ["medicación"],
+        "{base} Detalla la medicación actual y pasada del paciente con ID '{patient}', incluyendo la dosis, frecuencia y las causas de suspensión si están disponibles en los documentos. Si no hay medicación documentada para este paciente, indícalo. {message}",
+        sections=["medicacion", "tratamiento"],
+    ),
+    Intent(
+        "curvas_evolutivas", "Curvas evolutivas.",
+        ["curvas evolutivas"],
+        "{base} Describe cualquier información sobre curvas evolutivas, tendencias o cambios significativos en mediciones (ej. peso, tensión arterial, glucosa) a lo largo del tiempo, según los documentos disponibles para el paciente con ID '{patient}'. Si no hay datos, indícalo. {message}",
+    ),
+    Intent(
+        "pruebas", "Pruebas diagnósticas.",
+        ["pruebas"],
+        "{base} Resume las pruebas diagnósticas realizadas al paciente con ID '{patient}', enfocándote específicamente en sus conclusiones y resultados clave. {message}",
+        sections=["pruebas", "electrocardiograma", "analiticas"],
+    ),
+    Intent(
+        "analiticas", "Analíticas de laboratorio.",
+        ["analíticas"],
+        "{base} Proporciona un resumen de los resultados de las analíticas de laboratorio del paciente con ID '{patient}', destacando cualquier valor fuera de rango o significativo. {message}",
+        sections=["analiticas", "pruebas"],
+    ),
+    Intent(
+        "diagnosticos", "Diagnósticos.",
+        ["diagnósticos"],
+        "{base} Lista todos los diagnósticos registrados o mencionados para el paciente con ID '{patient}' en los documentos. {message}",
+        sections=["diagnostico", "motivo_consulta"],
+    ),
+    Intent(
+        "electros", "Electros/ECG.",
+        ["electros", "electrocardiogramas"],
+        "{base} Describe los hallazgos y conclusiones de los electrocardiogramas (ECG) mencionados en los documentos del paciente con ID '{patient}'. {message}",
+        sections=["electrocardiograma", "pruebas"],
+    ),
+    Intent(
+        "especialidades", "Especialidades.",
+        ["especialidades"],
+        "{base} Lista todas las especialidades médicas que han tratado al paciente con ID '{patient}' o que se mencionan en sus documentos, junto con los motivos de consulta si están disponibles. {message}",
+    ),
+    Intent(
+        "imagenes", "Imágenes diagnósticas.",
+        ["imágenes"],
+        "{base} Resume los hallazgos principales y las conclusiones de los estudios de imágenes diagnósticas (radiografías, ecografías, resonancias, etc.) mencionados en los documentos del paciente con ID '{patient}'. {message}",
+        sections=["pruebas"],
+    ),
+    Intent(
+        "archivos_adjuntos", "Archivos adjuntos.",
+        ["archivos adj.", "archivos adjuntos"],
+        "{base} Menciona cualquier información relevante sobre archivos adjuntos o documentos anexos que se describan en los registros del paciente con ID '{patient}'. {message}",
+    ),
+    Intent(
+        "formato_soap", "Generando informe estructurado (SOAP).",
+        ["formato soap"],
+        "{base} Por favor, genera un informe estructurado en formato SOAP (Subjetivo, Objetivo, Evaluación, Plan) basado en la información para el paciente con ID '{patient}'. Pregunta original: {message}",
+        topic="Motivo de consulta, exploración física, diagnóstico y plan de tratamiento",
+    ),
+    # Preguntas libres sobre una medida concreta (no es una burbuja): se responden con las series del
+    # paciente si las hay. Palabras generales como 'holter' o 'evolución' no bastan: siguen por el RAG.
+    Intent(
+        "medidas", "Medidas registradas.",
+        ["frecuencia cardíaca", "tensión arterial", "presión arterial", "extrasístole", "psvt"],
+        GENERAL_TEMPLATE,
+    ),
+])
@@ -0,0 +1,349 @@
+import functools
+import logging
+import re
+import unicodedata
+from collections import Counter
+
+import numpy as np
+from llama_index.core.indices.vector_store.retrievers import VectorIndexRetriever
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore
+from llama_index.core.vector_stores import ExactMatchFilter, FilterOperator, MetadataFilter, MetadataFilters
+
+from metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+
+# Parámetros habituales de BM25: saturación de la frecuencia del término y normalización por longitud.
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Candidatos que aporta cada búsqueda (léxica y vectorial) antes de combinar las puntuaciones.
+FUSION_CANDIDATES = 10
+# Una consulta de búsqueda exacta tiene como mucho estos términos ('Sinemet', 'Lisinopril 20mg').
+MAX_LOOKUP_TERMS = 3
+
+# Tokens ya vistos que no se expanden ni se descartan (la mayoría de las palabras de los informes).
+_plain_tokens = set()
+MAX_PLAIN_TOKENS = 200000
+
+# Palabras, números, dosis, fechas y códigos: '20mg', '12/03/2024', '12.345.678', 'dm-ii'.
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[./-][a-z0-9]+)*")
+TOKEN_SEPARATORS = re.compile(r"[./-]")
+DIGITS_LETTERS_SPLIT = re.compile(r"[0-9]+|[a-z]+")
+QUOTED_PATTERN = re.compile(r"[\"'“”«»]([^\"'“”«»]+)[\"'“”«»]")
+# Sin tildes, como quedan tras fold_for_search.
+SPANISH_STOPWORDS = frozenset("""
+a al algo algun alguna algunas alguno algunos ante antes aqui asi aun bajo bien cada como con contra cual cuales
+cuando de del desde donde dos durante e el ella ellas ello ellos en entre era eran es esa esas ese eso esos esta
+estaba estado estan estar estas este esto estos fue fueron ha hace hacia han hasta hay la las le les lo los mas me
+mi mis mucho muy nada ni no nos o os otra otras otro otros para pero poco por porque que quien quienes se segun
+ser si sido sin sobre son su sus tambien tan tanto te tiene tienen toda todas todo todos tras tu tus u un una unas
+uno unos usted y ya
+""".split())
+# Una pregunta ('¿qué tratamiento...?') no es una búsqueda de un término exacto.
+QUESTION_WORDS = frozenset(["que", "como", "cual", "cuales", "cuando", "donde", "cuanto", "cuantos", "cuanta", "cuantas", "quien", "por"])
+# Palabras de las consultas del chat que no forman parte de lo que se busca.
+QUERY_NOISE_WORDS = frozenset(["paciente", "cedula", "id", "documento", "documentos", "informe", "informes"])
+
+
+def fold_for_search(text):
+    """
+    Minúsculas y sin tildes ('Exploración' -> 'exploracion'). Equivale a fold_text para las letras que
+    reconoce TOKEN_PATTERN, pero sin recorrer el texto carácter a carácter (los informes son largos).
+    """
+    return unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode("ascii")
+
+@functools.lru_cache(maxsize=100000)
+def _token_terms(token):
+    """
+    Términos de un token: ninguno si es una palabra vacía; el token y sus variantes en otro caso.
+    Los tokens con separadores se indexan también sin ellos ('12.345.678' -> '12345678') y los que
+    mezclan cifras y letras también por partes ('20mg' -> '20', 'mg'), para que '20 mg' y '20mg' coincidan.
+    """
+    if token in SPANISH_STOPWORDS or (len(token) < 2 and not token.isdigit()):
+        return ()
+    if TOKEN_SEPARATORS.search(token):
+        return (token, TOKEN_SEPARATORS.sub("", token))
+    if not token.isdigit() and not token.isalpha():
+        return (token, *DIGITS_LETTERS_SPLIT.findall(token))
+    return (token,)
+
+def tokenize(text):
+    """
+    Términos de un texto para BM25: minúsculas, sin tildes ni palabras vacías.
+    """
+    return [term for token in TOKEN_PATTERN.findall(fold_for_search(text)) for term in _token_terms(token)]
+
+def count_terms(text):
+    """
+    Frecuencia de cada término de un texto; equivale a Counter(tokenize(text)).
+    Los tokens que son su propio y único término (casi todos) se cuentan tal cual: solo se
+    expanden las palabras vacías, las dosis, las fechas y los códigos.
+    """
+    counts = Counter(TOKEN_PATTERN.findall(fold_for_search(text)))
+    special_tokens = set(counts).difference(_plain_tokens)
+    for token in special_tokens:
+        terms = _token_terms(token)
+        if terms == (token,):
+            if len(_plain_tokens) < MAX_PLAIN_TOKENS:
+                _plain_tokens.add(token)
+            continue
+        frequency = counts.pop(token)
+        for term in terms:
+            counts[term] += frequency
+    return counts
+
+def _lookup_terms(query, ignored_terms=()):
+    """
+    Términos de una consulta de búsqueda exacta, o None si la consulta parece una pregunta.
+    Un texto entre comillas siempre es una búsqueda exacta.
+    """
+    quoted = QUOTED_PATTERN.findall(query)
+    if quoted:
+        return [term for text in quoted for term in tokenize(text) if term not in ignored_terms]
+    if "?" in query or "¿" in query:
+        return None
+    words = TOKEN_PATTERN.findall(fold_for_search(query))
+    if QUESTION_WORDS.intersection(words):
+        return None
+    words = [
+        word for word in words
+        if word not in SPANISH_STOPWORDS and word not in QUERY_NOISE_WORDS and word not in ignored_terms
+    ]
+    if not words or len(words) > MAX_LOOKUP_TERMS:
+        return None
+    return [term for word in words for term in _token_terms(word)]
+
+
+class LexicalIndex:
+    """
+    Índice invertido con puntuación BM25 de los nodos de un índice publicado.
+
+    Las listas de cada término (posiciones de los nodos que lo contienen y su peso BM25 ya calculado)
+    están en arrays contiguos, así que puntuar una consulta es sumar unos pocos tramos de arrays.
+    No se modifica una vez construido: build() reutiliza los términos de los nodos que ya estaban en
+    el índice anterior (el texto de un nodo no cambia nunca) y solo tokeniza los nuevos.
+    """
+
+    def __init__(self, vocabulary, node_terms, node_patients, node_sections=None):
+        # Término -> ID (solo crece entre versiones), ID de nodo -> (IDs de términos, frecuencias),
+        # ID de nodo -> ID de paciente e ID de nodo -> sección del informe.
+        self._vocabulary = vocabulary
+        self._node_terms = node_terms
+        self._node_patients = node_patients
+        self._node_sections = node_sections or {}
+        self.node_ids = list(node_terms)
+        term_arrays = [node_terms[node_id][0] for node_id in self.node_ids]
+        frequency_arrays = [node_terms[node_id][1] for node_id in self.node_ids]
+        term_ids = np.concatenate(term_arrays) if term_arrays else np.empty(0, dtype=np.int32)
+        frequencies = np.concatenate(frequency_arrays) if frequency_arrays else np.empty(0, dtype=np.float32)
+        node_lengths = np.array([len(terms) for terms in term_arrays], dtype=np.int64)
+        positions = np.repeat(np.arange(len(self.node_ids), dtype=np.int32), node_lengths)
+
+        lengths = np.array([float(counts.sum()) for counts in frequency_arrays], dtype=np.float32)
+        average_length = float(lengths.mean()) if len(lengths) and lengths.mean() > 0 else 1.0
+        length_norms = BM25_K1 * (1 - BM25_B + BM25_B * lengths / average_length)
+        document_frequencies = np.bincount(term_ids, minlength=len(vocabulary)).astype(np.float32)
+        idf = np.log1p((len(self.node_ids) - document_frequencies + 0.5) / (document_frequencies + 0.5))
+        weights = idf[term_ids] * frequencies * (BM25_K1 + 1) / (frequencies + length_norms[positions])
+
+        # Listas de cada término: tramo [offsets[id], offsets[id + 1]) de _positions y _weights.
+        order = np.argsort(term_ids, kind="stable")
+        self._positions = positions[order]
+        self._weights = weights[order].astype(np.float32)
+        self._offsets = np.concatenate(([0], np.cumsum(document_frequencies.astype(np.int64))))
+
+        patient_positions = {}
+        section_positions = {}
+        for position, node_id in enumerate(self.node_ids):
+            patient_positions.setdefault(node_patients.get(node_id), []).append(position)
+            section_positions.setdefault(self._node_sections.get(node_id), []).append(position)
+        self._patient_positions = {
+            patient_id: np.array(positions, dtype=np.int32) for patient_id, positions in patient_positions.items()
+        }
+        self._section_positions = {
+            section: np.array(positions, dtype=np.int32) for section, positions in section_positions.items()
+        }
+
+    @classmethod
+    def build(cls, nodes, previous=None):
+        """
+        Construye el índice con los nodos (TextNode) de un índice de LlamaIndex.
+        """
+        vocabulary = dict(previous._vocabulary) if previous is not None else {}
+        previous_terms = previous._node_terms if previous is not None else {}
+        node_terms = {}
+        node_patients = {}
+        node_sections = {}
+        for node in nodes:
+            terms = previous_terms.get(node.node_id)
+            if terms is None:
+                counts = count_terms(node.get_content())
+                for term in set(counts).difference(vocabulary):
+                    vocabulary[term] = len(vocabulary)
+                terms = (
+                    np.fromiter(map(vocabulary.__getitem__, counts), dtype=np.int32, count=len(counts)),
+                    np.fromiter(counts.values(), dtype=np.float32, count=len(counts)),
+                )
+            node_terms[node.node_id] = terms
+            node_patients[node.node_id] = node.metadata.get("patient_id")
+            node_sections[node.node_id] = node.metadata.get("section")
+        return cls(vocabulary, node_terms, node_patients, node_sections)
+
+    @classmethod
+    def from_index(cls, index, previous=None):
+        """
+        Construye el índice léxico con los nodos de un VectorStoreIndex.
+        """
+        node_ids = list(index.index_struct.nodes_dict.values())
+        nodes = index.docstore.get_nodes(node_ids, raise_error=False)
+        return cls.build([node for node in nodes if node is not None], previous)
+
+    def _postings(self, term):
+        term_id = self._vocabulary.get(term)
+        if term_id is None:
+            return None
+        start, end = self._offsets[term_id], self._offsets[term_id + 1]
+        if start == end:
+            return None
+        return self._positions[start:end], self._weights[start:end]
+
+    def search(self, query, top_k, patient_id=None, terms=None, sections=None):
+        """
+        Nodos con mayor puntuación BM25 para la consulta (solo los del paciente y de las secciones
+        del informe, si se indican).
+        Devuelve una lista de (ID de nodo, puntuación) ordenada de mayor a menor, sin los que no
+        contienen ningún término de la consulta.
+        """
+        terms = set(tokenize(query) if terms is None else terms)
+        scores = np.zeros(len(self.node_ids), dtype=np.float32)
+        for term in terms:
+            postings = self._postings(term)
+            if postings is not None:
+                positions, weights = postings
+                scores[positions] += weights
+        if patient_id is not None:
+            candidates = self._patient_positions.get(patient_id, np.empty(0, dtype=np.int32))
+        else:
+            candidates = np.arange(len(self.node_ids), dtype=np.int32)
+        if sections:
+            in_sections = [self._section_positions[section] for section in sections if section in self._section_positions]
+            if not in_sections:
+                return []
+            candidates = np.intersect1d(candidates, np.concatenate(in_sections))
+        candidates = candidates[scores[candidates] > 0]
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(self.node_ids[position], float(scores[position])) for position in candidates]
+
+    def exact_lookup_terms(self, query, ignored_terms=()):
+        """
+        Términos de la consulta si es una búsqueda exacta ('Sinemet', 'Lisinopril 20mg', una fecha o
+        un texto entre comillas) y todos aparecen en el índice; None en otro caso.
+        ignored_terms no cuentan como términos buscados (el ID del paciente de la consulta).
+        """
+        terms = _lookup_terms(query, ignored_terms)
+        if not terms or not all(self._postings(term) is not None for term in terms):
+            return None
+        return terms
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Recuperación híbrida: combina la búsqueda por similitud de vectores con BM25 sobre
+    el texto de búsqueda de la consulta (embedding_strs del QueryBundle, sin las instrucciones del
+    prompt), con cada lista de puntuaciones escalada a [0, 1].
+
+    - mode="hybrid": fusión de ambas listas con peso alpha para los vectores; si la consulta es una
+      búsqueda exacta y BM25 encuentra nodos, solo se usa BM25 (sin llamada de embeddings).
+    - mode="vector": solo vectores, como as_query_engine().
+    - mode="lexical": solo BM25.
+
+    Con sections (acciones del chat como 'Medicación') solo se buscan nodos de esas secciones de los
+    informes; si no hay ninguno (documentos sin encabezados reconocibles), se busca en todos.
+    """
+
+    def __init__(self, index, lexical_index, patient_id=None, sections=None, mode="hybrid", similarity_top_k=2, alpha=0.5):
+        super().__init__()
+        self._index = index
+        self._lexical_index = lexical_index
+        self._patient_id = patient_id
+        self._sections = list(sections) if sections else None
+        self._mode = mode
+        self._similarity_top_k = similarity_top_k
+        self._alpha = alpha
+
+    def _retrieve(self, query_bundle):
+        with stage_timer("recuperacion"):
+            if self._sections:
+                nodes = self._retrieve_in_sections(query_bundle, self._sections)
+                if nodes:
+                    return nodes
+                logger.debug(f"Sin nodos en las secciones {self._sections}; se busca en todo el documento.")
+            return self._retrieve_in_sections(query_bundle, None)
+
+    def _retrieve_in_sections(self, query_bundle, sections):
+        search_text = " ".join(query_bundle.embedding_strs)
+        if self._mode == "vector" or self._lexical_index is None:
+            return self._vector_retrieve(query_bundle, self._similarity_top_k, sections)
+
+        ignored_terms = set(tokenize(self._patient_id)) if self._patient_id else ()
+        lookup_terms = self._lexical_index.exact_lookup_terms(search_text, ignored_terms)
+        if self._mode == "lexical" or lookup_terms:
+            lexical_hits = self._lexical_index.search(search_text, self._similarity_top_k, self._patient_id, lookup_terms, sections)
+            if lexical_hits or self._mode == "lexical":
+                logger.debug(f"Recuperación léxica (BM25) para '{search_text}': {len(lexical_hits)} nodos.")
+                return self._lexical_nodes(lexical_hits)
+
+        candidates = max(FUSION_CANDIDATES, self._similarity_top_k)
+        lexical_hits = self._lexical_index.search(search_text, candidates, self._patient_id, sections=sections)
+        vector_hits = self._vector_retrieve(query_bundle, candidates, sections)
+        return self._fuse(vector_hits, lexical_hits)
+
+    def _vector_retrieve(self, query_bundle, top_k, sections=None):
+        conditions = []
+        if self._patient_id is not None:
+            conditions.append(ExactMatchFilter(key="patient_id", value=self._patient_id))
+        if sections:
+            conditions.append(MetadataFilter(key="section", value=list(sections), operator=FilterOperator.IN))
+        filters = MetadataFilters(filters=conditions) if conditions else None
+        # Sin la lista de todos los nodos del índice que añade as_retriever(): cada snapshot tiene su
+        # propio almacén de vectores, así que ya solo contiene los nodos de este índice.
+        return VectorIndexRetriever(self._index, similarity_top_k=top_k, filters=filters).retrieve(query_bundle)
+
+    def _lexical_nodes(self, hits):
+        nodes = self._index.docstore.get_nodes([node_id for node_id, _ in hits])
+        return [NodeWithScore(node=node, score=score) for node, (_, score) in zip(nodes, hits)]
+
+    def _fuse(self, vector_hits, lexical_hits):
+        """
+        Puntuación combinada: alpha * similitud normalizada + (1 - alpha) * BM25 normalizado.
+        Un nodo que solo aparece en una de las dos listas puntúa 0 en la otra.
+        """
+        nodes = {hit.node.node_id: hit.node for hit in vector_hits}
+        vector_scores = self._normalized({hit.node.node_id: hit.score or 0.0 for hit in vector_hits})
+        lexical_scores = self._normalized(dict(lexical_hits))
+        missing = [node_id for node_id in lexical_scores if node_id not in nodes]
+        for node in self._index.docstore.get_nodes(missing):
+            nodes[node.node_id] = node
+        fused = {
+            node_id: self._alpha * vector_scores.get(node_id, 0.0) + (1 - self._alpha) * lexical_scores.get(node_id, 0.0)
+            for node_id in nodes
+        }
+        ranked = sorted(fused, key=fused.get, reverse=True)[: self._similarity_top_k]
+        return [NodeWithScore(node=nodes[node_id], score=fused[node_id]) for node_id in ranked]
+
+    @staticmethod
+    def _normalized(scores):
+        """
+        Escala las puntuaciones al intervalo [0, 1] (mínimo-máximo) para poder combinarlas.
+        """
+        if not scores:
+            return {}
+        low = min(scores.values())
+        high = max(scores.values())
+        if high == low:
+            return {node_id: 1.0 for node_id in scores}
+        return {node_id: (score - low) / (high - low) for node_id, score in scores.items()}
@@ -0,0 +1,204 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Tipo MIME del formato de texto de Prometheus.
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Límites (en segundos) de los histogramas de latencia: de una búsqueda BM25 a una llamada lenta a Gemini.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """
+    Métrica con etiquetas: cada combinación de valores de label_names es una serie distinta.
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"La métrica '{self.name}' usa las etiquetas {self.label_names}, no {tuple(labels)}.")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    """
+    Contador que solo crece (llamadas, tokens, aciertos de caché).
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, label_names=()):
+        super().__init__(name, documentation, label_names)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in values]
+
+
+class Histogram(_Metric):
+    """
+    Histograma acumulado de Prometheus (cubetas, suma y número de observaciones por serie).
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # valores de las etiquetas -> [observaciones por cubeta, suma, total]
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][position] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observa la duración del bloque en segundos (también si termina con una excepción).
+        """
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def _samples(self):
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        lines = []
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, key, [("le", _format_value(float(bound)))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(float(total))}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """
+    Métrica cuyo valor se lee al exportar (tamaño del índice, cola de ingesta, contadores de la
+    caché de respuestas). callback devuelve un número o un diccionario valores de etiquetas -> número.
+    """
+
+    def __init__(self, name, documentation, callback, label_names=(), kind="gauge"):
+        super().__init__(name, documentation, label_names)
+        self.kind = kind
+        self.callback = callback
+
+    def _samples(self):
+        try:
+            values = self.callback()
+        except Exception:
+            # Un componente aún sin inicializar no debe romper la exportación del resto.
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [
+            f"{self.name}{_format_labels(self.label_names, key if isinstance(key, tuple) else (key,))} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class MetricsRegistry:
+    """
+    Métricas del proceso, exportadas en el formato de texto de Prometheus.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, label_names=()):
+        return self.register(Counter(name, documentation, label_names))
+
+    def histogram(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, label_names, buckets))
+
+    def callback(self, name, documentation, callback, label_names=(), kind="gauge"):
+        return self.register(CallbackMetric(name, documentation, callback, label_names, kind))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+START_TIME = time.time()
+REGISTRY = MetricsRegistry()
+# Etapas: extraccion, normalizacion, indexacion (troceo y embeddings), embeddings (llamadas a la API),
+# espera_gemini (cola del limitador de llamadas), persistencia, recuperacion, montaje_contexto, llm y pdf.
+STAGE_SECONDS = REGISTRY.histogram(
+    "sinusal_stage_duration_seconds", "Duración de cada etapa de la ingesta y del chat.", ["stage"]
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "sinusal_http_request_duration_seconds", "Duración de las peticiones HTTP por ruta.", ["endpoint", "method", "status"]
+)
+CHAT_TOKENS = REGISTRY.counter(
+    "sinusal_chat_tokens_total", "Tokens (aprox.) de las consultas del chat: entrada, salida y contexto.", ["kind"]
+)
+REGISTRY.callback("sinusal_process_start_time_seconds", "Hora de arranque del proceso (época Unix).", lambda: START_TIME)
+REGISTRY.callback("sinusal_process_id", "PID del proceso que responde (cada worker tiene sus métricas).", os.getpid)
+
+
+def stage_timer(stage):
+    """
+    Context manager que mide una etapa: `with stage_timer("extraccion"): ...`.
+    """
+    return STAGE_SECONDS.time(stage=stage)
@@ -0,0 +1,365 @@
+import json
+import os
+from typing import Any, List, Optional, Sequence
+
+import numpy as np
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.simple import SimpleVectorStore, _build_metadata_filter_fn
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    FilterCondition,
+    FilterOperator,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+from pydantic import PrivateAttr
+
+QUANTIZATIONS = ("float32", "int8")
+# Archivos de una versión persistida, junto al 'default__vector_store.json' que usaría SimpleVectorStore.
+VECTORS_SUFFIX = ".npy"
+SCALES_SUFFIX = ".scales.npy"
+META_SUFFIX = ".meta.json"
+DEFAULT_PERSIST_FNAME = "default__vector_store.json"
+# Tipos de metadatos que se guardan para filtrar (los nodos solo llevan valores simples).
+SCALAR_TYPES = (str, int, float, bool)
+# Filas por bloque al puntuar vectores int8.
+INT8_BLOCK_ROWS = 2048
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+def _quantize_rows(matrix):
+    """
+    Cuantización simétrica por fila a int8: fila ≈ valores * escala. Devuelve (valores, escalas).
+    """
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    values = np.rint(matrix / scales[:, None]).astype(np.int8)
+    return values, scales.astype(np.float32)
+
+def _base_path(persist_path):
+    return persist_path[:-len(".json")] if persist_path.endswith(".json") else persist_path
+
+
+class NumpyVectorStore(BasePydanticVectorStore):
+    """
+    Almacén de vectores en una matriz contigua de numpy (float32, o int8 con una escala por fila).
+
+    - Los vectores se guardan normalizados: la similitud coseno de una consulta con todos los
+      candidatos es un único producto matriz-vector y el top-k sale de np.argpartition.
+    - Los filtros de metadatos (ej. patient_id) se resuelven antes de puntuar con un índice
+      valor -> posiciones, de modo que solo se multiplican las filas del paciente.
+    - Persistido como .npy y cargado con mmap: los procesos que cargan la misma versión comparten
+      la matriz a través de la caché de páginas del sistema operativo.
+    - Los arrays no se modifican nunca en el sitio (añadir o borrar crea arrays nuevos), así que
+      clone() es inmediato y un snapshot publicado no ve los cambios de su copia.
+    El texto de los nodos vive en el docstore (stores_text=False), igual que con SimpleVectorStore.
+    """
+
+    stores_text: bool = False
+    quantization: str = "float32"
+
+    _ids: np.ndarray = PrivateAttr()
+    _ref_doc_ids: np.ndarray = PrivateAttr()
+    _metadata: list = PrivateAttr()
+    _vectors: Optional[np.ndarray] = PrivateAttr()
+    _scales: Optional[np.ndarray] = PrivateAttr()
+    _value_positions: dict = PrivateAttr()
+
+    def __init__(self, quantization="float32", **kwargs):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Cuantización no soportada: '{quantization}' (usa {', '.join(QUANTIZATIONS)}).")
+        super().__init__(quantization=quantization, **kwargs)
+        self._set_arrays(np.array([], dtype=object), np.array([], dtype=object), [], None, None)
+
+    @classmethod
+    def class_name(cls):
+        return "NumpyVectorStore"
+
+    @property
+    def client(self):
+        return None
+
+    @property
+    def node_count(self):
+        return len(self._ids)
+
+    # --- Escritura (siempre con arrays nuevos) ---
+
+    def add(self, nodes: Sequence[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+        matrix = _normalize_rows(np.asarray([node.get_embedding() for node in nodes], dtype=np.float32))
+        if self._vectors is not None and matrix.shape[1] != self._vectors.shape[1]:
+            raise ValueError(f"Dimensión de embedding {matrix.shape[1]} distinta de la del almacén ({self._vectors.shape[1]}).")
+        new_ids = np.array([node.node_id for node in nodes], dtype=object)
+        new_ref_doc_ids = np.array([node.ref_doc_id or "None" for node in nodes], dtype=object)
+        new_metadata = [
+            {key: value for key, value in node.metadata.items() if isinstance(value, SCALAR_TYPES)} for node in nodes
+        ]
+        # Un nodo que se vuelve a añadir sustituye a su versión anterior.
+        node_positions = self._positions_by_column("node_id", self._ids)
+        keep = ~self._membership_mask(node_positions, new_ids)
+        vectors, scales = self._encode(matrix)
+        self._set_arrays(
+            np.concatenate([self._ids[keep], new_ids]),
+            np.concatenate([self._ref_doc_ids[keep], new_ref_doc_ids]),
+            [entry for entry, kept in zip(self._metadata, keep) if kept] + new_metadata,
+            vectors if self._vectors is None else np.concatenate([self._vectors[keep], vectors]),
+            None if scales is None else (scales if self._scales is None else np.concatenate([self._scales[keep], scales])),
+        )
+        if keep.all():
+            # Sin sustituciones las posiciones anteriores no cambian: el índice de IDs se amplía
+            # en lugar de recalcularse entero en la siguiente subida.
+            node_positions = dict(node_positions)
+            for position, node_id in enumerate(new_ids, start=len(keep)):
+                previous = node_positions.get(node_id)
+                node_positions[node_id] = np.array([position], dtype=np.int64) if previous is None else np.append(previous, position)
+            self._value_positions[("column", "node_id")] = node_positions
+        return [node.node_id for node in nodes]
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        self._keep(self._ref_doc_ids != ref_doc_id)
+
+    def delete_nodes(self, node_ids=None, filters=None, **delete_kwargs):
+        remove = self._candidate_mask(filters, node_ids)
+        self._keep(~remove)
+
+    def clear(self):
+        self._keep(np.zeros(len(self._ids), dtype=bool))
+
+    def clone(self):
+        """
+        Copia que comparte los arrays actuales (no se modifican en el sitio) y sus índices de filtros.
+        """
+        store = NumpyVectorStore(quantization=self.quantization)
+        store._set_arrays(self._ids, self._ref_doc_ids, self._metadata, self._vectors, self._scales)
+        store._value_positions = self._value_positions
+        return store
+
+    # --- Consulta ---
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.mode != VectorStoreQueryMode.DEFAULT:
+            raise ValueError(f"Modo de consulta no soportado por NumpyVectorStore: {query.mode}")
+        if query.query_embedding is None:
+            raise ValueError("La consulta necesita un embedding.")
+        if self._vectors is None or not len(self._ids):
+            return VectorStoreQueryResult(similarities=[], ids=[])
+
+        query_vector = np.asarray(query.query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query_vector)
+        if norm:
+            query_vector = query_vector / norm
+
+        positions = None
+        if query.filters is not None or query.node_ids is not None or query.doc_ids is not None:
+            positions = np.flatnonzero(self._candidate_mask(query.filters, query.node_ids, query.doc_ids))
+            if not len(positions):
+                return VectorStoreQueryResult(similarities=[], ids=[])
+        scores = self._scores(query_vector, positions)
+
+        top_k = min(query.similarity_top_k, len(scores))
+        top = np.argpartition(-scores, top_k - 1)[:top_k] if top_k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        rows = top if positions is None else positions[top]
+        return VectorStoreQueryResult(similarities=scores[top].tolist(), ids=self._ids[rows].tolist())
+
+    def _scores(self, query_vector, positions):
+        vectors = self._vectors if positions is None else self._vectors[positions]
+        if self.quantization != "int8":
+            return vectors @ query_vector
+        # int8: se convierte a float32 por bloques que caben en caché, en lugar de toda la matriz de una vez.
+        scores = np.empty(len(vectors), dtype=np.float32)
+        for start in range(0, len(vectors), INT8_BLOCK_ROWS):
+            block = vectors[start:start + INT8_BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32) @ query_vector
+        return scores * (self._scales if positions is None else self._scales[positions])
+
+    def _candidate_mask(self, filters=None, node_ids=None, doc_ids=None):
+        mask = np.ones(len(self._ids), dtype=bool)
+        # Con el índice ID -> posiciones: np.isin sobre arrays de objetos ordena las dos listas y, con
+        # todos los IDs del índice (lo que pasa as_retriever()), tarda casi un segundo con 10.000 nodos.
+        if node_ids is not None:
+            mask &= self._membership_mask(self._positions_by_column("node_id", self._ids), node_ids)
+        if doc_ids is not None:
+            mask &= self._membership_mask(self._positions_by_column("ref_doc_id", self._ref_doc_ids), doc_ids)
+        if filters is not None and filters.filters:
+            mask &= self._filter_mask(filters)
+        return mask
+
+    def _filter_mask(self, filters: MetadataFilters):
+        masks = []
+        for metadata_filter in filters.filters:
+            if isinstance(metadata_filter, MetadataFilters):
+                masks.append(self._filter_mask(metadata_filter))
+            elif metadata_filter.operator in (FilterOperator.EQ, FilterOperator.IN):
+                # Igualdad: posiciones desde el índice valor -> posiciones, sin recorrer los metadatos.
+                values = metadata_filter.value if metadata_filter.operator == FilterOperator.IN else [metadata_filter.value]
+                masks.append(self._membership_mask(self._positions_by_value(metadata_filter.key), values))
+            else:
+                # Resto de operadores: misma semántica que SimpleVectorStore, evaluada fila a fila.
+                matches = _build_metadata_filter_fn(lambda position: self._metadata[position], MetadataFilters(filters=[metadata_filter]))
+                masks.append(np.fromiter((matches(position) for position in range(len(self._ids))), dtype=bool, count=len(self._ids)))
+        if filters.condition == FilterCondition.OR:
+            return np.logical_or.reduce(masks)
+        return np.logical_and.reduce(masks)
+
+    def _membership_mask(self, index, values):
+        mask = np.zeros(len(self._ids), dtype=bool)
+        for value in values:
+            positions = index.get(value)
+            if positions is not None:
+                mask[positions] = True
+        return mask
+
+    def _positions_by_value(self, key):
+        return self._grouped_positions(("metadata", key), (metadata.get(key) for metadata in self._metadata))
+
+    def _positions_by_column(self, name, column):
+        return self._grouped_positions(("column", name), column)
+
+    def _grouped_positions(self, cache_key, values):
+        index = self._value_positions.get(cache_key)
+        if index is None:
+            grouped = {}
+            for position, value in enumerate(values):
+                if value is not None:
+                    grouped.setdefault(value, []).append(position)
+            index = {value: np.array(positions, dtype=np.int64) for value, positions in grouped.items()}
+            self._value_positions[cache_key] = index
+        return index
+
+    # --- Persistencia ---
+
+    def persist(self, persist_path: str = DEFAULT_PERSIST_FNAME, fs=None) -> None:
+        base_path = _base_path(persist_path)
+        os.makedirs(os.path.dirname(base_path) or ".", exist_ok=True)
+        dimension = 0 if self._vectors is None else int(self._vectors.shape[1])
+        vectors = self._vectors if self._vectors is not None else np.zeros((0, 0), dtype=self._dtype())
+        np.save(base_path + VECTORS_SUFFIX, np.ascontiguousarray(vectors))
+        if self.quantization == "int8":
+            np.save(base_path + SCALES_SUFFIX, self._scales if self._scales is not None else np.zeros(0, dtype=np.float32))
+        with open(base_path + META_SUFFIX, "w", encoding="utf-8") as f:
+            json.dump({
+                "quantization": self.quantization,
+                "dimension": dimension,
+                "ids": self._ids.tolist(),
+                "ref_doc_ids": self._ref_doc_ids.tolist(),
+                "metadata": self._metadata,
+            }, f, ensure_ascii=False)
+
+    @staticmethod
+    def persisted_quantization(persist_dir, fname=DEFAULT_PERSIST_FNAME):
+        """
+        Cuantización de un almacén persistido en persist_dir, o None si no hay uno de este tipo.
+        """
+        meta_path = _base_path(os.path.join(persist_dir, fname)) + META_SUFFIX
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)["quantization"]
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir, quantization=None, fname=DEFAULT_PERSIST_FNAME, mmap=True):
+        """
+        Carga el almacén de persist_dir (la matriz, con mmap de solo lectura). Si la carpeta solo
+        tiene el JSON de SimpleVectorStore (índices anteriores), se convierte. Si se pide otra
+        cuantización distinta de la guardada, se convierte en memoria. Sin nada persistido, vacío.
+        """
+        base_path = _base_path(os.path.join(persist_dir, fname))
+        if not os.path.exists(base_path + META_SUFFIX):
+            legacy_path = os.path.join(persist_dir, fname)
+            if os.path.exists(legacy_path):
+                return cls.from_simple_store(SimpleVectorStore.from_persist_path(legacy_path), quantization or "float32")
+            return cls(quantization=quantization or "float32")
+
+        with open(base_path + META_SUFFIX, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        store = cls(quantization=meta["quantization"])
+        mmap_mode = "r" if mmap else None
+        vectors = np.load(base_path + VECTORS_SUFFIX, mmap_mode=mmap_mode) if meta["ids"] else None
+        scales = None
+        if meta["quantization"] == "int8" and meta["ids"]:
+            scales = np.load(base_path + SCALES_SUFFIX, mmap_mode=mmap_mode)
+        store._set_arrays(
+            np.array(meta["ids"], dtype=object), np.array(meta["ref_doc_ids"], dtype=object), meta["metadata"], vectors, scales
+        )
+        if quantization and quantization != store.quantization:
+            store = store.with_quantization(quantization)
+        return store
+
+    @classmethod
+    def from_simple_store(cls, simple_store, quantization="float32"):
+        """
+        Convierte un SimpleVectorStore (embeddings en listas de Python) a este formato.
+        """
+        data = simple_store.data
+        store = cls(quantization=quantization)
+        ids = list(data.embedding_dict)
+        if not ids:
+            return store
+        metadata_dict = data.metadata_dict or {}
+        matrix = _normalize_rows(np.asarray([data.embedding_dict[node_id] for node_id in ids], dtype=np.float32))
+        vectors, scales = store._encode(matrix)
+        store._set_arrays(
+            np.array(ids, dtype=object),
+            np.array([data.text_id_to_ref_doc_id.get(node_id, "None") for node_id in ids], dtype=object),
+            [
+                {key: value for key, value in metadata_dict.get(node_id, {}).items() if not key.startswith("_") and isinstance(value, SCALAR_TYPES)}
+                for node_id in ids
+            ],
+            vectors,
+            scales,
+        )
+        return store
+
+    def with_quantization(self, quantization):
+        """
+        Copia del almacén con otra cuantización (de int8 a float32 se recuperan los valores aproximados).
+        """
+        store = NumpyVectorStore(quantization=quantization)
+        if self._vectors is None:
+            return store
+        matrix = self._vectors.astype(np.float32)
+        if self.quantization == "int8":
+            matrix = _normalize_rows(matrix * self._scales[:, None])
+        vectors, scales = store._encode(matrix)
+        store._set_arrays(self._ids, self._ref_doc_ids, self._metadata, vectors, scales)
+        return store
+
+    # --- Internos ---
+
+    def _dtype(self):
+        return np.int8 if self.quantization == "int8" else np.float32
+
+    def _encode(self, matrix):
+        if self.quantization == "int8":
+            return _quantize_rows(matrix)
+        return matrix, None
+
+    def _keep(self, keep):
+        if keep.all():
+            return
+        self._set_arrays(
+            self._ids[keep],
+            self._ref_doc_ids[keep],
+            [entry for entry, kept in zip(self._metadata, keep) if kept],
+            self._vectors[keep] if self._vectors is not None and keep.any() else None,
+            self._scales[keep] if self._scales is not None and keep.any() else None,
+        )
+
+    def _set_arrays(self, ids, ref_doc_ids, metadata, vectors, scales):
+        self._ids = ids
+        self._ref_doc_ids = ref_doc_ids
+        self._metadata = metadata
+        self._vectors = vectors
+        self._scales = scales
+        # Índices valor -> posiciones de los filtros (metadatos, IDs de nodo y de documento),
+        # calculados al primer uso de cada clave.
+        self._value_positions = {}
@@ -0,0 +1,299 @@
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+# --- Extracción de nombres y fechas en el momento de la ingesta ---
+
+NAME_WORD = r"[A-ZÁÉÍÓÚÑ][a-záéíóúñü]+"
+NAME_PATTERNS = [
+    # 'Paciente: Dionne Maldonado', 'Nombre del paciente: ...'
+    re.compile(rf"(?:Paciente|Nombre(?: del paciente)?)\s*:\s*({NAME_WORD}(?:[ \t]+{NAME_WORD}){{1,3}})"),
+    # Cabecera de informe en mayúsculas: 'INFORME CLÍNICO   JOSE MANUEL ALVAREZ QUIÑONES Fecha de nacimiento: ...'
+    # (las palabras del nombre van separadas por un solo espacio; las columnas del membrete, por varios).
+    re.compile(r"\b([A-ZÁÉÍÓÚÑ]{2,}(?: [A-ZÁÉÍÓÚÑ]{2,}){1,4})[ \t]+Fecha de nacimiento"),
+]
+NUMERIC_DATE_PATTERN = re.compile(r"\b(\d{1,2})/(\d{1,2})/(\d{4}|\d{2})\b")
+SPANISH_DATE_PATTERN = re.compile(
+    r"\b(\d{1,2})\s+de\s+(enero|febrero|marzo|abril|mayo|junio|julio|agosto|septiembre|setiembre|octubre|noviembre|diciembre)\s+de\s+(\d{4})\b",
+    re.IGNORECASE,
+)
+SPANISH_MONTHS = {
+    "enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6, "julio": 7,
+    "agosto": 8, "septiembre": 9, "setiembre": 9, "octubre": 10, "noviembre": 11, "diciembre": 12,
+}
+MAX_DATES_PER_DOCUMENT = 20
+# Especialidades reconocidas en el texto (raíz sin tildes -> nombre). 'cardiolog' cubre 'Cardiología' y 'cardiológico'.
+SPECIALTY_STEMS = {
+    "cardiolog": "Cardiología",
+    "neurolog": "Neurología",
+    "endocrinolog": "Endocrinología",
+    "neumolog": "Neumología",
+    "nefrolog": "Nefrología",
+    "gastroenterolog": "Gastroenterología",
+    "dermatolog": "Dermatología",
+    "traumatolog": "Traumatología",
+    "oftalmolog": "Oftalmología",
+    "otorrinolaringolog": "Otorrinolaringología",
+    "psiquiatr": "Psiquiatría",
+    "ginecolog": "Ginecología",
+    "urolog": "Urología",
+    "oncolog": "Oncología",
+    "hematolog": "Hematología",
+    "reumatolog": "Reumatología",
+    "pediatr": "Pediatría",
+    "radiolog": "Radiología",
+    "medicina interna": "Medicina Interna",
+    "medicina familiar": "Medicina Familiar",
+}
+SPECIALTY_PATTERN = re.compile(r"\b(" + "|".join(re.escape(stem) for stem in SPECIALTY_STEMS) + r")")
+# 'Motivo de Consulta: Control cardiológico de rutina.', 'MOTIVO DE CONSULTA Descartar patologia ...  ANTECEDENTES'
+# o, si no lo hay, el título 'Informe Médico: Fatiga Física y Taquicardias'.
+VISIT_REASON_PATTERN = re.compile(r"(?:motivo de consulta|informe m[eé]dico)\s*:?\s*(.+?)(?:\.|\n|\s{2,}|$)", re.IGNORECASE)
+MAX_VISIT_REASON_CHARS = 200
+# Cambia cuando el registro guarda campos nuevos: los registros anteriores se reconstruyen al arrancar.
+REGISTRY_VERSION = 2
+# Longitud de los grupos de palabras que se buscan en el mensaje del chat (nombre + apellidos).
+MAX_NAME_NGRAM = 4
+MIN_NAME_NGRAM = 2
+
+
+def fold_text(text):
+    """
+    Minúsculas y sin tildes, para buscar nombres sin depender de cómo se escriban ('Quiñones' = 'QUINONES').
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+def name_tokens(text):
+    return re.findall(r"[a-z0-9]+", fold_text(text))
+
+def extract_patient_names(text):
+    """
+    Nombres de paciente presentes en el texto de un informe.
+    """
+    names = []
+    for pattern in NAME_PATTERNS:
+        for match in pattern.finditer(text):
+            name = " ".join(match.group(1).split())
+            if name.title() not in (existing.title() for existing in names):
+                names.append(name.title())
+    return names
+
+def extract_specialties(text):
+    """
+    Especialidades médicas mencionadas en el texto, en orden de aparición.
+    """
+    specialties = []
+    for match in SPECIALTY_PATTERN.finditer(fold_text(text)):
+        specialty = SPECIALTY_STEMS[match.group(1)]
+        if specialty not in specialties:
+            specialties.append(specialty)
+    return specialties
+
+def extract_visit_reason(text):
+    """
+    Motivo de consulta del informe, o None si no aparece.
+    """
+    match = VISIT_REASON_PATTERN.search(text)
+    if not match:
+        return None
+    return " ".join(match.group(1).split())[:MAX_VISIT_REASON_CHARS] or None
+
+def extract_document_dates(text):
+    """
+    Fechas del informe en formato ISO (AAAA-MM-DD), sin repetir y en orden de aparición.
+    """
+    dates = []
+    candidates = []
+    for match in SPANISH_DATE_PATTERN.finditer(text):
+        candidates.append((match.start(), int(match.group(3)), SPANISH_MONTHS[match.group(2).lower()], int(match.group(1))))
+    for match in NUMERIC_DATE_PATTERN.finditer(text):
+        year = int(match.group(3))
+        if year < 100:
+            year += 2000
+        candidates.append((match.start(), year, int(match.group(2)), int(match.group(1))))
+    for _, year, month, day in sorted(candidates):
+        if not (1 <= month <= 12 and 1 <= day <= 31 and 1900 <= year <= 2100):
+            continue
+        iso_date = f"{year:04d}-{month:02d}-{day:02d}"
+        if iso_date not in dates:
+            dates.append(iso_date)
+        if len(dates) >= MAX_DATES_PER_DOCUMENT:
+            break
+    return dates
+
+
+class PatientRegistry:
+    """
+    Registro persistente de pacientes construido en la ingesta: ID -> documentos, nombres, fechas
+    y especialidades (con el motivo de consulta de cada documento).
+
+    Permite saber el paciente de un documento ya registrado sin volver a aplicar las expresiones
+    regulares al arrancar, y resolver un paciente por su nombre (sin tildes ni mayúsculas) con
+    búsquedas en diccionario de los grupos de palabras del mensaje.
+
+    Las vistas por paciente y el índice de nombres se actualizan solo para el paciente afectado al
+    registrar o eliminar un documento, así que sincronizar N documentos al arrancar es O(N).
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.RLock()
+        # documento -> {"patient_id", "content_hash", "names", "dates", "specialties", "visit_reason"}
+        self.documents = {}
+        if path and os.path.exists(path):
+            try:
+                self.documents = _read_documents(path)
+            except Exception as e:
+                logger.warning(f"No se pudo cargar el registro de pacientes '{path}': {e}")
+        self._rebuild_views()
+
+    def reload(self, path=None):
+        """
+        Vuelve a leer el registro desde disco (por defecto desde su propia ruta). Lo usan los
+        procesos de solo lectura cuando otro proceso publica una versión nueva del índice.
+        """
+        documents = _read_documents(path or self.path)
+        with self._lock:
+            self.documents = documents
+            self._rebuild_views()
+
+    def get_document(self, filename):
+        with self._lock:
+            return self.documents.get(filename)
+
+    def register_document(self, filename, patient_id, content_hash, content, save=True):
+        """
+        Registra (o actualiza) un documento con los nombres, fechas, especialidades y motivo de consulta de su texto.
+        """
+        with self._lock:
+            previous = self.documents.get(filename)
+            self.documents[filename] = {
+                "patient_id": patient_id,
+                "content_hash": content_hash,
+                "names": extract_patient_names(content),
+                "dates": extract_document_dates(content),
+                "specialties": extract_specialties(content),
+                "visit_reason": extract_visit_reason(content),
+            }
+            if previous is not None and previous["patient_id"] != patient_id:
+                self._patient_documents[previous["patient_id"]].discard(filename)
+                self._refresh_patient(previous["patient_id"])
+            self._patient_documents.setdefault(patient_id, set()).add(filename)
+            self._refresh_patient(patient_id)
+            if save:
+                self.save()
+
+    def remove_document(self, filename, save=True):
+        with self._lock:
+            entry = self.documents.pop(filename, None)
+            if entry is None:
+                return False
+            self._patient_documents[entry["patient_id"]].discard(filename)
+            self._refresh_patient(entry["patient_id"])
+            if save:
+                self.save()
+            return True
+
+    def get_patient(self, patient_id):
+        with self._lock:
+            patient = self.patients.get(patient_id)
+            return _copy_patient(patient) if patient else None
+
+    def list_patients(self):
+        with self._lock:
+            return [_copy_patient(patient) for _, patient in sorted(self.patients.items())]
+
+    def find_patient_by_name(self, text):
+        """
+        Busca en el texto (ej. un mensaje del chat) el nombre de un paciente registrado.
+        Se prueban primero los grupos de palabras más largos; un grupo que corresponde a
+        varios pacientes se considera ambiguo y se ignora. Devuelve el ID o None.
+        """
+        tokens = name_tokens(text)
+        with self._lock:
+            for size in range(min(MAX_NAME_NGRAM, len(tokens)), MIN_NAME_NGRAM - 1, -1):
+                for start in range(len(tokens) - size + 1):
+                    patient_ids = self._name_index.get(" ".join(tokens[start:start + size]))
+                    if patient_ids and len(patient_ids) == 1:
+                        return next(iter(patient_ids))
+        return None
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            try:
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump({"version": REGISTRY_VERSION, "documents": self.documents}, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                logger.warning(f"No se pudo guardar el registro de pacientes '{self.path}': {e}")
+
+    def _rebuild_views(self):
+        # Vistas derivadas: pacientes agregados e índice de nombres (grupos de 2 a 4 palabras).
+        self.patients = {}
+        self._name_index = {}
+        # paciente -> documentos y paciente -> claves del índice de nombres, para actualizar solo su parte.
+        self._patient_documents = {}
+        self._patient_name_keys = {}
+        for filename, entry in self.documents.items():
+            self._patient_documents.setdefault(entry["patient_id"], set()).add(filename)
+        for patient_id in self._patient_documents:
+            self._refresh_patient(patient_id)
+
+    def _refresh_patient(self, patient_id):
+        """
+        Recalcula la vista agregada y las entradas del índice de nombres de un paciente.
+        """
+        for key in self._patient_name_keys.pop(patient_id, ()):
+            patient_ids = self._name_index[key]
+            patient_ids.discard(patient_id)
+            if not patient_ids:
+                del self._name_index[key]
+        filenames = sorted(self._patient_documents.get(patient_id, ()))
+        if not filenames:
+            self._patient_documents.pop(patient_id, None)
+            self.patients.pop(patient_id, None)
+            return
+
+        patient = {"patient_id": patient_id, "names": [], "documents": filenames, "dates": [], "specialties": []}
+        name_keys = set()
+        for filename in filenames:
+            entry = self.documents[filename]
+            for name in entry["names"]:
+                if name not in patient["names"]:
+                    patient["names"].append(name)
+                tokens = name_tokens(name)
+                for size in range(MIN_NAME_NGRAM, min(MAX_NAME_NGRAM, len(tokens)) + 1):
+                    for start in range(len(tokens) - size + 1):
+                        name_keys.add(" ".join(tokens[start:start + size]))
+            for date in entry["dates"]:
+                if date not in patient["dates"]:
+                    patient["dates"].append(date)
+            for specialty in entry["specialties"]:
+                if specialty not in patient["specialties"]:
+                    patient["specialties"].append(specialty)
+        patient["dates"].sort()
+        for key in name_keys:
+            self._name_index.setdefault(key, set()).add(patient_id)
+        self._patient_name_keys[patient_id] = name_keys
+        self.patients[patient_id] = patient
+
+
+def _read_documents(path):
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    # Un registro de una versión anterior no tiene todos los campos: se reconstruye.
+    if data.get("version") != REGISTRY_VERSION:
+        return {}
+    return data.get("documents", {})
+
+def _copy_patient(patient):
+    return {key: list(value) if isinstance(value, list) else value for key, value in patient.items()}
@@ -0,0 +1,488 @@
+import os
+import re
+import threading
+import unicodedata # Para normalizar caracteres Unicode
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from PyPDF2 import PdfReader, PdfWriter
+
+from reportlab.lib.pagesizes import letter # Para definir el tamaño de página del PDF
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfgen import canvas
+
+from pdf_extraction import process_pool_context
+
+# --- Configuración de página, fuentes y márgenes ---
+PAGE_WIDTH, PAGE_HEIGHT = letter # letter = 612x792 puntos
+MARGIN_LEFT = 72 # 1 pulgada = 72 puntos
+MARGIN_RIGHT = PAGE_WIDTH - 72
+MARGIN_TOP = PAGE_HEIGHT - 72
+MARGIN_BOTTOM = 72
+BODY_TOP = MARGIN_TOP - 60 # Posición inicial del texto después del encabezado
+LINE_HEIGHT = 14
+NORMAL_FONT_SIZE = 10
+HEADING_FONT_SIZE = 12
+SECTION_INDENT = 20 # Pequeña sangría para el contenido de las secciones SOAP
+# Por debajo de este número de secciones un lote se renderiza en el propio proceso.
+MIN_SECTIONS_FOR_POOL = 3
+
+# --- Datos del Membrete ---
+DR_NAME = "Dr. Rodolfo Gutiérrez Caro"
+DR_SPECIALTY = "Especialista en Cardiología"
+DR_COLEGIADO = "Colegiado 332405519"
+CLINIC_INFO = "CliniKa AI - Asistente Médico Virtual"
+CONTACT_INFO = "Contacto: info@clinika-ai.com | Tel: +58 412-1234567" # Ejemplo
+REPORT_TITLE = "Informe Generado por Asistente Médico Virtual:"
+
+# --- Detección de secciones SOAP ---
+# Se aceptan el nombre completo ('Evaluación:', '**Plan**') o la inicial seguida de ':' o '.' ('S:');
+# una línea que solo empieza por esa letra ('Se recomienda...') no es un título.
+SOAP_SECTIONS = [
+    ("SUBJETIVO", re.compile(r"^[#*\s]*(?:subjetivo\b|s(?=\s*[:.]))[*\s]*[:.]?[*\s]*", re.IGNORECASE)),
+    ("OBJETIVO", re.compile(r"^[#*\s]*(?:objetivo\b|o(?=\s*[:.]))[*\s]*[:.]?[*\s]*", re.IGNORECASE)),
+    ("EVALUACIÓN", re.compile(r"^[#*\s]*(?:evaluaci[oó]n\b|e(?=\s*[:.]))[*\s]*[:.]?[*\s]*", re.IGNORECASE)),
+    ("PLAN", re.compile(r"^[#*\s]*(?:plan\b|p(?=\s*[:.]))[*\s]*[:.]?[*\s]*", re.IGNORECASE)),
+]
+SOAP_HEADINGS = {name for name, _ in SOAP_SECTIONS}
+
+
+class GlyphWidthCache:
+    """
+    Anchos de los caracteres de una fuente a un tamaño dado, calculados una sola vez.
+    El ancho de una palabra es la suma de los anchos de sus glifos (ReportLab no aplica kerning);
+    las palabras ya medidas también se guardan, hasta MAX_CACHED_WORDS.
+    """
+
+    MAX_CACHED_WORDS = 50000
+
+    def __init__(self, font_name, font_size):
+        self.font_name = font_name
+        self.font_size = font_size
+        self._char_widths = {}
+        self._word_widths = {}
+
+    def width(self, text):
+        total = self._word_widths.get(text)
+        if total is not None:
+            return total
+        char_widths = self._char_widths
+        total = 0.0
+        for char in text:
+            char_width = char_widths.get(char)
+            if char_width is None:
+                char_width = pdfmetrics.stringWidth(char, self.font_name, self.font_size)
+                char_widths[char] = char_width
+            total += char_width
+        if len(self._word_widths) < self.MAX_CACHED_WORDS:
+            self._word_widths[text] = total
+        return total
+
+_width_caches = {}
+_width_caches_lock = threading.Lock()
+
+def get_width_cache(font_name, font_size):
+    with _width_caches_lock:
+        cache = _width_caches.get((font_name, font_size))
+        if cache is None:
+            cache = _width_caches[(font_name, font_size)] = GlyphWidthCache(font_name, font_size)
+        return cache
+
+def wrap_text(text, max_width, width_cache):
+    """
+    Divide un texto en líneas que caben en max_width, cortando por espacios.
+    Las palabras más largas que una línea se cortan por caracteres.
+    """
+    space_width = width_cache.width(" ")
+    lines = []
+    current_words = []
+    current_width = 0.0
+    for word in text.split():
+        word_width = width_cache.width(word)
+        if word_width > max_width:
+            if current_words:
+                lines.append(" ".join(current_words))
+                current_words, current_width = [], 0.0
+            chunk = ""
+            chunk_width = 0.0
+            for char in word:
+                char_width = width_cache.width(char)
+                if chunk and chunk_width + char_width > max_width:
+                    lines.append(chunk)
+                    chunk, chunk_width = "", 0.0
+                chunk += char
+                chunk_width += char_width
+            current_words, current_width = [chunk], chunk_width
+            continue
+        needed_width = word_width if not current_words else current_width + space_width + word_width
+        if needed_width > max_width:
+            lines.append(" ".join(current_words))
+            current_words, current_width = [word], word_width
+        else:
+            current_words.append(word)
+            current_width = needed_width
+    if current_words:
+        lines.append(" ".join(current_words))
+    return lines
+
+def parse_soap_sections(text):
+    """
+    Clasifica las líneas del texto en títulos de sección SOAP, contenido de sección o texto normal.
+    Devuelve una lista de (tipo, texto) con tipo 'SUBJETIVO', ..., 'CONTENT' o 'NORMAL'.
+    """
+    current_section = None
+    processed_lines = []
+    for line in text.split("\n"):
+        line = line.strip()
+        if not line: # Saltar líneas vacías
+            continue
+        for section_name, pattern in SOAP_SECTIONS:
+            match = pattern.match(line)
+            if match:
+                # Extraer solo el contenido después del título de la sección
+                processed_lines.append((section_name, line[match.end():].strip()))
+                current_section = section_name
+                break
+        else:
+            processed_lines.append(("CONTENT" if current_section else "NORMAL", line))
+    return processed_lines
+
+
+class LetterheadTemplate:
+    """
+    Membrete (encabezado y pie) con las posiciones y anchos calculados una sola vez al arrancar.
+    En cada documento se dibuja una única vez como form XObject y cada página lo referencia con
+    doForm; solo el número de página se dibuja en cada página.
+    """
+
+    FORM_NAME = "membrete"
+
+    def __init__(self, font_name):
+        self.font_name = font_name
+        # Textos alineados a la derecha o centrados: el ancho se mide aquí y no en cada página.
+        self.strings = [
+            (HEADING_FONT_SIZE, MARGIN_LEFT, PAGE_HEIGHT - 40, CLINIC_INFO),
+            (NORMAL_FONT_SIZE, self._right(DR_NAME, NORMAL_FONT_SIZE), PAGE_HEIGHT - 40, DR_NAME),
+            (NORMAL_FONT_SIZE, self._right(DR_SPECIALTY, NORMAL_FONT_SIZE), PAGE_HEIGHT - 55, DR_SPECIALTY),
+            (NORMAL_FONT_SIZE, self._right(DR_COLEGIADO, NORMAL_FONT_SIZE), PAGE_HEIGHT - 70, DR_COLEGIADO),
+            (NORMAL_FONT_SIZE - 2, self._centred(CONTACT_INFO, NORMAL_FONT_SIZE - 2), 40, CONTACT_INFO),
+        ]
+        self.lines = [
+            (MARGIN_LEFT, PAGE_HEIGHT - 80, MARGIN_RIGHT, PAGE_HEIGHT - 80), # Línea divisoria del encabezado
+            (MARGIN_LEFT, 50, MARGIN_RIGHT, 50), # Línea divisoria del pie de página
+        ]
+        self.page_number_widths = get_width_cache(font_name, NORMAL_FONT_SIZE - 2)
+
+    def _right(self, text, font_size):
+        return MARGIN_RIGHT - get_width_cache(self.font_name, font_size).width(text)
+
+    def _centred(self, text, font_size):
+        return PAGE_WIDTH / 2 - get_width_cache(self.font_name, font_size).width(text) / 2
+
+    def register(self, canvas_obj):
+        """
+        Dibuja el membrete como form XObject del documento. Se llama una vez por documento.
+        """
+        canvas_obj.beginForm(self.FORM_NAME)
+        for font_size, x, y, text in self.strings:
+            canvas_obj.setFont(self.font_name, font_size)
+            canvas_obj.drawString(x, y, text)
+        canvas_obj.lines(self.lines)
+        canvas_obj.endForm()
+
+    def draw_page(self, canvas_obj, page_num):
+        canvas_obj.doForm(self.FORM_NAME)
+        page_label = f"Página {page_num}"
+        canvas_obj.setFont(self.font_name, NORMAL_FONT_SIZE - 2)
+        canvas_obj.drawString(PAGE_WIDTH / 2 - self.page_number_widths.width(page_label) / 2, 25, page_label)
+
+
+class _PageLayout:
+    """
+    Coloca líneas de texto de arriba abajo y pasa a una página nueva al llegar al margen, sin dibujar.
+    Sirve para contar las páginas de un informe antes de renderizarlo (paginación de los lotes).
+    """
+
+    def __init__(self, font_name, first_page_number=1):
+        self.font_name = font_name
+        self.page_num = first_page_number - 1
+        self.pages = 0
+        self._new_page()
+
+    def _new_page(self):
+        self.page_num += 1
+        self.pages += 1
+        self.y = BODY_TOP
+
+    def ensure_space(self, height):
+        if self.y - height < MARGIN_BOTTOM:
+            self._new_page()
+
+    def line(self, x, text, font_size=NORMAL_FONT_SIZE, right_text=None):
+        """
+        Añade una línea en x; right_text se alinea al margen derecho en la misma línea (ej. número de página del índice).
+        """
+        if self.y < MARGIN_BOTTOM:
+            self._new_page()
+        self._draw_line(x, text, font_size, right_text)
+        self.y -= LINE_HEIGHT
+
+    def skip(self, height):
+        self.y -= height
+
+    def finish(self):
+        pass
+
+    def _draw_line(self, x, text, font_size, right_text):
+        pass
+
+
+class _PageWriter(_PageLayout):
+    """
+    _PageLayout que dibuja en un canvas, con el membrete en cada página.
+    Las líneas de cada página se emiten en un único objeto de texto; las líneas consecutivas con
+    la misma sangría avanzan con el interlineado (T*) sin volver a posicionar ni medir el texto.
+    """
+
+    def __init__(self, canvas_obj, letterhead, first_page_number=1):
+        self.canvas = canvas_obj
+        self.letterhead = letterhead
+        self.text = None
+        super().__init__(letterhead.font_name, first_page_number)
+
+    def _new_page(self):
+        if self.text is not None:
+            self.canvas.drawText(self.text)
+            self.canvas.showPage()
+        super()._new_page()
+        self.letterhead.draw_page(self.canvas, self.page_num)
+        self.text = self.canvas.beginText()
+        self.font_size = None
+        self.next_line_position = None
+
+    def _draw_line(self, x, text, font_size, right_text):
+        if font_size != self.font_size:
+            self.text.setFont(self.font_name, font_size, LINE_HEIGHT)
+            self.font_size = font_size
+        if self.next_line_position != (x, self.y):
+            self.text.setTextOrigin(x, self.y)
+        self.text.textLine(text)
+        self.next_line_position = (x, self.y - LINE_HEIGHT)
+        if right_text is not None:
+            right_width = get_width_cache(self.font_name, font_size).width(right_text)
+            self.text.setTextOrigin(MARGIN_RIGHT - right_width, self.y)
+            self.text.textLine(right_text)
+            self.next_line_position = None
+
+    def finish(self):
+        self.canvas.drawText(self.text)
+        self.canvas.showPage()
+
+
+def prepare_text(text_content):
+    """
+    Normaliza el texto de la respuesta (buena práctica Unicode) antes de dibujarlo.
+    """
+    normalized_text_content = unicodedata.normalize("NFC", text_content)
+    # Codificación/decodificación explícita para asegurar la compatibilidad con ReportLab
+    return normalized_text_content.encode("utf-8", "ignore").decode("utf-8")
+
+def write_report(writer, text_content, title=REPORT_TITLE):
+    """
+    Escribe un informe (título y líneas, con formato SOAP si lo detecta) en un _PageLayout/_PageWriter.
+    """
+    widths = get_width_cache(writer.font_name, NORMAL_FONT_SIZE)
+    body_width = MARGIN_RIGHT - MARGIN_LEFT
+
+    for line_part in wrap_text(prepare_text(title), body_width, widths):
+        writer.line(MARGIN_LEFT, line_part)
+    writer.skip(LINE_HEIGHT)
+
+    for item_type, text_to_draw in parse_soap_sections(prepare_text(text_content)):
+        # Manejo de salto de página antes de dibujar cada elemento
+        required_height = LINE_HEIGHT
+        if item_type in SOAP_HEADINGS:
+            required_height += (HEADING_FONT_SIZE - NORMAL_FONT_SIZE) + LINE_HEIGHT # Espacio extra para el título
+        writer.ensure_space(required_height)
+
+        if item_type in SOAP_HEADINGS:
+            writer.line(MARGIN_LEFT, item_type + ":", HEADING_FONT_SIZE)
+            for line_part in wrap_text(text_to_draw, body_width - SECTION_INDENT, widths):
+                writer.line(MARGIN_LEFT + SECTION_INDENT, line_part)
+        else: # Tipo "CONTENT" o "NORMAL"
+            for line_part in wrap_text(text_to_draw, body_width, widths):
+                writer.line(MARGIN_LEFT, line_part)
+        writer.skip(LINE_HEIGHT / 2) # Pequeño espacio extra entre secciones/párrafos
+
+def count_report_pages(text_content, font_name, title=REPORT_TITLE):
+    """
+    Número de páginas que ocupará un informe, sin renderizarlo.
+    """
+    layout = _PageLayout(font_name)
+    write_report(layout, text_content, title)
+    return layout.pages
+
+def render_chat_response_pdf(text_content, letterhead, first_page_number=1, title=REPORT_TITLE):
+    """
+    Genera el PDF con membrete de una respuesta del chatbot y devuelve (bytes del PDF, número de páginas).
+    first_page_number permite numerar las páginas de una sección dentro de un documento mayor.
+    """
+    buffer_pdf = BytesIO()
+    c = canvas.Canvas(buffer_pdf, pagesize=letter)
+    letterhead.register(c)
+    writer = _PageWriter(c, letterhead, first_page_number)
+    write_report(writer, text_content, title)
+    writer.finish()
+    c.save() # Guardar el contenido del PDF
+    return buffer_pdf.getvalue(), writer.pages
+
+# --- Exportación en lote: varias respuestas en un único documento con índice ---
+
+TOC_TITLE = "Índice"
+TOC_GROUP_INDENT = 15
+
+_render_pool = None
+_render_pool_key = None
+_render_pool_lock = threading.Lock()
+# Membrete de cada proceso del pool (se crea una vez por proceso).
+_worker_letterhead = None
+
+
+class ExportSection:
+    """
+    Una respuesta del lote: título de la sección, texto y grupo (ej. 'Paciente 14473217') o None.
+    """
+
+    def __init__(self, title, text_content, group=None):
+        self.title = title
+        self.text_content = text_content
+        self.group = group
+        self.first_page = None
+        self.pages = None
+
+
+def _init_render_worker(font_name, font_path):
+    global _worker_letterhead
+    from reportlab.pdfbase import ttfonts
+    pdfmetrics.registerFont(ttfonts.TTFont(font_name, font_path))
+    _worker_letterhead = LetterheadTemplate(font_name)
+
+def _render_section_in_worker(text_content, title, first_page_number):
+    return render_chat_response_pdf(text_content, _worker_letterhead, first_page_number, title)[0]
+
+def _get_render_pool(max_workers, font_name, font_path):
+    global _render_pool, _render_pool_key
+    key = (max_workers, font_name, font_path)
+    with _render_pool_lock:
+        if _render_pool is None or _render_pool_key != key:
+            if _render_pool is not None:
+                _render_pool.shutdown(wait=False, cancel_futures=True)
+            _render_pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=process_pool_context(),
+                initializer=_init_render_worker,
+                initargs=(font_name, font_path),
+            )
+            _render_pool_key = key
+        return _render_pool
+
+def _reset_render_pool():
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is not None:
+            _render_pool.shutdown(wait=False, cancel_futures=True)
+        _render_pool = None
+
+def _table_of_contents_entries(sections):
+    """
+    Líneas del índice: (sangría, texto, página o None), con una cabecera por grupo.
+    """
+    entries = []
+    current_group = None
+    for section in sections:
+        if section.group is not None and section.group != current_group:
+            entries.append((0, section.group, section.first_page))
+            current_group = section.group
+        indent = TOC_GROUP_INDENT if section.group is not None else 0
+        entries.append((indent, section.title, section.first_page))
+    return entries
+
+def _write_table_of_contents(writer, entries):
+    widths = get_width_cache(writer.font_name, NORMAL_FONT_SIZE)
+    writer.line(MARGIN_LEFT, TOC_TITLE, HEADING_FONT_SIZE)
+    writer.skip(LINE_HEIGHT)
+    page_column_width = widths.width("0000")
+    for indent, text, page in entries:
+        available_width = MARGIN_RIGHT - MARGIN_LEFT - indent - page_column_width
+        lines = wrap_text(prepare_text(text), available_width, widths) or [""]
+        for position, line_part in enumerate(lines):
+            is_last = position == len(lines) - 1
+            writer.line(MARGIN_LEFT + indent, line_part, right_text=str(page) if is_last and page is not None else None)
+
+def render_batch_pdf(sections, letterhead, font_path, output, max_workers=None):
+    """
+    Compila varias respuestas en un único PDF paginado con índice y marcadores, y lo escribe en output.
+
+    1. Paginación: se cuentan las páginas de cada sección (sin dibujar) para conocer la página en
+       la que empieza y poder numerar el pie de forma continua.
+    2. Las secciones se renderizan en paralelo en un pool de procesos (o en serie si hay pocas).
+    3. Se unen con el índice delante y se añaden marcadores (outline) por grupo y sección.
+    Devuelve el número total de páginas.
+    """
+    font_name = letterhead.font_name
+    for section in sections:
+        section.pages = count_report_pages(section.text_content, font_name, section.title)
+
+    # El índice va delante: sus páginas se cuentan con números provisionales del mismo ancho.
+    for section in sections:
+        section.first_page = 0
+    toc_layout = _PageLayout(font_name)
+    _write_table_of_contents(toc_layout, _table_of_contents_entries(sections))
+    next_page = toc_layout.pages + 1
+    for section in sections:
+        section.first_page = next_page
+        next_page += section.pages
+
+    max_workers = max_workers or os.cpu_count() or 1
+    if len(sections) < MIN_SECTIONS_FOR_POOL or max_workers == 1:
+        rendered = [
+            render_chat_response_pdf(section.text_content, letterhead, section.first_page, section.title)[0]
+            for section in sections
+        ]
+    else:
+        pool = _get_render_pool(max_workers, font_name, font_path)
+        try:
+            futures = [
+                pool.submit(_render_section_in_worker, section.text_content, section.title, section.first_page)
+                for section in sections
+            ]
+            rendered = [future.result() for future in futures]
+        except BrokenProcessPool:
+            _reset_render_pool()
+            raise
+
+    toc_buffer = BytesIO()
+    c = canvas.Canvas(toc_buffer, pagesize=letter)
+    letterhead.register(c)
+    toc_writer = _PageWriter(c, letterhead)
+    _write_table_of_contents(toc_writer, _table_of_contents_entries(sections))
+    toc_writer.finish()
+    c.save()
+
+    merged = PdfWriter()
+    for pdf_bytes in [toc_buffer.getvalue()] + rendered:
+        for page in PdfReader(BytesIO(pdf_bytes)).pages:
+            merged.add_page(page)
+
+    group_outlines = {}
+    for section in sections:
+        parent = None
+        if section.group is not None:
+            parent = group_outlines.get(section.group)
+            if parent is None:
+                parent = group_outlines[section.group] = merged.add_outline_item(section.group, section.first_page - 1)
+        merged.add_outline_item(section.title, section.first_page - 1, parent=parent)
+
+    merged.write(output)
+    return next_page - 1
@@ -0,0 +1,255 @@
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import PyPDF2
+
+# Las páginas se separan con el mismo carácter que usa la normalización para detectar membretes por página.
+from text_normalization import PAGE_SEPARATOR
+
+logger = logging.getLogger(__name__)
+
+# Por debajo de este número de páginas el PDF se extrae en el propio hilo, sin pasar por el pool.
+MIN_PAGES_FOR_POOL = 4
+
+
+def process_pool_context():
+    """
+    Contexto de multiprocessing para los pools de procesos de los PDF. El proceso de Flask tiene
+    hilos (peticiones, ingesta, calentamiento, vigilancia del índice) y una conexión SQLite: un fork
+    podría copiar un lock tomado por otro hilo y bloquear al hijo, así que los procesos se crean
+    con forkserver (spawn donde no existe, como en Windows).
+    """
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+def _extract_page_range(path, start, stop):
+    """
+    Extrae el texto de las páginas [start, stop). Se ejecuta en un proceso del pool, que abre y
+    analiza el PDF una sola vez para todo el tramo. Devuelve (textos, errores por página).
+    """
+    texts = []
+    errors = {}
+    with open(path, "rb") as f:
+        reader = PyPDF2.PdfReader(f)
+        for page_number in range(start, stop):
+            try:
+                texts.append(reader.pages[page_number].extract_text() or "")
+            except Exception as e:
+                texts.append("")
+                errors[page_number] = str(e)
+    return texts, errors
+
+def _page_ranges(num_pages, parts):
+    """
+    Reparte las páginas en `parts` tramos contiguos de tamaño parecido.
+    """
+    size, remainder = divmod(num_pages, parts)
+    ranges = []
+    start = 0
+    for part in range(parts):
+        stop = start + size + (1 if part < remainder else 0)
+        if stop > start:
+            ranges.append((start, stop))
+        start = stop
+    return ranges
+
+
+class _SharedExtractionPool:
+    """
+    Pool de procesos compartido por todas las extracciones del proceso, creado la primera vez que
+    hace falta: un PDF no paga el arranque de procesos nuevos.
+
+    Un proceso bloqueado no se puede recuperar sin terminar su pool, y terminarlo cancelaría el
+    trabajo de otras ingestas simultáneas. Por eso la extracción que detecta el bloqueo retira el
+    pool (las siguientes usan uno nuevo) y sus procesos se terminan cuando lo suelta la última
+    extracción que lo estaba usando.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._users = {}
+        self._retired = set()
+
+    def acquire(self, max_workers):
+        with self._lock:
+            if self._executor is not None and getattr(self._executor, "_broken", False):
+                # Un proceso del pool murió durante otra extracción: ya no acepta trabajos.
+                self._retired.add(self._executor)
+                self._executor = None
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=process_pool_context())
+            self._users[self._executor] = self._users.get(self._executor, 0) + 1
+            return self._executor
+
+    def release(self, executor):
+        with self._lock:
+            self._users[executor] -= 1
+            if self._users[executor] > 0:
+                return
+            del self._users[executor]
+            if executor not in self._retired:
+                return
+            self._retired.discard(executor)
+        _terminate_executor(executor)
+
+    def retire(self, executor):
+        """
+        Deja de repartir trabajo a un pool con un proceso bloqueado o caído.
+        """
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+            self._retired.add(executor)
+
+def _terminate_executor(executor):
+    """
+    Termina los procesos de un pool (también el que sigue ocupado con una página bloqueada).
+    """
+    # ProcessPoolExecutor no expone sus procesos; shutdown() no detiene uno que no responde.
+    processes = list((getattr(executor, "_processes", None) or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        process.join(timeout=5)
+        if process.is_alive():
+            process.kill()
+
+_pool = _SharedExtractionPool()
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _extract_in_pool(path, num_pages, max_workers, page_timeout):
+    """
+    Reparte las páginas en tramos contiguos entre los procesos del pool; cada proceso analiza el
+    archivo una sola vez para todo su tramo. Devuelve (textos, errores por página).
+    """
+    pages = [""] * num_pages
+    errors = {}
+    ranges = _page_ranges(num_pages, min(max_workers, num_pages))
+    executors = [_pool.acquire(max_workers)]
+    try:
+        futures = []
+        retry_pages = []
+        for start, stop in ranges:
+            try:
+                futures.append((start, stop, executors[0].submit(_extract_page_range, path, start, stop)))
+            except BrokenProcessPool:
+                retry_pages.extend(range(start, stop))
+        # Los tramos se extraen a la vez: cada uno dispone del plazo de todas sus páginas.
+        deadline = time.monotonic() + page_timeout * max(stop - start for start, stop in ranges)
+        for start, stop, future in futures:
+            try:
+                texts, range_errors = future.result(timeout=max(0, deadline - time.monotonic()))
+            except (FutureTimeoutError, BrokenProcessPool):
+                # Una página bloqueada (o un proceso caído) en el tramo: se reintentan sus páginas una a una.
+                retry_pages.extend(range(start, stop))
+                continue
+            except Exception as e:
+                for page_number in range(start, stop):
+                    errors[page_number] = str(e)
+                continue
+            pages[start:stop] = texts
+            errors.update(range_errors)
+
+        if retry_pages:
+            _pool.retire(executors[-1])
+            executors.append(_pool.acquire(max_workers))
+            for page_number in sorted(retry_pages):
+                try:
+                    future = executors[-1].submit(_extract_page_range, path, page_number, page_number + 1)
+                    texts, range_errors = future.result(timeout=page_timeout)
+                except FutureTimeoutError:
+                    errors[page_number] = f"tiempo de extracción superado ({page_timeout} s)"
+                except BrokenProcessPool as e:
+                    errors[page_number] = f"proceso de extracción terminado inesperadamente: {e}"
+                except Exception as e:
+                    errors[page_number] = str(e)
+                    continue
+                else:
+                    pages[page_number] = texts[0]
+                    errors.update(range_errors)
+                    continue
+                # La página sigue bloqueando su proceso: las siguientes se reintentan en otro pool.
+                _pool.retire(executors[-1])
+                executors.append(_pool.acquire(max_workers))
+    finally:
+        for executor in executors:
+            _pool.release(executor)
+    return pages, errors
+
+
+class PdfExtractionResult:
+    """
+    Resultado de la extracción: texto de cada página y errores de las páginas que fallaron.
+    """
+
+    def __init__(self, pages, errors=None, from_cache=False):
+        self.pages = pages
+        self.errors = errors or {}
+        self.from_cache = from_cache
+
+    @property
+    def text(self):
+        # Las páginas se unen una sola vez al final, separadas por un salto de página.
+        return PAGE_SEPARATOR.join(self.pages)
+
+
+def extract_pdf_pages(path, max_workers=None, page_timeout=30, cache_dir=None):
+    """
+    Extrae el texto de un PDF en paralelo, por tramos de páginas, en el pool de procesos compartido.
+
+    - Los PDF de menos de MIN_PAGES_FOR_POOL páginas se extraen en el propio hilo: el intercambio
+      con otro proceso cuesta más que la extracción. En ellos no se aplica el tiempo máximo.
+    - Cada página tiene su propio tiempo máximo; una página que falla o tarda demasiado queda
+      vacía y se anota en errors, sin perder el resto del documento.
+    - Si se indica cache_dir, el resultado se guarda por hash del archivo y los PDF ya
+      extraídos no se vuelven a procesar (solo se cachean extracciones sin errores).
+    """
+    cache_path = None
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        cache_path = os.path.join(cache_dir, f"{file_sha256(path)}.json")
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, "r", encoding="utf-8") as f:
+                    return PdfExtractionResult(json.load(f)["pages"], from_cache=True)
+            except Exception as e:
+                logger.warning(f"Caché de extracción ilegible '{cache_path}', se extrae de nuevo: {e}")
+
+    with open(path, "rb") as f:
+        num_pages = len(PyPDF2.PdfReader(f).pages)
+
+    if num_pages < MIN_PAGES_FOR_POOL:
+        pages, errors = _extract_page_range(path, 0, num_pages)
+    else:
+        pages, errors = _extract_in_pool(path, num_pages, max_workers or os.cpu_count() or 1, page_timeout)
+
+    for page_number, error in errors.items():
+        logger.warning(f"No se pudo extraer la página {page_number + 1} de {path}: {error}")
+
+    if cache_path and not errors:
+        try:
+            tmp_path = f"{cache_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"pages": pages}, f, ensure_ascii=False)
+            os.replace(tmp_path, cache_path)
+        except Exception as e:
+            logger.warning(f"No se pudo guardar la caché de extracción '{cache_path}': {e}")
+
+    return PdfExtractionResult(pages, errors)
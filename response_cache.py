@@ -0,0 +1,140 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(text):
+    """
+    Normaliza el mensaje del usuario para la clave de caché: minúsculas, sin tildes y
+    con los espacios colapsados ('Medicación ' y 'medicacion' comparten entrada).
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class ResponseCache:
+    """
+    Caché LRU acotada de respuestas del chat, opcionalmente persistida en disco.
+
+    La clave combina el mensaje normalizado, el ID del paciente y la versión del índice
+    para ese paciente: al indexar o eliminar un documento cambia la versión y las entradas
+    antiguas dejan de encontrarse; además se eliminan explícitamente con invalidate_patient().
+
+    Los cambios no se escriben en cada fallo: se marcan como pendientes y un temporizador
+    guarda el archivo como mucho una vez cada flush_delay segundos (y al cerrar el proceso).
+    """
+
+    def __init__(self, max_entries=512, persist_path=None, flush_delay=5.0):
+        self.max_entries = max_entries
+        self.persist_path = persist_path
+        self.flush_delay = flush_delay
+        self._lock = threading.Lock()
+        # Serializa las escrituras del archivo (temporizador, flush() explícito y salida del proceso).
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._flush_timer = None
+        # clave -> {"patient_id": ..., "value": ...}; el orden refleja el uso más reciente.
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if persist_path and os.path.exists(persist_path):
+            try:
+                with open(persist_path, "r", encoding="utf-8") as f:
+                    for key, entry in json.load(f):
+                        self._entries[key] = entry
+                self._trim()
+            except Exception as e:
+                logger.warning(f"No se pudo cargar la caché de respuestas '{persist_path}': {e}")
+        if persist_path:
+            atexit.register(self.flush)
+
+    @staticmethod
+    def make_key(user_message, patient_id, index_version):
+        raw = f"{normalize_prompt(user_message)}\x00{patient_id or ''}\x00{index_version}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry["value"]
+
+    def put(self, key, value, patient_id=None):
+        with self._lock:
+            self._entries[key] = {"patient_id": patient_id, "value": value}
+            self._entries.move_to_end(key)
+            self._trim()
+            self._mark_dirty()
+
+    def invalidate_patient(self, patient_id):
+        """
+        Elimina las entradas del paciente y las de consultas sin paciente (que buscan en todo el índice).
+        Devuelve el número de entradas eliminadas.
+        """
+        with self._lock:
+            stale_keys = [
+                key for key, entry in self._entries.items()
+                if entry["patient_id"] in (patient_id, None)
+            ]
+            for key in stale_keys:
+                del self._entries[key]
+            if stale_keys:
+                self._mark_dirty()
+            return len(stale_keys)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _trim(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _mark_dirty(self):
+        """
+        Anota que hay cambios sin guardar y programa el guardado si no hay uno pendiente.
+        Se llama con self._lock tomado.
+        """
+        if not self.persist_path:
+            return
+        self._dirty = True
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.flush_delay, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def flush(self):
+        """
+        Guarda en disco los cambios pendientes. Lo llama el temporizador y, al salir, atexit.
+        """
+        with self._save_lock:
+            with self._lock:
+                if self._flush_timer is not None:
+                    self._flush_timer.cancel()
+                    self._flush_timer = None
+                if not self._dirty:
+                    return
+                self._dirty = False
+                # La copia se hace bajo el lock; la escritura del JSON no bloquea las peticiones.
+                entries = list(self._entries.items())
+            try:
+                tmp_path = f"{self.persist_path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(entries, f, ensure_ascii=False)
+                os.replace(tmp_path, self.persist_path)
+            except Exception as e:
+                logger.warning(f"No se pudo guardar la caché de respuestas '{self.persist_path}': {e}")
+                with self._lock:
+                    self._mark_dirty()
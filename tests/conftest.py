@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Los módulos del servicio están en la raíz del repositorio (se ejecutan como scripts, sin paquete).
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
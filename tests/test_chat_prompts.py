@@ -0,0 +1,36 @@
+from chat_prompts import (
+    CHAT_QA_TEMPLATE, NO_PATIENT_INSTRUCTION, QA_TEMPLATE_TOKENS, SYSTEM_PROMPT, ChatRequest, build_instruction,
+    build_retrieval_query,
+)
+from context_assembly import estimate_tokens
+from intents import CHAT_INTENTS
+
+
+def test_retrieval_query_drops_patient_mentions_and_adds_the_intent_topic():
+    intent = CHAT_INTENTS.classify("Medicación.")
+    query = build_retrieval_query("Medicación del paciente 14473217", ["14473217"], intent)
+    assert "14473217" not in query
+    assert query == f"{intent.topic} Medicación del paciente"
+    assert build_retrieval_query("¿Tiene alergias?") == "¿Tiene alergias?"
+    # Si el mensaje solo era la mención del paciente, se busca con el mensaje original.
+    assert build_retrieval_query("14473217", ["14473217"]) == "14473217"
+
+def test_instruction_carries_the_patient_focus_and_the_question():
+    instruction = build_instruction("¿Tiene alergias?", "14473217")
+    assert "14473217" in instruction and "¿Tiene alergias?" in instruction
+    assert SYSTEM_PROMPT not in instruction
+    assert NO_PATIENT_INSTRUCTION in build_instruction("¿Tiene alergias?")
+
+def test_only_the_retrieval_query_is_embedded():
+    request = ChatRequest(
+        "Alergias del paciente 14473217", "Alergias del paciente", build_instruction("Alergias", "14473217"), "14473217"
+    )
+    bundle = request.query_bundle()
+    assert bundle.query_str == request.instruction
+    assert bundle.embedding_strs == ["Alergias del paciente"]
+    assert request.prompt_tokens() == QA_TEMPLATE_TOKENS + estimate_tokens(request.instruction)
+
+def test_system_prompt_is_a_separate_message():
+    messages = CHAT_QA_TEMPLATE.format_messages(context_str="Alergia a la penicilina.", query_str="¿Alergias?")
+    assert messages[0].content == SYSTEM_PROMPT
+    assert "Alergia a la penicilina." in messages[1].content and "¿Alergias?" in messages[1].content
@@ -0,0 +1,56 @@
+from llama_index.core import Document
+
+from clinical_sections import ClinicalSectionParser, split_sections
+
+
+def sections_of(text):
+    return [section for section, _ in split_sections(text)]
+
+
+def test_uppercase_and_colon_headings_open_sections():
+    text = (
+        "Paciente 55555555. Fecha 12/03/2024.\n"
+        "MOTIVO DE CONSULTA\nPalpitaciones desde hace un mes.\n"
+        "Alergias: no conocidas.\n"
+        "TRATAMIENTO\nBisoprolol 2,5 mg cada 24 horas."
+    )
+    sections = split_sections(text)
+    assert [section for section, _ in sections] == ["encabezado", "motivo_consulta", "alergias", "tratamiento"]
+    assert sections[1][1].startswith("MOTIVO DE CONSULTA")
+    assert sections[3][1] == "TRATAMIENTO\nBisoprolol 2,5 mg cada 24 horas."
+
+def test_lowercase_heading_words_inside_a_sentence_are_not_headings():
+    text = (
+        "DIAGNÓSTICO PRINCIPAL - Fibrilación auricular paroxística. "
+        "Se inicia tratamiento con apixaban. El plan es revisar en tres meses. "
+        "Tratamiento con bisoprolol bien tolerado. ECG 27/05/2025 en ritmo sinusal."
+    )
+    assert sections_of(text) == ["diagnostico"]
+
+def test_numbered_items_are_not_headings():
+    text = (
+        "PRUEBAS COMPLEMENTARIAS\n"
+        "1.  Electrocardiograma de 12 derivaciones sin alteraciones.\n"
+        "2. Ecocardiograma transtorácico normal."
+    )
+    assert sections_of(text) == ["pruebas"]
+
+def test_uppercase_headings_joined_by_pdf_extraction():
+    # La extracción del PDF junta las líneas: el encabezado en mayúsculas sigue a la frase anterior.
+    text = (
+        "Paciente 55555555. ANTECEDENTES PERSONALES Hipertensión arterial y bradiarritmias "
+        "DIAGNÓSTICO PRINCIPAL - Enfermedad del nodo sinusal TRATAMIENTO Marcapasos bicameral."
+    )
+    assert sections_of(text) == ["encabezado", "antecedentes", "diagnostico", "tratamiento"]
+
+def test_heading_without_text_joins_the_next_section():
+    text = "ANTECEDENTES\nAlergias: penicilina.\nMedicación previa: enalapril 10 mg."
+    sections = split_sections(text)
+    assert [section for section, _ in sections] == ["alergias", "medicacion"]
+    assert sections[0][1].startswith("ANTECEDENTES")
+
+def test_parser_tags_nodes_with_their_section():
+    document = Document(text="Paciente 55555555.\nALERGIAS\nPenicilina.\nTRATAMIENTO\nBisoprolol 2,5 mg.", doc_id="a.txt")
+    nodes = ClinicalSectionParser(chunk_size=256, chunk_overlap=0).get_nodes_from_documents([document])
+    assert [node.metadata["section"] for node in nodes] == ["encabezado", "alergias", "tratamiento"]
+    assert all(node.ref_doc_id == "a.txt" for node in nodes)
@@ -0,0 +1,61 @@
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+
+from context_assembly import ContextAssembler, estimate_tokens
+
+
+def retrieved(*texts):
+    return [NodeWithScore(node=TextNode(id_=f"nodo-{rank}", text=text), score=1.0 - rank / 10) for rank, text in enumerate(texts)]
+
+def query(text):
+    return QueryBundle(query_str=text, custom_embedding_strs=[text])
+
+def contents(nodes):
+    return [node.node.get_content() for node in nodes]
+
+
+def test_removes_repeated_and_near_duplicate_sentences():
+    nodes = retrieved(
+        "Paciente con hipertensión arterial en tratamiento con enalapril. Refiere palpitaciones ocasionales.",
+        "Paciente con hipertensión arterial en tratamiento con enalapril diario. Ecocardiograma sin alteraciones.",
+        "Refiere palpitaciones ocasionales.",
+    )
+    assembler = ContextAssembler(token_budget=2000)
+    result = assembler.postprocess_nodes(nodes, query_bundle=query("palpitaciones"))
+    assert contents(result) == [
+        "Paciente con hipertensión arterial en tratamiento con enalapril. Refiere palpitaciones ocasionales.",
+        "Ecocardiograma sin alteraciones.",
+    ]
+    assert assembler.report["frases_duplicadas"] == 2
+    # Los nodos del docstore no se modifican.
+    assert nodes[1].node.get_content().startswith("Paciente con hipertensión")
+
+def test_sentences_with_different_values_are_not_duplicates():
+    nodes = retrieved(
+        "Frecuencia cardiaca media 61 lpm durante la noche.",
+        "Frecuencia cardiaca media 62 lpm durante la noche.",
+    )
+    result = ContextAssembler(token_budget=2000).postprocess_nodes(nodes, query_bundle=query("frecuencia"))
+    assert len(result) == 2
+
+def test_budget_keeps_the_most_relevant_sentences_in_original_order():
+    filler = " ".join(f"Revisión número {number} sin incidencias en la consulta." for number in range(20))
+    nodes = retrieved(
+        f"{filler} Alergia a la penicilina documentada.",
+        "Tratamiento con bisoprolol 2,5 mg. Alergia al contraste yodado.",
+    )
+    assembler = ContextAssembler(token_budget=60)
+    result = assembler.postprocess_nodes(nodes, query_bundle=query("alergia penicilina"))
+    text = "\n".join(contents(result))
+    assert "Alergia a la penicilina documentada." in text
+    assert "Alergia al contraste yodado." in text
+    assert text.index("penicilina") < text.index("contraste")
+    assert "Revisión número 19" not in text
+    assert assembler.report["tokens_contexto"] <= 60
+    assert assembler.report["tokens_contexto_recuperado"] > 60
+
+def test_sentence_larger_than_budget_is_truncated():
+    nodes = retrieved("Alergia " + "muy " * 400 + "grave.")
+    assembler = ContextAssembler(token_budget=20)
+    result = assembler.postprocess_nodes(nodes, query_bundle=query("alergia"))
+    assert len(result) == 1
+    assert estimate_tokens(result[0].node.get_content()) < 20
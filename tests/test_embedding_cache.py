@@ -0,0 +1,81 @@
+from llama_index.core.embeddings import MockEmbedding
+from pydantic import PrivateAttr
+
+from embedding_cache import CachedEmbedding, EmbeddingCacheStore
+
+
+class CountingEmbedding(MockEmbedding):
+    """
+    Modelo de prueba que anota los lotes que recibe.
+    """
+
+    _batches: list = PrivateAttr(default_factory=list)
+
+    def __init__(self):
+        super().__init__(embed_dim=4, embed_batch_size=2)
+
+    @property
+    def batches(self):
+        return self._batches
+
+    def _get_text_embeddings(self, texts):
+        self.batches.append(list(texts))
+        return [[float(len(text)), 1.0, 0.0, 0.5] for text in texts]
+
+    def _get_query_embedding(self, query):
+        self.batches.append([query])
+        return [0.0, 0.0, 1.0, float(len(query))]
+
+
+def test_only_missing_texts_are_embedded_in_batches(tmp_path):
+    inner = CountingEmbedding()
+    model = CachedEmbedding(inner, EmbeddingCacheStore(str(tmp_path / "cache.sqlite")))
+    first = model.get_text_embedding_batch(["a", "bb", "a", "ccc"])
+    assert inner.batches == [["a", "bb"], ["ccc"]]
+    assert first[0] == first[2] == [1.0, 1.0, 0.0, 0.5]
+
+    inner.batches.clear()
+    second = model.get_text_embedding_batch(["ccc", "dddd", "bb"])
+    assert inner.batches == [["dddd"]]
+    assert second[0] == first[3]
+
+def test_cache_survives_reopening_the_store(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    CachedEmbedding(CountingEmbedding(), EmbeddingCacheStore(path)).get_text_embedding_batch(["informe"])
+    inner = CountingEmbedding()
+    store = EmbeddingCacheStore(path)
+    assert CachedEmbedding(inner, store).get_text_embedding("informe") == [7.0, 1.0, 0.0, 0.5]
+    assert inner.batches == []
+    assert (store.hits, store.misses, len(store)) == (1, 0, 1)
+
+def test_query_and_text_embeddings_use_different_keys(tmp_path):
+    inner = CountingEmbedding()
+    model = CachedEmbedding(inner, EmbeddingCacheStore(str(tmp_path / "cache.sqlite")))
+    assert model.get_text_embedding("alergias") != model.get_query_embedding("alergias")
+    model.get_query_embedding("alergias")
+    assert inner.batches == [["alergias"], ["alergias"]]
+    assert EmbeddingCacheStore.make_key("m", "query", "x") != EmbeddingCacheStore.make_key("m", "text", "x")
+
+def test_nodes_of_several_documents_are_embedded_together(tmp_path):
+    # Como upsert_indexed_documents: se trocean todos los documentos y sus nodos se insertan de una vez.
+    from llama_index.core import Document, StorageContext, VectorStoreIndex
+    from llama_index.core.ingestion import run_transformations
+
+    from clinical_sections import ClinicalSectionParser
+    from numpy_vector_store import NumpyVectorStore
+
+    inner = CountingEmbedding()
+    model = CachedEmbedding(inner, EmbeddingCacheStore(str(tmp_path / "cache.sqlite")))
+    index = VectorStoreIndex([], storage_context=StorageContext.from_defaults(vector_store=NumpyVectorStore()), embed_model=model)
+    documents = [
+        Document(text="ALERGIAS\nPenicilina.\nTRATAMIENTO\nBisoprolol 2,5 mg.\nDIAGNÓSTICO\nFibrilación auricular.", doc_id="a.txt"),
+        Document(text="ALERGIAS\nContraste yodado.", doc_id="b.txt"),
+    ]
+    nodes = run_transformations(documents, [ClinicalSectionParser(chunk_size=256, chunk_overlap=0)])
+    index.insert_nodes(nodes)
+
+    assert len(nodes) == 4
+    # El segundo lote mezcla el último nodo de un documento con el primero del siguiente.
+    assert [len(batch) for batch in inner.batches] == [2, 2]
+    assert "Fibrilación" in inner.batches[1][0] and "Contraste" in inner.batches[1][1]
+    assert set(index.ref_doc_info) == {"a.txt", "b.txt"}
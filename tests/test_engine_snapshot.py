@@ -0,0 +1,86 @@
+import pytest
+from llama_index.core import Document, Settings, StorageContext, VectorStoreIndex
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.llms import MockLLM
+from llama_index.core.schema import QueryBundle
+
+from engine_snapshot import EngineSnapshotHolder, clone_index
+from numpy_vector_store import NumpyVectorStore
+
+EMBED_MODEL = MockEmbedding(embed_dim=8)
+
+
+def make_document(filename, text):
+    return Document(text=text, doc_id=filename, metadata={"filename": filename})
+
+@pytest.fixture
+def index(monkeypatch):
+    # Sin modelo de Gemini: load_index_from_storage toma el modelo de Settings.
+    monkeypatch.setattr(Settings, "_embed_model", EMBED_MODEL)
+    return VectorStoreIndex.from_documents(
+        [make_document("a.txt", "Informe del paciente A."), make_document("b.txt", "Informe del paciente B.")],
+        storage_context=StorageContext.from_defaults(vector_store=NumpyVectorStore()),
+    )
+
+def node_ids(index):
+    return {ref_doc_id: sorted(info.node_ids) for ref_doc_id, info in index.ref_doc_info.items()}
+
+
+def test_clone_shares_nodes_with_original(index):
+    clone = clone_index(index)
+    original_nodes = index.storage_context.docstore.to_dict()["docstore/data"]
+    cloned_nodes = clone.storage_context.docstore.to_dict()["docstore/data"]
+    assert cloned_nodes == original_nodes
+    assert cloned_nodes is not original_nodes
+    assert all(cloned_nodes[node_id] is original_nodes[node_id] for node_id in original_nodes)
+
+def test_changes_to_clone_do_not_affect_original(index):
+    before = node_ids(index)
+    clone = clone_index(index)
+    clone.delete_ref_doc("a.txt", delete_from_docstore=True)
+    clone.insert(make_document("b.txt", "Informe del paciente B, segunda página."))
+    clone.insert(make_document("c.txt", "Informe del paciente C."))
+
+    assert node_ids(index) == before
+    assert set(index.storage_context.docstore.docs) == {node_id for ids in before.values() for node_id in ids}
+    assert set(node_ids(clone)) == {"b.txt", "c.txt"}
+    assert len(node_ids(clone)["b.txt"]) > len(before["b.txt"])
+
+@pytest.fixture
+def holder(monkeypatch):
+    monkeypatch.setattr(Settings, "_embed_model", EMBED_MODEL)
+    monkeypatch.setattr(Settings, "_llm", MockLLM())
+    documents = {
+        "a1.txt": ("111", "Alergia a la penicilina. Tratamiento con bisoprolol."),
+        "a2.txt": ("111", "Holter sin pausas significativas."),
+        "b1.txt": ("222", "Alergia al contraste yodado. Tratamiento con apixaban."),
+    }
+    index = VectorStoreIndex.from_documents(
+        [
+            Document(text=text, doc_id=filename, metadata={"filename": filename, "patient_id": patient_id})
+            for filename, (patient_id, text) in documents.items()
+        ],
+        storage_context=StorageContext.from_defaults(vector_store=NumpyVectorStore()),
+    )
+    holder = EngineSnapshotHolder({"mode": "hybrid", "similarity_top_k": 5, "alpha": 0.5})
+    holder.publish(
+        index,
+        {filename: f"hash-{filename}" for filename in documents},
+        {filename: patient_id for filename, (patient_id, _) in documents.items()},
+    )
+    return holder
+
+def retrieved_patients(snapshot, patient_id, question="alergia tratamiento"):
+    engine = snapshot.get_query_engine(patient_id)
+    return {node.node.metadata["patient_id"] for node in engine.retrieve(QueryBundle(question))}
+
+
+def test_query_engine_only_retrieves_the_patient_nodes(holder):
+    snapshot = holder.current()
+    assert snapshot.patient_documents == {"111": frozenset({"a1.txt", "a2.txt"}), "222": frozenset({"b1.txt"})}
+    assert retrieved_patients(snapshot, "111") == {"111"}
+    assert retrieved_patients(snapshot, "222") == {"222"}
+
+def test_unknown_patient_searches_the_whole_index(holder):
+    assert retrieved_patients(holder.current(), "999") == {"111", "222"}
+    assert retrieved_patients(holder.current(), None) == {"111", "222"}
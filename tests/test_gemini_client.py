@@ -0,0 +1,191 @@
+import threading
+import time
+
+import pytest
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from benchmarks.fake_gemini import FakeGeminiLLM
+from gemini_client import GeminiGovernor, GeminiUnavailableError, GovernedLLM, SingleFlight, TokenBucket
+
+
+class ApiError(Exception):
+    """
+    Error con código HTTP, como los de google.genai.
+    """
+
+    def __init__(self, code, message=""):
+        super().__init__(f"{code} {message}".strip())
+        self.code = code
+
+
+class CountingLLM(FakeGeminiLLM):
+    _calls: int = PrivateAttr(default=0)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def complete(self, prompt, formatted=False, **kwargs):
+        with self._lock:
+            self._calls += 1
+        return super().complete(prompt, formatted=formatted, **kwargs)
+
+
+def failing(errors, result="ok"):
+    """
+    Función que lanza los errores dados, uno por llamada, y después devuelve result.
+    """
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+
+    return fn, calls
+
+
+# --- TokenBucket ---
+
+def test_token_bucket_without_limit():
+    bucket = TokenBucket(0)
+    assert bucket.acquire(10**9, max_wait=0) == 0.0
+
+def test_token_bucket_rejects_without_consuming():
+    bucket = TokenBucket(600) # 10 tokens por segundo
+    assert bucket.acquire(500, max_wait=0) == 0.0
+    wait = bucket.acquire(200, max_wait=0)
+    assert wait == pytest.approx(10.0, abs=0.5)
+    # El rechazo no descuenta nada: siguen disponibles los 100 que quedaban.
+    assert bucket.available() == pytest.approx(100, abs=5)
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(6000) # 100 tokens por segundo
+    assert bucket.acquire(6000, max_wait=0) == 0.0
+    started_at = time.monotonic()
+    assert bucket.acquire(20, max_wait=1) == 0.0
+    assert 0.1 <= time.monotonic() - started_at < 1
+
+def test_token_bucket_caps_calls_larger_than_capacity():
+    bucket = TokenBucket(100)
+    assert bucket.acquire(1000, max_wait=0) == 0.0
+    assert bucket.available() < 1
+
+
+# --- Reintentos y espera exponencial ---
+
+def test_backoff_delay_is_bounded_and_grows():
+    governor = GeminiGovernor(base_delay=1.0, max_delay=4.0)
+    for attempt in range(6):
+        delays = [governor.backoff_delay(attempt) for _ in range(50)]
+        assert all(0 <= delay <= min(4.0, 2 ** attempt) for delay in delays)
+    assert max(governor.backoff_delay(3) for _ in range(50)) > 1.0
+
+def test_backoff_delay_uses_the_suggested_retry_delay():
+    governor = GeminiGovernor(base_delay=1.0, max_delay=30.0)
+    error = ApiError(429, "RESOURCE_EXHAUSTED {'retryDelay': '17s'}")
+    assert 17.0 <= governor.backoff_delay(0, error) <= 17.0 * 1.2
+    # Nunca más que max_delay (con el jitter).
+    capped = GeminiGovernor(base_delay=1.0, max_delay=5.0)
+    assert capped.backoff_delay(0, error) <= 5.0 * 1.2
+
+def test_transient_errors_are_retried():
+    governor = GeminiGovernor(max_retries=3, base_delay=0)
+    fn, calls = failing([ApiError(429), ApiError(503)])
+    assert governor.call("llm", fn) == "ok"
+    assert len(calls) == 3
+    assert governor.in_flight == 0
+
+def test_exhausted_retries_raise_unavailable():
+    governor = GeminiGovernor(max_retries=2, base_delay=0)
+    fn, calls = failing([ApiError(429)] * 10)
+    with pytest.raises(GeminiUnavailableError) as info:
+        governor.call("llm", fn)
+    assert len(calls) == 3
+    assert isinstance(info.value.__cause__, ApiError)
+    assert info.value.retry_after_header() == "1"
+
+def test_non_transient_errors_are_not_retried():
+    governor = GeminiGovernor(max_retries=3, base_delay=0)
+    fn, calls = failing([ApiError(400, "bad request")])
+    with pytest.raises(ApiError):
+        governor.call("llm", fn)
+    assert len(calls) == 1
+
+def test_retries_do_not_consume_tokens_again():
+    governor = GeminiGovernor(tokens_per_minute=100, max_retries=2, base_delay=0, max_wait=0)
+    fn, calls = failing([ApiError(503)])
+    assert governor.call("llm", fn, tokens=60) == "ok"
+    assert len(calls) == 2
+    assert governor.status()["tokens_disponibles"] == pytest.approx(40, abs=2)
+
+def test_stream_retries_before_the_first_chunk():
+    governor = GeminiGovernor(max_retries=2, base_delay=0)
+    opened = []
+
+    def open_stream():
+        opened.append(1)
+        if len(opened) == 1:
+            raise ApiError(503)
+        return iter(["a", "b"])
+
+    assert list(governor.stream("llm", open_stream)) == ["a", "b"]
+    assert len(opened) == 2
+    assert governor.in_flight == 0
+
+
+# --- Llamadas agrupadas (single-flight) ---
+
+def test_concurrent_identical_calls_share_one_request():
+    inner = CountingLLM(latency=0.2)
+    llm = GovernedLLM(inner, GeminiGovernor(max_concurrency=8))
+    responses = []
+
+    def ask():
+        responses.append(llm.complete("Medicación del paciente 12345678").text)
+
+    threads = [threading.Thread(target=ask) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert inner._calls == 1
+    assert len(responses) == 8 and len(set(responses)) == 1
+
+def test_different_calls_are_not_shared():
+    inner = CountingLLM()
+    llm = GovernedLLM(inner, GeminiGovernor())
+    llm.complete("a")
+    llm.complete("b")
+    llm.complete("a")
+    assert inner._calls == 3
+
+def test_waiters_get_their_own_error_chained_to_the_leader():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    leader_error = ApiError(400, "bad request")
+    errors = []
+
+    def fn():
+        release.wait(5)
+        raise leader_error
+
+    def call():
+        try:
+            single_flight.do("clave", fn)
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=call) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert sum(error is leader_error for error in errors) == 1
+    waiter_errors = [error for error in errors if error is not leader_error]
+    assert len(waiter_errors) == 3
+    assert all(isinstance(error, GeminiUnavailableError) for error in waiter_errors)
+    assert all(error.__cause__ is leader_error for error in waiter_errors)
+    assert len({id(error) for error in waiter_errors}) == 3
+    assert len(single_flight) == 0
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from holter_metrics import KIND_CONSULTATION, KIND_DAY, HolterMetricsStore, answer_metric_question, parse_holter_metrics
+
+
+@pytest.fixture
+def series():
+    store = HolterMetricsStore()
+    store.set_document("holter.txt", "111", "h1", [
+        {"date": np.datetime64("2024-05-28"), "kind": KIND_DAY, "hr_max": 126, "hr_mean": 80, "hr_min": 55, "psvt": 2, "sve": 40},
+        {"date": np.datetime64("2024-05-29"), "kind": KIND_DAY, "hr_max": 130, "hr_mean": 84, "hr_min": 58, "psvt": 1, "sve": 35},
+    ])
+    store.set_document("consulta_1.txt", "111", "h2", [{"date": np.datetime64("2024-06-10"), "kind": KIND_CONSULTATION, "bp_sys": 140, "bp_dia": 90}])
+    store.set_document("consulta_2.txt", "111", "h3", [{"date": np.datetime64("2024-09-10"), "kind": KIND_CONSULTATION, "bp_sys": 130, "bp_dia": 80}])
+    return store.get_series("111")
+
+
+@pytest.mark.parametrize("message", [
+    "¿Hay pausas en el holter?",
+    "Evolución del paciente tras la cirugía",
+    "Tendencia del peso",
+    "Curvas evolutivas.",
+    "Electros/ECG.",
+])
+def test_general_questions_are_left_to_the_llm(series, message):
+    assert answer_metric_question(series, message, "111") is None
+
+def test_heart_rate_question(series):
+    answer = answer_metric_question(series, "¿Cuál es la frecuencia cardiaca?", "111")
+    assert "FC máxima 130 lpm" in answer
+    assert "Evolución de la FC media diaria: 80 → 84 lpm" in answer
+    assert "Tensión arterial" not in answer
+
+def test_blood_pressure_trend(series):
+    answer = answer_metric_question(series, "Tendencia de la tensión arterial", "111")
+    assert "Tensión arterial media: 135/85 mm Hg en 2 consultas." in answer
+    assert "FC" not in answer
+
+def test_trend_needs_a_series():
+    store = HolterMetricsStore()
+    store.set_document("consulta.txt", "111", "h1", [{"date": np.datetime64("2024-06-10"), "kind": KIND_CONSULTATION, "bp_sys": 140, "bp_dia": 90}])
+    series = store.get_series("111")
+    assert answer_metric_question(series, "Evolución de la tensión arterial", "111") is None
+    assert "140/90" in answer_metric_question(series, "Tensión arterial", "111")
+
+def test_no_series_means_no_local_answer():
+    assert answer_metric_question(None, "¿Cuál es la frecuencia cardiaca?", "111") is None
+
+def test_parse_consultation_measures():
+    records = parse_holter_metrics("Consulta del 10/06/2024. Tensión arterial: 140/90 mmHg. ECG: ritmo sinusal a 72 lpm.")
+    assert records == [{"date": np.datetime64("2024-06-10"), "kind": KIND_CONSULTATION, "bp_sys": 140, "bp_dia": 90, "ecg_hr": 72}]
@@ -0,0 +1,80 @@
+import os
+import shutil
+import threading
+
+from index_versions import IndexVersionPublisher, IndexVersionStore
+
+
+def write_marker(payload, path):
+    with open(os.path.join(path, "indice.txt"), "w", encoding="utf-8") as f:
+        f.write(payload)
+
+
+def test_publisher_writes_and_publishes(tmp_path):
+    store = IndexVersionStore(str(tmp_path))
+    publisher = IndexVersionPublisher(store, write_marker)
+    name, _ = store.new_version()
+    publisher.submit(name, "uno")
+    assert publisher.wait(timeout=5)
+    assert store.current_name() == name
+    with open(os.path.join(store.path_for(name), "indice.txt"), encoding="utf-8") as f:
+        assert f.read() == "uno"
+
+def test_publisher_keeps_only_latest_pending_version(tmp_path):
+    store = IndexVersionStore(str(tmp_path), keep=5)
+    started = threading.Event()
+    release = threading.Event()
+    written = []
+
+    def slow_write(payload, path):
+        started.set()
+        release.wait(5)
+        written.append(payload)
+        write_marker(payload, path)
+
+    publisher = IndexVersionPublisher(store, slow_write)
+    names = []
+    for payload in ("uno", "dos", "tres"):
+        name, _ = store.new_version()
+        names.append(name)
+        publisher.submit(name, payload)
+        if payload == "uno":
+            assert started.wait(5)
+    release.set()
+    assert publisher.wait(timeout=5)
+
+    # "uno" ya se estaba escribiendo; "dos" se sustituye por "tres" antes de escribirse.
+    assert written == ["uno", "tres"]
+    assert store.current_name() == names[-1]
+    assert not os.path.exists(store.path_for(names[1]))
+
+def test_publisher_discards_failed_version(tmp_path):
+    store = IndexVersionStore(str(tmp_path))
+
+    def failing_write(payload, path):
+        raise OSError("disco lleno")
+
+    publisher = IndexVersionPublisher(store, failing_write)
+    name, _ = store.new_version()
+    publisher.submit(name, "uno")
+    assert publisher.wait(timeout=5)
+    assert store.current_name() is None
+    assert not os.path.exists(store.path_for(name))
+
+def test_failed_cleanup_is_logged_and_retried(tmp_path, monkeypatch, caplog):
+    store = IndexVersionStore(str(tmp_path), keep=2)
+    names = [store.new_version()[0] for _ in range(3)]
+    real_rmtree = shutil.rmtree
+
+    def locked_rmtree(path, *args, **kwargs):
+        raise PermissionError(f"archivo en uso: {path}")
+
+    monkeypatch.setattr(shutil, "rmtree", locked_rmtree)
+    store.publish(names[-1])
+    assert os.path.isdir(store.path_for(names[0]))
+    assert "se reintentará" in caplog.text
+
+    monkeypatch.setattr(shutil, "rmtree", real_rmtree)
+    store.publish(store.new_version()[0])
+    assert not os.path.exists(store.path_for(names[0]))
+    assert not os.path.exists(store.path_for(names[1]))
@@ -0,0 +1,73 @@
+import threading
+import time
+
+import pytest
+
+from ingestion_jobs import JOB_DONE, JOB_FAILED, JOB_QUEUED, JOB_RUNNING, IngestionJobManager, QueueFullError
+
+
+def wait_for_status(job, status, timeout=5):
+    deadline = time.monotonic() + timeout
+    while job.status != status and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return job.status
+
+
+def test_job_goes_from_queued_to_running_to_done():
+    manager = IngestionJobManager(max_workers=1)
+    release = threading.Event()
+    seen = []
+
+    def work(job, value):
+        seen.append(job.status)
+        job.update("indexando", 60)
+        release.wait(5)
+        return {"valor": value}
+
+    job = manager.submit("informe.pdf", work, 42)
+    assert wait_for_status(job, JOB_RUNNING) == JOB_RUNNING
+    # Un segundo trabajo espera en cola mientras el único hilo está ocupado.
+    queued = manager.submit("otro.pdf", lambda job: None)
+    assert queued.status == JOB_QUEUED
+    assert manager.pending_count() == 2
+    assert job.to_dict()["etapa"] in ("iniciando", "indexando")
+
+    release.set()
+    assert wait_for_status(job, JOB_DONE) == JOB_DONE
+    assert wait_for_status(queued, JOB_DONE) == JOB_DONE
+    assert seen == [JOB_RUNNING]
+    state = manager.get(job.id).to_dict()
+    assert (state["estado"], state["progreso"], state["resultado"], state["error"]) == (JOB_DONE, 100, {"valor": 42}, None)
+    assert manager.pending_count() == 0
+
+def test_failed_job_records_error():
+    manager = IngestionJobManager(max_workers=1)
+
+    def work(job):
+        job.update("extrayendo", 20)
+        raise RuntimeError("PDF ilegible")
+
+    job = manager.submit("roto.pdf", work)
+    assert wait_for_status(job, JOB_FAILED) == JOB_FAILED
+    state = job.to_dict()
+    assert (state["etapa"], state["progreso"], state["error"], state["resultado"]) == ("error", 20, "PDF ilegible", None)
+
+def test_queue_limit_rejects_new_jobs():
+    manager = IngestionJobManager(max_workers=1, max_pending=2)
+    release = threading.Event()
+    jobs = [manager.submit(f"{n}.pdf", lambda job: release.wait(5)) for n in range(2)]
+    with pytest.raises(QueueFullError):
+        manager.submit("extra.pdf", lambda job: None)
+    release.set()
+    for job in jobs:
+        assert wait_for_status(job, JOB_DONE) == JOB_DONE
+    assert manager.submit("extra.pdf", lambda job: None) is not None
+
+def test_old_finished_jobs_are_forgotten():
+    manager = IngestionJobManager(max_workers=1, max_finished_jobs=2)
+    jobs = []
+    for n in range(4):
+        jobs.append(manager.submit(f"{n}.pdf", lambda job: None))
+        assert wait_for_status(jobs[-1], JOB_DONE) == JOB_DONE
+    manager.submit("nuevo.pdf", lambda job: None)
+    assert [manager.get(job.id) is not None for job in jobs] == [False, False, True, True]
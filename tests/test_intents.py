@@ -0,0 +1,43 @@
+import pytest
+
+from intents import CHAT_INTENTS, GENERAL_TEMPLATE, Intent, IntentRegistry
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("¿Cuál es la frecuencia cardiaca media?", "medidas"),
+    ("Tendencia de la TENSIÓN ARTERIAL", "medidas"),
+    ("¿Cuántas extrasístoles tuvo?", "medidas"),
+    ("¿Hay pausas en el holter?", None),
+    ("Evolución del paciente tras la cirugía", None),
+    ("Curvas evolutivas.", "curvas_evolutivas"),
+    ("Electros/ECG.", "electros"),
+    ("Medicación.", "medicacion"),
+])
+def test_classify(message, expected):
+    intent = CHAT_INTENTS.classify(message)
+    assert (intent.name if intent else None) == expected
+
+def test_registration_order_is_the_priority():
+    registry = IntentRegistry([
+        Intent("primera", "Primera.", ["resumen"], GENERAL_TEMPLATE),
+        Intent("segunda", "Segunda.", ["resumen", "informe"], GENERAL_TEMPLATE),
+    ])
+    assert registry.classify("Resumen del informe").name == "primera"
+    assert registry.classify("Informe").name == "segunda"
+
+def test_local_handler_registration():
+    registry = IntentRegistry([
+        Intent("medidas", "Medidas.", ["psvt"], GENERAL_TEMPLATE),
+        Intent("otra", "Otra.", ["otra"], GENERAL_TEMPLATE),
+    ])
+
+    @registry.local_handler("medidas")
+    def handler(user_message, patient_id):
+        return None
+
+    assert registry.get("medidas").local_handler is handler
+    assert registry.get("otra").local_handler is None
+    # Un manejador que devuelve None deja la pregunta al prompt de la acción.
+    intent = registry.classify("PSVT del holter")
+    assert intent.local_handler("PSVT del holter", "111") is None
+    assert intent.build_prompt("Base.", "111", "PSVT del holter") == "Base. Pregunta original: PSVT del holter"
@@ -0,0 +1,125 @@
+import pytest
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+
+from lexical_index import HybridRetriever, LexicalIndex, tokenize
+
+NODES = [
+    TextNode(id_="a1", text="Paciente con hipertensión arterial en tratamiento con Lisinopril 20mg cada 24 horas.", metadata={"patient_id": "111"}),
+    TextNode(id_="a2", text="Holter de 24 horas: ritmo sinusal, frecuencia cardiaca media 78 lpm.", metadata={"patient_id": "111"}),
+    TextNode(id_="b1", text="Enfermedad de Parkinson en tratamiento con Sinemet. Cédula 12.345.678.", metadata={"patient_id": "222"}),
+    TextNode(id_="b2", text="Ecocardiograma: fracción de eyección conservada, sin valvulopatías.", metadata={"patient_id": "222"}),
+    TextNode(id_="c1", text="Control de hipertensión arterial. Tensión arterial 130/85 mmHg.", metadata={"patient_id": "333"}),
+]
+
+
+class FakeDocstore:
+    def __init__(self, nodes):
+        self._nodes = {node.node_id: node for node in nodes}
+
+    def get_nodes(self, node_ids, raise_error=True):
+        return [self._nodes[node_id] for node_id in node_ids]
+
+
+class FakeIndex:
+    """
+    Índice mínimo para HybridRetriever: solo el docstore (la parte vectorial se sustituye en cada prueba).
+    """
+
+    def __init__(self, nodes):
+        self.docstore = FakeDocstore(nodes)
+
+
+@pytest.fixture
+def lexical_index():
+    return LexicalIndex.build(NODES)
+
+def retriever(lexical_index, vector_hits=None, **kwargs):
+    hybrid = HybridRetriever(FakeIndex(NODES), lexical_index, **kwargs)
+
+    def vector_retrieve(query_bundle, top_k, sections=None):
+        if vector_hits is None:
+            raise AssertionError("No se esperaba una búsqueda vectorial.")
+        return vector_hits[:top_k]
+
+    hybrid._vector_retrieve = vector_retrieve
+    return hybrid
+
+
+# --- BM25 ---
+
+def test_exact_id_lookup_ranks_first(lexical_index):
+    hits = lexical_index.search("12345678", top_k=3)
+    assert hits[0][0] == "b1"
+    # Con puntos o sin ellos es el mismo término.
+    assert lexical_index.search("12.345.678", top_k=3)[0][0] == "b1"
+
+def test_rare_terms_weigh_more(lexical_index):
+    # 'hipertension' aparece en dos nodos y 'lisinopril' solo en uno: gana el que tiene ambos.
+    hits = lexical_index.search("hipertensión lisinopril", top_k=5)
+    assert [node_id for node_id, _ in hits][:2] == ["a1", "c1"]
+    assert hits[0][1] > hits[1][1] > 0
+
+def test_search_only_returns_matching_nodes(lexical_index):
+    assert lexical_index.search("amiodarona", top_k=5) == []
+    assert {node_id for node_id, _ in lexical_index.search("holter", top_k=5)} == {"a2"}
+
+def test_search_filters_by_patient(lexical_index):
+    hits = lexical_index.search("hipertensión arterial", top_k=5, patient_id="333")
+    assert [node_id for node_id, _ in hits] == ["c1"]
+
+def test_build_reuses_terms_of_previous_nodes(lexical_index):
+    extra = TextNode(id_="d1", text="Sinemet 25/250 tres veces al día.", metadata={"patient_id": "444"})
+    rebuilt = LexicalIndex.build(NODES + [extra], previous=lexical_index)
+    assert rebuilt._node_terms["a1"] is lexical_index._node_terms["a1"]
+    assert {node_id for node_id, _ in rebuilt.search("sinemet", top_k=5)} == {"b1", "d1"}
+
+def test_exact_lookup_terms(lexical_index):
+    assert lexical_index.exact_lookup_terms("Sinemet") == ["sinemet"]
+    # Con un término que no está en el índice no es una búsqueda exacta.
+    assert lexical_index.exact_lookup_terms("Sinemet Levodopa") is None
+    assert "lisinopril" in tokenize("Lisinopril 20mg")
+
+
+# --- Fusión mínimo-máximo ---
+
+def test_normalized_scales_to_unit_interval():
+    assert HybridRetriever._normalized({"a": 2.0, "b": 4.0, "c": 3.0}) == {"a": 0.0, "b": 1.0, "c": 0.5}
+    assert HybridRetriever._normalized({"a": 0.3, "b": 0.3}) == {"a": 1.0, "b": 1.0}
+    assert HybridRetriever._normalized({}) == {}
+
+def test_fuse_combines_both_lists(lexical_index):
+    nodes = {node.node_id: node for node in NODES}
+    vector_hits = [NodeWithScore(node=nodes["a2"], score=0.9), NodeWithScore(node=nodes["a1"], score=0.7), NodeWithScore(node=nodes["b2"], score=0.5)]
+    lexical_hits = [("a1", 6.0), ("c1", 2.0)]
+    fused = retriever(lexical_index, similarity_top_k=4, alpha=0.5)._fuse(vector_hits, lexical_hits)
+    scores = {hit.node.node_id: hit.score for hit in fused}
+    # a1: 0.5 * 0.5 (vector) + 0.5 * 1 (BM25); a2: 0.5 * 1; c1: solo BM25 (mínimo -> 0); b2: mínimo en vectores.
+    assert scores == pytest.approx({"a1": 0.75, "a2": 0.5, "c1": 0.0, "b2": 0.0})
+    assert [hit.node.node_id for hit in fused][:2] == ["a1", "a2"]
+
+def test_alpha_weights_the_vector_scores(lexical_index):
+    nodes = {node.node_id: node for node in NODES}
+    vector_hits = [NodeWithScore(node=nodes["a2"], score=0.9), NodeWithScore(node=nodes["a1"], score=0.1)]
+    lexical_hits = [("a1", 5.0), ("a2", 1.0)]
+    vector_first = retriever(lexical_index, similarity_top_k=1, alpha=0.9)._fuse(vector_hits, lexical_hits)
+    lexical_first = retriever(lexical_index, similarity_top_k=1, alpha=0.1)._fuse(vector_hits, lexical_hits)
+    assert vector_first[0].node.node_id == "a2"
+    assert lexical_first[0].node.node_id == "a1"
+
+
+# --- Recuperación híbrida ---
+
+def test_exact_lookup_skips_the_vector_search(lexical_index):
+    hybrid = retriever(lexical_index, similarity_top_k=2)
+    nodes = hybrid.retrieve(QueryBundle("Medicación", custom_embedding_strs=["Sinemet"]))
+    assert [hit.node.node_id for hit in nodes] == ["b1"]
+
+def test_hybrid_query_fuses_vector_and_lexical_hits(lexical_index):
+    nodes = {node.node_id: node for node in NODES}
+    vector_hits = [
+        NodeWithScore(node=nodes["b2"], score=0.8), NodeWithScore(node=nodes["a2"], score=0.75), NodeWithScore(node=nodes["c1"], score=0.1),
+    ]
+    hybrid = retriever(lexical_index, vector_hits, similarity_top_k=2)
+    result = hybrid.retrieve(QueryBundle("pregunta", custom_embedding_strs=["¿Cómo está la frecuencia cardiaca en el holter?"]))
+    # a2 está en las dos listas; b2 solo en la vectorial.
+    assert [hit.node.node_id for hit in result] == ["a2", "b2"]
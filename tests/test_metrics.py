@@ -0,0 +1,50 @@
+import pytest
+
+from metrics import MetricsRegistry
+
+
+def sample_lines(registry):
+    return [line for line in registry.render().splitlines() if not line.startswith("#")]
+
+
+def test_counter_series_per_label_values():
+    registry = MetricsRegistry()
+    calls = registry.counter("llamadas_total", "Llamadas.", ["kind"])
+    calls.inc(kind="llm")
+    calls.inc(2, kind="llm")
+    calls.inc(kind="embeddings")
+    assert sample_lines(registry) == ['llamadas_total{kind="embeddings"} 1', 'llamadas_total{kind="llm"} 3']
+    assert "# TYPE llamadas_total counter" in registry.render()
+
+def test_counter_rejects_unknown_labels():
+    calls = MetricsRegistry().counter("llamadas_total", "Llamadas.", ["kind"])
+    with pytest.raises(ValueError):
+        calls.inc(tipo="llm")
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    durations = registry.histogram("duracion_seconds", "Duración.", ["stage"], buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.7, 3):
+        durations.observe(value, stage="pdf")
+    assert sample_lines(registry) == [
+        'duracion_seconds_bucket{stage="pdf",le="0.1"} 1',
+        'duracion_seconds_bucket{stage="pdf",le="1.0"} 3',
+        'duracion_seconds_bucket{stage="pdf",le="+Inf"} 4',
+        'duracion_seconds_sum{stage="pdf"} 4.25',
+        'duracion_seconds_count{stage="pdf"} 4',
+    ]
+
+def test_histogram_times_blocks_that_raise():
+    registry = MetricsRegistry()
+    durations = registry.histogram("duracion_seconds", "Duración.", ["stage"])
+    with pytest.raises(RuntimeError):
+        with durations.time(stage="llm"):
+            raise RuntimeError("fallo")
+    assert 'duracion_seconds_count{stage="llm"} 1' in sample_lines(registry)
+
+def test_callback_metrics_and_escaping():
+    registry = MetricsRegistry()
+    registry.callback("documentos", "Documentos.", lambda: 3)
+    registry.callback("cola", "Cola.", lambda: {"archivo \"a\".pdf": 1}, ["filename"])
+    registry.callback("roto", "Sin inicializar.", lambda: 1 / 0)
+    assert sample_lines(registry) == ["documentos 3", 'cola{filename="archivo \\"a\\".pdf"} 1']
@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores import ExactMatchFilter, MetadataFilters
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from numpy_vector_store import NumpyVectorStore
+
+DIMENSION = 64
+NODE_COUNT = 500
+
+
+def make_nodes(count=NODE_COUNT, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((count, DIMENSION)).astype(np.float32)
+    return [
+        TextNode(
+            id_=f"nodo-{position}",
+            text=f"texto {position}",
+            embedding=vectors[position].tolist(),
+            metadata={"patient_id": str(position % 5)},
+        )
+        for position in range(count)
+    ]
+
+def make_store(quantization, nodes):
+    store = NumpyVectorStore(quantization=quantization)
+    store.add(nodes)
+    return store
+
+def query_vectors(count=20, seed=1):
+    return np.random.default_rng(seed).standard_normal((count, DIMENSION)).astype(np.float32)
+
+def search(store, vector, top_k=10, filters=None):
+    return store.query(VectorStoreQuery(query_embedding=vector.tolist(), similarity_top_k=top_k, filters=filters))
+
+
+@pytest.fixture(scope="module")
+def nodes():
+    return make_nodes()
+
+
+def test_float32_scores_are_cosine_similarities(nodes):
+    store = make_store("float32", nodes)
+    vector = query_vectors(1)[0]
+    result = search(store, vector, top_k=5)
+    embeddings = np.array([node.embedding for node in nodes], dtype=np.float32)
+    cosine = embeddings @ vector / (np.linalg.norm(embeddings, axis=1) * np.linalg.norm(vector))
+    expected = np.argsort(-cosine)[:5]
+    assert result.ids == [f"nodo-{position}" for position in expected]
+    assert result.similarities == pytest.approx(cosine[expected].tolist(), abs=1e-5)
+
+def test_int8_top_k_matches_float32(nodes):
+    exact = make_store("float32", nodes)
+    quantized = make_store("int8", nodes)
+    overlaps = []
+    for vector in query_vectors():
+        expected = search(exact, vector)
+        result = search(quantized, vector)
+        # La cuantización por fila apenas mueve las puntuaciones...
+        expected_scores = dict(zip(expected.ids, expected.similarities))
+        for node_id, score in zip(result.ids, result.similarities):
+            if node_id in expected_scores:
+                assert score == pytest.approx(expected_scores[node_id], abs=0.02)
+        # ...y los vecinos son casi siempre los mismos (solo cambian empates muy ajustados al final).
+        overlaps.append(len(set(result.ids) & set(expected.ids)) / len(expected.ids))
+        assert result.ids[0] == expected.ids[0]
+    assert np.mean(overlaps) >= 0.9
+
+def test_int8_filters_by_metadata(nodes):
+    store = make_store("int8", nodes)
+    filters = MetadataFilters(filters=[ExactMatchFilter(key="patient_id", value="3")])
+    result = search(store, query_vectors(1)[0], top_k=10, filters=filters)
+    assert len(result.ids) == 10
+    assert all(int(node_id.split("-")[1]) % 5 == 3 for node_id in result.ids)
+
+@pytest.mark.parametrize("quantization", ["float32", "int8"])
+def test_persist_and_mmap_round_trip(tmp_path, nodes, quantization):
+    store = make_store(quantization, nodes)
+    store.persist(str(tmp_path / "default__vector_store.json"))
+    assert NumpyVectorStore.persisted_quantization(str(tmp_path)) == quantization
+
+    loaded = NumpyVectorStore.from_persist_dir(str(tmp_path))
+    assert loaded.quantization == quantization
+    assert loaded.node_count == NODE_COUNT
+    assert isinstance(loaded._vectors, np.memmap)
+    assert loaded._vectors.dtype == (np.int8 if quantization == "int8" else np.float32)
+    for vector in query_vectors(5):
+        before = search(store, vector)
+        after = search(loaded, vector)
+        assert after.ids == before.ids
+        assert after.similarities == pytest.approx(before.similarities, abs=1e-6)
+
+def test_mmap_store_is_not_modified_by_its_clone(tmp_path, nodes):
+    make_store("int8", nodes).persist(str(tmp_path / "default__vector_store.json"))
+    loaded = NumpyVectorStore.from_persist_dir(str(tmp_path))
+    clone = loaded.clone()
+    clone.delete_nodes(node_ids=["nodo-0", "nodo-1"])
+    clone.add(make_nodes(3, seed=2)[:1])
+    assert loaded.node_count == NODE_COUNT
+    assert clone.node_count == NODE_COUNT - 1
+    assert "nodo-0" in loaded._ids.tolist() and "nodo-1" not in clone._ids.tolist()
+
+def test_add_replaces_existing_nodes_and_keeps_id_index(nodes):
+    store = make_store("float32", nodes[:10])
+    store.add(nodes[10:20])
+    positions = store._positions_by_column("node_id", store._ids)
+    assert {node_id: rows.tolist() for node_id, rows in positions.items()} == {
+        node.node_id: [row] for row, node in enumerate(nodes[:20])
+    }
+    replacement = TextNode(id_="nodo-3", text="nuevo", embedding=nodes[15].get_embedding(), metadata={"patient_id": "9"})
+    store.add([replacement])
+    assert store.node_count == 20
+    assert store._ids.tolist().count("nodo-3") == 1
+
+    store.delete_nodes(node_ids=["nodo-12", "nodo-3"])
+    remaining = store._ids.tolist()
+    assert store.node_count == 18
+    assert "nodo-12" not in remaining and "nodo-3" not in remaining and "nodo-19" in remaining
+
+def test_conversion_between_quantizations(tmp_path, nodes):
+    make_store("float32", nodes).persist(str(tmp_path / "default__vector_store.json"))
+    converted = NumpyVectorStore.from_persist_dir(str(tmp_path), quantization="int8")
+    exact = make_store("float32", nodes)
+    assert converted.quantization == "int8"
+    vector = query_vectors(1)[0]
+    assert search(converted, vector).ids[0] == search(exact, vector).ids[0]
@@ -0,0 +1,82 @@
+import random
+
+from patient_registry import PatientRegistry, extract_document_dates, extract_patient_names
+
+REPORTS = {
+    "informe_a1.txt": ("111", "Paciente: Dionne Maldonado Rivas\nFecha: 12/03/2024\nMotivo de consulta: Control cardiológico."),
+    "informe_a2.txt": ("111", "Paciente: Dionne Maldonado Rivas\n5 de mayo de 2024. Neurología."),
+    "informe_b1.txt": ("222", "Paciente: Jose Manuel Alvarez\nFecha: 01/02/2023"),
+    "informe_c1.txt": ("333", "Paciente: Maria Alvarez Quiñones\nFecha: 03/04/2023"),
+}
+
+
+def make_registry(path=None):
+    registry = PatientRegistry(path)
+    for filename, (patient_id, content) in REPORTS.items():
+        registry.register_document(filename, patient_id, f"hash-{filename}", content, save=False)
+    return registry
+
+def views(registry):
+    return registry.patients, {key: set(ids) for key, ids in registry._name_index.items()}
+
+
+def test_patient_view_aggregates_documents():
+    patient = make_registry().get_patient("111")
+    assert patient["documents"] == ["informe_a1.txt", "informe_a2.txt"]
+    assert patient["names"] == ["Dionne Maldonado Rivas"]
+    assert patient["dates"] == ["2024-03-12", "2024-05-05"]
+    assert patient["specialties"] == ["Cardiología", "Neurología"]
+
+def test_find_patient_by_name():
+    registry = make_registry()
+    assert registry.find_patient_by_name("¿Qué medicación toma DIONNE MALDONADO?") == "111"
+    assert registry.find_patient_by_name("informes de jose manuel") == "222"
+    assert registry.find_patient_by_name("informes de maria alvarez quinones") == "333"
+
+def test_ambiguous_names_are_ignored():
+    registry = make_registry()
+    # Un apellido suelto no basta: los grupos de palabras tienen al menos dos.
+    assert registry.find_patient_by_name("paciente Alvarez") is None
+    registry.register_document("informe_d1.txt", "444", "h", "Paciente: Dionne Maldonado Perez", save=False)
+    # 'Dionne Maldonado' ahora es de dos pacientes; el nombre completo sigue siendo único.
+    assert registry.find_patient_by_name("Dionne Maldonado") is None
+    assert registry.find_patient_by_name("Dionne Maldonado Rivas") == "111"
+    assert registry.find_patient_by_name("Dionne Maldonado Perez") == "444"
+
+def test_incremental_updates_match_a_full_rebuild():
+    registry = make_registry()
+    registry.register_document("informe_a2.txt", "222", "nuevo", REPORTS["informe_a2.txt"][1], save=False)
+    registry.remove_document("informe_c1.txt", save=False)
+    registry.register_document("informe_e1.txt", "555", "h", "Paciente: Ana Lopez Garcia\n10/10/2020", save=False)
+    incremental = views(registry)
+    registry._rebuild_views()
+    assert incremental == views(registry)
+    assert registry.get_patient("333") is None
+    assert registry.get_patient("222")["documents"] == ["informe_a2.txt", "informe_b1.txt"]
+    assert registry.find_patient_by_name("Maria Alvarez Quiñones") is None
+
+def test_incremental_updates_in_random_order():
+    rng = random.Random(7)
+    registry = PatientRegistry()
+    for _ in range(200):
+        filename = f"informe_{rng.randrange(30)}.txt"
+        if rng.random() < 0.3:
+            registry.remove_document(filename, save=False)
+        else:
+            patient_id = str(rng.randrange(8))
+            registry.register_document(filename, patient_id, "h", f"Paciente: Nombre{patient_id} Apellido{rng.randrange(3)}", save=False)
+    incremental = views(registry)
+    registry._rebuild_views()
+    assert incremental == views(registry)
+
+def test_save_and_reload(tmp_path):
+    path = str(tmp_path / "registro.json")
+    registry = make_registry(path)
+    registry.save()
+    reloaded = PatientRegistry(path)
+    assert reloaded.documents == registry.documents
+    assert views(reloaded) == views(registry)
+
+def test_extractors():
+    assert extract_patient_names("INFORME CLÍNICO   JOSE MANUEL ALVAREZ QUIÑONES Fecha de nacimiento: 01/01/1960") == ["Jose Manuel Alvarez Quiñones"]
+    assert extract_document_dates("12/03/24, 5 de mayo de 2024 o 45/13/2024") == ["2024-03-12", "2024-05-05"]
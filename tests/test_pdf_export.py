@@ -0,0 +1,93 @@
+import os
+from io import BytesIO
+
+from PyPDF2 import PdfReader
+from reportlab.pdfbase import pdfmetrics
+
+from pdf_export import (
+    NORMAL_FONT_SIZE, ExportSection, GlyphWidthCache, LetterheadTemplate, count_report_pages, parse_soap_sections,
+    render_batch_pdf, render_chat_response_pdf, wrap_text,
+)
+
+# Fuente estándar de PDF: no hace falta registrar ningún archivo TTF.
+FONT = "Helvetica"
+
+
+def test_glyph_widths_match_reportlab():
+    widths = GlyphWidthCache(FONT, NORMAL_FONT_SIZE)
+    for text in ("Bisoprolol", "Ecocardiografía transtorácica", "120/80 mmHg"):
+        assert abs(widths.width(text) - pdfmetrics.stringWidth(text, FONT, NORMAL_FONT_SIZE)) < 1e-6
+
+def test_wrap_text_fills_lines_without_exceeding_width():
+    widths = GlyphWidthCache(FONT, NORMAL_FONT_SIZE)
+    text = "Paciente con fibrilación auricular paroxística en tratamiento con apixaban y bisoprolol. " * 5
+    lines = wrap_text(text, 200, widths)
+    assert " ".join(lines) == " ".join(text.split())
+    assert all(widths.width(line) <= 200 for line in lines)
+    # Cada línea está llena: la primera palabra de la siguiente ya no cabía.
+    for line, next_line in zip(lines, lines[1:]):
+        assert widths.width(f"{line} {next_line.split()[0]}") > 200
+
+def test_wrap_text_splits_words_longer_than_a_line():
+    widths = GlyphWidthCache(FONT, NORMAL_FONT_SIZE)
+    lines = wrap_text("ECG " + "x" * 80 + " fin", 100, widths)
+    assert lines[0] == "ECG"
+    assert "".join(line.replace(" ", "") for line in lines[1:]) == "x" * 80 + "fin"
+    assert len(lines) > 3
+    assert all(widths.width(line) <= 100 for line in lines)
+
+def test_parse_soap_sections():
+    text = "Resumen del caso\nS: Palpitaciones.\nSe recomienda reposo.\n**Plan**: control en 3 meses"
+    assert parse_soap_sections(text) == [
+        ("NORMAL", "Resumen del caso"),
+        ("SUBJETIVO", "Palpitaciones."),
+        ("CONTENT", "Se recomienda reposo."),
+        ("PLAN", "control en 3 meses"),
+    ]
+
+def test_rendered_pages_match_the_page_count():
+    text = "\n".join(f"Línea {number} del informe con texto suficiente para ocupar espacio." for number in range(120))
+    pdf_bytes, pages = render_chat_response_pdf(text, LetterheadTemplate(FONT), first_page_number=5)
+    reader = PdfReader(BytesIO(pdf_bytes))
+    assert pages == len(reader.pages) == count_report_pages(text, FONT) > 1
+    assert "Página 5" in reader.pages[0].extract_text()
+    assert "CliniKa AI" in reader.pages[-1].extract_text()
+
+
+def test_batch_pdf_has_table_of_contents_and_continuous_numbering():
+    long_text = "\n".join(f"Línea {number} de la evolución clínica del paciente." for number in range(90))
+    sections = [
+        ExportSection("Alergias", "Alergia a la penicilina.", group="Paciente 111"),
+        ExportSection("Evolución", long_text, group="Paciente 111"),
+        ExportSection("Tratamiento", "Apixaban 5 mg cada 12 horas.", group="Paciente 222"),
+    ]
+    output = BytesIO()
+    total_pages = render_batch_pdf(sections, LetterheadTemplate(FONT), None, output, max_workers=1)
+
+    reader = PdfReader(BytesIO(output.getvalue()))
+    assert total_pages == len(reader.pages)
+    assert [section.first_page for section in sections] == [2, 3, 3 + sections[1].pages]
+    assert sections[1].pages > 1
+    toc = reader.pages[0].extract_text()
+    assert "Índice" in toc and "Paciente 222" in toc
+    for section in sections:
+        assert section.title in reader.pages[section.first_page - 1].extract_text()
+        assert f"Página {section.first_page}" in reader.pages[section.first_page - 1].extract_text()
+    outline = reader.outline
+    assert [item.title for item in outline if not isinstance(item, list)] == ["Paciente 111", "Paciente 222"]
+    assert [item.title for item in outline[1]] == ["Alergias", "Evolución"]
+
+def test_batch_rendered_in_process_pool_matches_serial_rendering():
+    from reportlab.pdfbase import ttfonts
+
+    font_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fonts", "DejaVuSans.ttf")
+    pdfmetrics.registerFont(ttfonts.TTFont("DejaVuSans", font_path))
+    letterhead = LetterheadTemplate("DejaVuSans")
+
+    def render(max_workers):
+        sections = [ExportSection(f"Sección {number}", f"Informe número {number}. " * 200) for number in range(4)]
+        output = BytesIO()
+        render_batch_pdf(sections, letterhead, font_path, output, max_workers=max_workers)
+        return [page.extract_text() for page in PdfReader(BytesIO(output.getvalue())).pages]
+
+    assert render(2) == render(1)
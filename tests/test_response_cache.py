@@ -0,0 +1,57 @@
+import json
+
+from engine_snapshot import EngineSnapshot
+from response_cache import ResponseCache
+
+
+def snapshot(indexed_documents, document_patients, version=1):
+    return EngineSnapshot(version, indexed_documents=indexed_documents, document_patients=document_patients)
+
+def key_for(snapshot, message, patient_id):
+    return ResponseCache.make_key(message, patient_id, snapshot.get_index_version(patient_id))
+
+
+def test_normalized_prompts_share_an_entry():
+    assert ResponseCache.make_key("Medicación  actual ", "111", "v1") == ResponseCache.make_key("medicacion actual", "111", "v1")
+    assert ResponseCache.make_key("medicacion actual", "111", "v1") != ResponseCache.make_key("medicacion actual", "222", "v1")
+
+def test_entries_stop_matching_when_the_patient_index_version_changes():
+    cache = ResponseCache()
+    before = snapshot({"a.txt": "h1", "b.txt": "h2"}, {"a.txt": "111", "b.txt": "222"})
+    cache.put(key_for(before, "alergias", "111"), "penicilina", patient_id="111")
+    cache.put(key_for(before, "alergias", "222"), "ninguna", patient_id="222")
+
+    # Se reemplaza un documento del paciente 111: solo cambia su versión.
+    after = snapshot({"a.txt": "h1-nuevo", "b.txt": "h2"}, {"a.txt": "111", "b.txt": "222"}, version=2)
+    assert cache.get(key_for(after, "alergias", "111")) is None
+    assert cache.get(key_for(after, "alergias", "222")) == "ninguna"
+    # Las consultas sin paciente usan la versión global, que cambia con cualquier documento.
+    assert before.get_index_version(None) != after.get_index_version(None)
+
+def test_invalidate_patient_removes_patient_and_global_entries():
+    cache = ResponseCache()
+    cache.put("k1", "r1", patient_id="111")
+    cache.put("k2", "r2", patient_id="222")
+    cache.put("k3", "r3", patient_id=None)
+    assert cache.invalidate_patient("111") == 2
+    assert cache.get("k1") is None and cache.get("k3") is None
+    assert cache.get("k2") == "r2"
+
+def test_lru_trims_least_recently_used():
+    cache = ResponseCache(max_entries=2)
+    cache.put("k1", "r1")
+    cache.put("k2", "r2")
+    cache.get("k1")
+    cache.put("k3", "r3")
+    assert cache.get("k2") is None
+    assert cache.get("k1") == "r1" and cache.get("k3") == "r3"
+    assert (cache.hits, cache.misses) == (3, 1)
+
+def test_flush_persists_entries(tmp_path):
+    path = str(tmp_path / "respuestas.json")
+    cache = ResponseCache(persist_path=path, flush_delay=60)
+    cache.put("k1", "r1", patient_id="111")
+    cache.flush()
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f) == [["k1", {"patient_id": "111", "value": "r1"}]]
+    assert ResponseCache(persist_path=path).get("k1") == "r1"
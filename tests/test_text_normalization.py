@@ -0,0 +1,49 @@
+from text_normalization import PAGE_SEPARATOR, BoilerplateFilter, repair_text
+
+HISTORY = (
+    "ANTECEDENTES: Hipertensión arterial de larga evolución, diabetes mellitus tipo 2 en tratamiento "
+    "con metformina 850 mg y enalapril 10 mg diarios."
+)
+LEGAL_NOTICE = (
+    "Sus datos personales serán tratados conforme a la normativa vigente de protección de datos y no "
+    "serán cedidos a terceros salvo obligación legal expresa."
+)
+
+
+def test_history_repeated_for_the_same_patient_is_kept():
+    boilerplate_filter = BoilerplateFilter()
+    for number in range(5):
+        text = f"Informe de seguimiento {number}\n{HISTORY}\nEvolución: estable."
+        output = boilerplate_filter.normalize(text, document_id=f"informe_{number}.txt", content_hash=str(number), patient_id="111")
+        assert HISTORY in output
+
+def test_template_shared_by_several_patients_keeps_one_copy():
+    boilerplate_filter = BoilerplateFilter()
+    for number in range(4):
+        pages = [f"Informe {number}\nEvolución favorable.\n{LEGAL_NOTICE}", LEGAL_NOTICE, LEGAL_NOTICE]
+        output = boilerplate_filter.normalize(
+            PAGE_SEPARATOR.join(pages), document_id=f"informe_{number}.txt", content_hash=str(number), patient_id=f"{number}"
+        )
+        assert output.count(LEGAL_NOTICE) == 1
+        assert "Evolución favorable." in output
+
+def test_letterhead_repeated_on_every_page_keeps_the_first_copy():
+    letterhead = "Dr. Rodolfo Gutiérrez Caro - Cardiología"
+    pages = [f"{letterhead}\nPágina con hallazgos {number}." for number in range(4)]
+    output = BoilerplateFilter().normalize(PAGE_SEPARATOR.join(pages))
+    assert output.count(letterhead) == 1
+    assert all(f"Página con hallazgos {number}." in output for number in range(4))
+
+def test_same_document_is_learned_once(tmp_path):
+    model_path = str(tmp_path / "modelo.json")
+    boilerplate_filter = BoilerplateFilter(model_path)
+    for _ in range(3):
+        boilerplate_filter.normalize(f"{LEGAL_NOTICE}\nHallazgos.", document_id="informe.txt", content_hash="h1", patient_id="111")
+    reloaded = BoilerplateFilter(model_path)
+    assert reloaded.observed_documents == {"informe.txt": "h1"}
+    assert all(len(patients) == 1 for patients in reloaded.segment_patients.values())
+
+def test_repair_text_splits_glued_tokens():
+    assert repair_text("FCmáximo130may") == "FCmáximo 130 may"
+    assert repair_text("cardiologÃ­a") == "cardiología"
+    assert repair_text("HbA1c 20mg") == "HbA1c 20mg"
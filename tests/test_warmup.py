@@ -0,0 +1,61 @@
+import os
+import subprocess
+import sys
+import threading
+
+from warmup import WARMUP_FAILED, WARMUP_PENDING, WARMUP_READY, Warmup
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_steps_run_in_order_in_a_background_thread():
+    warmup = Warmup()
+    release = threading.Event()
+    calls = []
+    warmup.add_step("modulos", lambda: calls.append(("modulos", threading.current_thread().name)))
+    warmup.add_step("indice", lambda: (release.wait(5), calls.append(("indice", threading.current_thread().name))))
+    assert warmup.to_dict()["estado"] == WARMUP_PENDING
+
+    warmup.start()
+    assert not warmup.wait(0.05)
+    state = warmup.to_dict()
+    assert (state["paso"], state["pasos_completados"], state["progreso"]) == ("indice", 1, 50)
+
+    release.set()
+    assert warmup.wait(5) and warmup.ready
+    assert calls == [("modulos", "calentamiento"), ("indice", "calentamiento")]
+    state = warmup.to_dict()
+    assert (state["estado"], state["paso"], state["progreso"]) == (WARMUP_READY, None, 100)
+
+def test_failed_step_stops_the_warmup():
+    warmup = Warmup()
+    calls = []
+    warmup.add_step("modulos", lambda: calls.append("modulos"))
+    warmup.add_step("indice", lambda: 1 / 0)
+    warmup.add_step("pdf", lambda: calls.append("pdf"))
+    warmup.start(background=False)
+    assert warmup.finished and not warmup.ready
+    state = warmup.to_dict()
+    assert (state["estado"], state["paso"], state["pasos_completados"]) == (WARMUP_FAILED, "indice", 1)
+    assert "division by zero" in state["error"]
+    assert calls == ["modulos"]
+
+def test_start_runs_only_once():
+    warmup = Warmup()
+    calls = []
+    warmup.add_step("modulos", lambda: calls.append(1))
+    warmup.start(background=False)
+    warmup.start(background=False)
+    assert calls == [1]
+
+def test_startup_modules_do_not_import_heavy_dependencies():
+    # Los módulos que app.py importa al arrancar no deben cargar LlamaIndex, Gemini, PyPDF2 ni ReportLab.
+    code = (
+        "import sys\n"
+        "import text_normalization, response_cache, ingestion_jobs, patient_registry, holter_metrics, intents\n"
+        "import engine_snapshot, index_versions, warmup, metrics\n"
+        "heavy = {'llama_index', 'google', 'PyPDF2', 'reportlab'}\n"
+        "print(sorted({name.split('.')[0] for name in sys.modules} & heavy))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
@@ -0,0 +1,221 @@
+import hashlib # Para obtener huellas compactas de los segmentos repetidos
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata # Para normalizar la composición de los caracteres acentuados
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# --- Reparación de caracteres mal decodificados y tokens pegados ---
+
+# Ligaduras tipográficas que PyPDF2 devuelve tal cual (ej. 'Ediﬁcio').
+# No se usa NFKC porque también transformaría 'º' en 'o' ('1ºA', 'eje 60º').
+LIGATURES = str.maketrans({"ﬀ": "ff", "ﬁ": "fi", "ﬂ": "fl", "ﬃ": "ffi", "ﬄ": "ffl", "ﬅ": "st", "ﬆ": "st"})
+# Palabras en las que el extractor de PDF deja el carácter de reemplazo U+FFFD en lugar de la vocal acentuada.
+REPLACEMENT_CHAR_FIXES = [
+    (re.compile(r"m�x", re.IGNORECASE), "máx"),
+    (re.compile(r"m�n", re.IGNORECASE), "mín"),
+    (re.compile(r"p�g", re.IGNORECASE), "pág"),
+]
+# Secuencias UTF-8 decodificadas como Latin-1/CP1252 (ej. 'cardiologÃ­a' -> 'cardiología').
+DOUBLE_ENCODED_PATTERN = re.compile(r"(?:[ÂÃ][\u0080-\u00bf\u0152-\u0178\u2013-\u203a\u20ac])+")
+# Tokens pegados por el extractor: 'FCmáximo130may' -> 'FCmáximo 130 may', 'confirmarALVAREZ' -> 'confirmar ALVAREZ'.
+# Se exigen al menos tres minúsculas para no romper abreviaturas como 'mg', 'HbA1c' o 'DM-II'.
+LOWER = "a-záéíóúñü"
+GLUED_LETTERS_DIGITS = re.compile(rf"(?<=[{LOWER}]{{3}})(?=\d)")
+GLUED_DIGITS_LETTERS = re.compile(rf"(?<=\d)(?=[{LOWER}]{{3}})")
+GLUED_LOWER_UPPER = re.compile(rf"(?<=[{LOWER}]{{3}})(?=[A-ZÁÉÍÓÚÑ])")
+
+# --- Segmentación en párrafos/frases para detectar texto repetido ---
+
+# Bloques: saltos de línea o dos o más espacios (separación típica entre columnas del membrete).
+BLOCK_SPLIT_PATTERN = re.compile(r"\n|[ \t]{2,}")
+# Frases dentro de un bloque: el aviso legal llega como un único párrafo de muchas frases.
+SENTENCE_SPLIT_PATTERN = re.compile(r"(?<=[.!?])\s+(?=[A-ZÁÉÍÓÚÑ¿¡])")
+# Separador de páginas que deja el extractor de PDF.
+PAGE_SEPARATOR = "\f"
+
+# Se incrementa al cambiar las reglas, para que los documentos ya indexados se vuelvan a normalizar.
+NORMALIZATION_VERSION = 2
+
+MIN_BOILERPLATE_CHARS = 8 # Segmentos más cortos ("1", "Dr.") no se consideran texto repetido
+LONG_BOILERPLATE_CHARS = 100 # El texto repetido a partir de esta longitud (avisos legales) se elimina de sus bloques
+PAGE_REPEAT_THRESHOLD = 3 # Apariciones en un mismo documento para considerarlo membrete o pie de página
+# Pacientes distintos en cuyos documentos debe aparecer para considerarlo plantilla: los antecedentes
+# que se copian de un informe de seguimiento al siguiente del mismo paciente no son plantilla.
+CROSS_PATIENT_THRESHOLD = 3
+MAX_LEARNED_SEGMENTS = 50000 # Tope de huellas guardadas; al superarlo se olvidan las vistas en un solo paciente
+MODEL_FORMAT_VERSION = 2 # Formato del JSON del modelo; uno anterior (conteo por documento) se descarta
+
+
+def repair_text(text):
+    """
+    Repara caracteres mal decodificados y separa tokens pegados por el extractor de PDF.
+    """
+    text = unicodedata.normalize("NFC", text).translate(LIGATURES)
+    text = DOUBLE_ENCODED_PATTERN.sub(_fix_double_encoded, text)
+    for pattern, replacement in REPLACEMENT_CHAR_FIXES:
+        text = pattern.sub(replacement, text)
+    text = GLUED_LETTERS_DIGITS.sub(" ", text)
+    text = GLUED_DIGITS_LETTERS.sub(" ", text)
+    text = GLUED_LOWER_UPPER.sub(" ", text)
+    return text
+
+def _fix_double_encoded(match):
+    fragment = match.group(0)
+    for encoding in ("cp1252", "latin-1"):
+        try:
+            return fragment.encode(encoding).decode("utf-8")
+        except UnicodeError:
+            continue
+    return fragment
+
+def split_segments(text):
+    """
+    Divide un texto en bloques y cada bloque en frases.
+    Devuelve una lista de bloques, cada uno con su lista de segmentos no vacíos.
+    """
+    blocks = []
+    for block in BLOCK_SPLIT_PATTERN.split(text):
+        segments = [segment.strip() for segment in SENTENCE_SPLIT_PATTERN.split(block)]
+        segments = [segment for segment in segments if segment]
+        if segments:
+            blocks.append(segments)
+    return blocks
+
+def segment_fingerprint(segment):
+    """
+    Huella de un segmento insensible a mayúsculas y espacios, para reconocer el mismo párrafo en otra página.
+    """
+    key = " ".join(segment.lower().split())
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+class BoilerplateFilter:
+    """
+    Aprende qué párrafos se repiten entre páginas y documentos (membretes, pies, avisos de protección
+    de datos) y los elimina antes de trocear y embeber el texto.
+
+    - Un segmento repetido en varias páginas del mismo documento, o presente en documentos de varios
+      pacientes, se considera plantilla y se conserva solo su primera aparición en el documento.
+    - Los fragmentos repetidos que comparten bloque con una copia eliminada de un texto largo (restos
+      del aviso legal partidos de otra forma en otra página) se eliminan con ella.
+    - Cualquier otra repetición exacta dentro del documento se deduplica.
+
+    Las huellas aprendidas (huella -> pacientes en los que apareció, hasta CROSS_PATIENT_THRESHOLD)
+    se guardan en un JSON para que el aprendizaje sobreviva a los reinicios.
+
+    El resultado depende del orden de ingesta: un documento se normaliza con lo aprendido hasta ese
+    momento, y los ya indexados no se vuelven a normalizar cuando el modelo aprende una plantilla
+    nueva. Solo se reindexan todos al cambiar NORMALIZATION_VERSION (forma parte del hash indexado).
+    """
+
+    def __init__(self, model_path=None):
+        self.model_path = model_path
+        self._lock = threading.Lock()
+        # Huella -> pacientes distintos en cuyos documentos apareció (como mucho CROSS_PATIENT_THRESHOLD).
+        self.segment_patients = {}
+        # Documento -> hash del contenido ya aprendido, para no contar dos veces el mismo documento.
+        self.observed_documents = {}
+        if model_path and os.path.exists(model_path):
+            try:
+                with open(model_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") == MODEL_FORMAT_VERSION:
+                    self.segment_patients = data.get("segments", {})
+                    self.observed_documents = data.get("documents", {})
+                else:
+                    logger.info(f"Modelo de texto repetido '{model_path}' en un formato anterior; se vuelve a aprender.")
+            except Exception as e:
+                logger.warning(f"No se pudo cargar el modelo de texto repetido '{model_path}': {e}")
+
+    def normalize(self, text, document_id=None, content_hash=None, patient_id=None):
+        """
+        Devuelve el texto reparado y sin párrafos repetidos.
+        Si se indica document_id, las huellas del documento se incorporan al aprendizaje entre
+        documentos, asociadas a patient_id (sin paciente, el documento cuenta como uno distinto).
+        """
+        pages = [repair_text(page) for page in text.split(PAGE_SEPARATOR)]
+        page_blocks = [split_segments(page) for page in pages]
+
+        fingerprints = {}
+        occurrences = Counter()
+        for blocks in page_blocks:
+            for segments in blocks:
+                for segment in segments:
+                    fingerprint = segment_fingerprint(segment)
+                    fingerprints[segment] = fingerprint
+                    occurrences[fingerprint] += 1
+
+        document_fingerprints = {
+            fingerprints[segment] for segment in fingerprints if len(segment) >= MIN_BOILERPLATE_CHARS
+        }
+        with self._lock:
+            if document_id is not None:
+                self._observe(document_id, content_hash, patient_id, document_fingerprints)
+            learned_counts = {fp: len(self.segment_patients.get(fp, ())) for fp in document_fingerprints}
+
+        seen = set()
+        output_pages = []
+        for blocks in page_blocks:
+            output_blocks = []
+            for segments in blocks:
+                boilerplate_flags = [
+                    len(segment) >= MIN_BOILERPLATE_CHARS and (
+                        occurrences[fingerprints[segment]] >= PAGE_REPEAT_THRESHOLD
+                        or learned_counts.get(fingerprints[segment], 0) >= CROSS_PATIENT_THRESHOLD
+                    )
+                    for segment in segments
+                ]
+                # Bloque con una copia repetida de un texto largo de plantilla (la primera se conserva).
+                block_repeats_long_boilerplate = any(
+                    flag and len(segment) >= LONG_BOILERPLATE_CHARS and fingerprints[segment] in seen
+                    for segment, flag in zip(segments, boilerplate_flags)
+                )
+                kept = []
+                for segment in segments:
+                    fingerprint = fingerprints[segment]
+                    if block_repeats_long_boilerplate and occurrences[fingerprint] > 1:
+                        continue
+                    if fingerprint in seen and len(segment) >= MIN_BOILERPLATE_CHARS:
+                        continue
+                    seen.add(fingerprint)
+                    kept.append(segment)
+                if kept:
+                    output_blocks.append(" ".join(kept))
+            if output_blocks:
+                output_pages.append("\n".join(output_blocks))
+        return "\n".join(output_pages)
+
+    def _observe(self, document_id, content_hash, patient_id, document_fingerprints):
+        if self.observed_documents.get(document_id) == content_hash:
+            return
+        self.observed_documents[document_id] = content_hash
+        patient_key = patient_id or f"documento:{document_id}"
+        for fingerprint in document_fingerprints:
+            patients = self.segment_patients.setdefault(fingerprint, [])
+            if len(patients) < CROSS_PATIENT_THRESHOLD and patient_key not in patients:
+                patients.append(patient_key)
+        if len(self.segment_patients) > MAX_LEARNED_SEGMENTS:
+            self.segment_patients = {
+                fp: patients for fp, patients in self.segment_patients.items() if len(patients) > 1
+            }
+        self._save()
+
+    def _save(self):
+        if not self.model_path:
+            return
+        try:
+            tmp_path = f"{self.model_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({
+                    "version": MODEL_FORMAT_VERSION,
+                    "segments": self.segment_patients,
+                    "documents": self.observed_documents,
+                }, f)
+            os.replace(tmp_path, self.model_path)
+        except Exception as e:
+            logger.warning(f"No se pudo guardar el modelo de texto repetido '{self.model_path}': {e}")
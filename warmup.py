@@ -0,0 +1,102 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Estados del calentamiento
+WARMUP_PENDING = "pendiente"
+WARMUP_RUNNING = "calentando"
+WARMUP_READY = "listo"
+WARMUP_FAILED = "error"
+
+
+class Warmup:
+    """
+    Calentamiento del proceso: pasos (importar los módulos pesados, preparar el PDF, cargar el
+    índice...) que se ejecutan en orden en un hilo propio después de importar la aplicación, para
+    que Flask responda desde el primer momento. El progreso se consulta en /ready.
+    """
+
+    def __init__(self):
+        self._steps = []
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._thread = None
+        self.status = WARMUP_PENDING
+        self.step = None
+        self.completed_steps = 0
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+
+    def add_step(self, name, fn):
+        self._steps.append((name, fn))
+
+    def start(self, background=True):
+        """
+        Ejecuta los pasos en un hilo (background=True) o en el hilo actual. Solo la primera vez.
+        """
+        with self._lock:
+            if self.status != WARMUP_PENDING:
+                return
+            self.status = WARMUP_RUNNING
+            self.started_at = time.time()
+        if background:
+            self._thread = threading.Thread(target=self._run, name="calentamiento", daemon=True)
+            self._thread.start()
+        else:
+            self._run()
+
+    def _run(self):
+        try:
+            for name, fn in self._steps:
+                with self._lock:
+                    self.step = name
+                started_at = time.perf_counter()
+                fn()
+                logger.info(f"Calentamiento: '{name}' completado en {time.perf_counter() - started_at:.2f} s.")
+                with self._lock:
+                    self.completed_steps += 1
+        except Exception as e:
+            logger.exception(f"El calentamiento falló en el paso '{self.step}': {e}")
+            with self._lock:
+                self.status = WARMUP_FAILED
+                self.error = str(e)
+        else:
+            with self._lock:
+                self.status = WARMUP_READY
+                self.step = None
+            logger.info(f"Proceso listo en {time.time() - self.started_at:.2f} s.")
+        finally:
+            with self._lock:
+                self.finished_at = time.time()
+            self._done.set()
+
+    @property
+    def ready(self):
+        return self.status == WARMUP_READY
+
+    @property
+    def finished(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Espera a que termine el calentamiento. Devuelve True si ha terminado (bien o con error).
+        """
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        with self._lock:
+            total = len(self._steps)
+            end = self.finished_at or time.time()
+            return {
+                "estado": self.status,
+                "paso": self.step,
+                "pasos_completados": self.completed_steps,
+                "pasos_totales": total,
+                "progreso": round(100 * self.completed_steps / total) if total else 100,
+                "segundos": round(end - self.started_at, 2) if self.started_at else 0,
+                "error": self.error,
+            }